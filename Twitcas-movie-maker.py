@@ -5,22 +5,2317 @@ import numpy as np
 import threading
 import time
 import os
+import sys
+import argparse
 from datetime import timedelta
+from collections import deque, OrderedDict
+import hashlib
+import re
+import bisect
+import queue
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 import subprocess
 from PIL import Image, ImageTk
 import json
+import platform
+import cProfile
+from dataclasses import asdict, dataclass, replace
+
+# OpenCVの補間方式に対応するffmpeg perspectiveフィルターの補間方式
+FFMPEG_PERSPECTIVE_INTERPOLATION = {
+    cv2.INTER_LINEAR: 'linear',
+    cv2.INTER_CUBIC: 'cubic',
+}
+
+# キャッシュの保存先（remapテーブルなど）
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.twitcas-movie-maker', 'cache')
+
+
+def get_cache_dir(*parts):
+    """キャッシュ用ディレクトリを返す（なければ作成）"""
+    path = os.path.join(CACHE_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class PerspectiveWarper:
+    """固定の台形補正を事前計算したremapテーブルで適用する
+    
+    補正の4点はジョブ中ずっと同じなので、各出力画素が参照する元画像の座標を
+    一度だけ計算し、cv2.convertMaps の固定小数点形式 (CV_16SC2 + 補間テーブル) に変換しておく。
+    テーブルは (元座標4点, 幅, 高さ, 補間方式) をキーにメモリとディスクにキャッシュする。
+    """
+    
+    MEMORY_CACHE_SIZE = 4   # メモリに保持するテーブル数
+    DISK_CACHE_SIZE = 8     # ディスクに保持するテーブル数
+    
+    _memory_cache = OrderedDict()
+    _cache_lock = threading.Lock()
+    
+    def __init__(self, src_points, width, height, interpolation=cv2.INTER_LINEAR, geometry=None,
+                 matrix=None, border_value=0):
+        self.src_points = np.float32(src_points)
+        self.width = int(width)
+        self.height = int(height)
+        self.interpolation = interpolation
+        self.border_value = border_value    # 補正で画像の外になった部分の値
+        
+        # 行列を直接指定した場合は width・height をそのまま出力サイズにする（YUVの色差面など）
+        self.explicit_matrix = matrix is not None
+        if self.explicit_matrix:
+            self.matrix = np.float64(matrix)
+        else:
+            dst_points = np.float32([
+                [0, 0],
+                [self.width, 0],
+                [0, self.height],
+                [self.width, self.height]
+            ])
+            self.matrix = cv2.getPerspectiveTransform(self.src_points, dst_points)
+        
+        # 出力の切り抜き・解像度は行列に織り込み、出力サイズのテーブルを直接作る
+        self.geometry = geometry if geometry is not None and not geometry.is_identity else None
+        if self.geometry is not None and not self.explicit_matrix:
+            self.matrix = self.geometry.matrix() @ self.matrix
+            self.width, self.height = self.geometry.output_size()
+        
+        self.map1, self.map2 = self._load_maps()
+    
+    @property
+    def cache_key(self):
+        """キャッシュキー（座標は小数第3位で丸める）"""
+        key = {
+            'src': [[round(float(x), 3), round(float(y), 3)] for x, y in self.src_points],
+            'size': [self.width, self.height],
+            'interpolation': int(self.interpolation),
+        }
+        if self.geometry is not None or self.explicit_matrix:
+            key['matrix'] = [round(float(v), 6) for v in self.matrix.flatten()]
+        key_source = json.dumps(key, sort_keys=True)
+        return hashlib.sha1(key_source.encode('utf-8')).hexdigest()
+    
+    def _cache_path(self):
+        return os.path.join(get_cache_dir('remap'), f"{self.cache_key}.npz")
+    
+    def _load_maps(self):
+        """メモリ → ディスク → 新規計算 の順にテーブルを取得"""
+        key = self.cache_key
+        with self._cache_lock:
+            if key in self._memory_cache:
+                self._memory_cache.move_to_end(key)
+                return self._memory_cache[key]
+        
+        maps = None
+        cache_path = self._cache_path()
+        if os.path.exists(cache_path):
+            try:
+                with np.load(cache_path) as data:
+                    map2 = data['map2'] if 'map2' in data.files else None
+                    maps = (data['map1'], map2)
+                print(f"remapテーブルをキャッシュから読み込み: {cache_path}")
+            except Exception as e:
+                print(f"remapテーブルの読み込みに失敗: {e}")
+        
+        if maps is None:
+            maps = self._build_maps()
+            self._save_maps(cache_path, maps)
+        
+        with self._cache_lock:
+            self._memory_cache[key] = maps
+            while len(self._memory_cache) > self.MEMORY_CACHE_SIZE:
+                self._memory_cache.popitem(last=False)
+        return maps
+    
+    def _build_maps(self):
+        """出力画素ごとの参照元座標を計算し、固定小数点形式に変換"""
+        start = time.time()
+        inverse = np.linalg.inv(self.matrix)
+        
+        xs = np.arange(self.width, dtype=np.float32)
+        ys = np.arange(self.height, dtype=np.float32)[:, np.newaxis]
+        
+        # 出力座標 (x, y, 1) に逆行列を掛けて元画像の座標を求める
+        denom = inverse[2, 0] * xs + inverse[2, 1] * ys + inverse[2, 2]
+        map_x = ((inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]) / denom).astype(np.float32)
+        map_y = ((inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]) / denom).astype(np.float32)
+        
+        map1, map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2,
+                                     nninterpolation=(self.interpolation == cv2.INTER_NEAREST))
+        print(f"remapテーブル作成: {self.width}x{self.height} ({time.time() - start:.2f}秒)")
+        return map1, map2
+    
+    def _save_maps(self, cache_path, maps):
+        """テーブルをディスクに保存し、古いキャッシュを整理"""
+        try:
+            map1, map2 = maps
+            temp_path = cache_path[:-len('.npz')] + '_tmp.npz'
+            if map2 is not None:
+                np.savez(temp_path, map1=map1, map2=map2)
+            else:
+                np.savez(temp_path, map1=map1)
+            os.replace(temp_path, cache_path)
+            
+            cache_files = sorted(
+                (os.path.join(os.path.dirname(cache_path), name)
+                 for name in os.listdir(os.path.dirname(cache_path)) if name.endswith('.npz')),
+                key=os.path.getmtime, reverse=True)
+            for old_path in cache_files[self.DISK_CACHE_SIZE:]:
+                os.remove(old_path)
+        except Exception as e:
+            print(f"remapテーブルの保存に失敗: {e}")
+    
+    def apply(self, frame, dst=None):
+        """フレームに台形補正を適用"""
+        return cv2.remap(frame, self.map1, self.map2, self.interpolation,
+                         dst=dst, borderMode=cv2.BORDER_CONSTANT, borderValue=self.border_value)
+
+
+class BandWarper:
+    """出力フレームを横方向の帯に分け、専用のスレッドプールで並列にremapする
+    
+    4Kなどの大きなフレームを1回のremapで処理すると、OpenCV内部の並列化とエンコーダーが
+    CPUを取り合うため、帯の数とスレッド数をこちらで決めて処理する。
+    帯ごとのremapテーブルは元のテーブルのスライス（コピーなし）で、出力は事前に確保した
+    buffer_count 枚のバッファへ順番に書き込むため、フレームごとのメモリ確保は発生しない。
+    返したバッファは buffer_count 回先の変換まで書き換えないので、呼び出し側は
+    同時に保持する変換結果の枚数以上を指定する。
+    """
+    
+    AUTO_MIN_PIXELS = 1920 * 1080 * 2   # 自動設定で帯に分ける出力画素数の下限
+    MIN_BAND_ROWS = 16                  # 1つの帯の最小行数
+    
+    # スレッドプールを使っている間は OpenCV 内部の並列化を止める（帯の数 × OpenCVのスレッド数にならないように）
+    _opencv_threads_lock = threading.Lock()
+    _active_pools = 0
+    _saved_opencv_threads = None
+    
+    def __init__(self, warper, bands, threads, buffer_count, executor=None):
+        self.warper = warper
+        self.width = warper.width
+        self.height = warper.height
+        self.bands = max(1, min(int(bands), self.height // self.MIN_BAND_ROWS))
+        self.threads = max(1, min(int(threads), self.bands))
+        
+        edges = np.linspace(0, self.height, self.bands + 1).astype(int)
+        self.band_maps = []
+        for top, bottom in zip(edges[:-1], edges[1:]):
+            map2 = warper.map2[top:bottom] if warper.map2 is not None else None
+            self.band_maps.append((slice(top, bottom), warper.map1[top:bottom], map2))
+        
+        self.buffer_count = max(1, int(buffer_count))
+        self.buffers = None     # 最初のフレームでチャンネル数・型に合わせて確保する
+        self.next_buffer = 0
+        self.lock = threading.Lock()
+        # 呼び出し元のスレッドも1つの帯を受け持つ（executor を渡した場合は共有して、閉じない）
+        self.owns_executor = executor is None
+        if executor is None and self.threads > 1:
+            executor = ThreadPoolExecutor(max_workers=self.threads - 1, thread_name_prefix='warp-band')
+        self.executor = executor
+        self.holds_opencv_threads = self.owns_executor and self.executor is not None
+        if self.holds_opencv_threads:
+            self._acquire_opencv_threads()
+    
+    @classmethod
+    def _acquire_opencv_threads(cls):
+        """最初のプールが作られたら OpenCV のスレッド数を1にする"""
+        with cls._opencv_threads_lock:
+            if cls._active_pools == 0:
+                cls._saved_opencv_threads = cv2.getNumThreads()
+                cv2.setNumThreads(1)
+            cls._active_pools += 1
+    
+    @classmethod
+    def _release_opencv_threads(cls):
+        """最後のプールが閉じられたら OpenCV のスレッド数を元に戻す"""
+        with cls._opencv_threads_lock:
+            cls._active_pools -= 1
+            if cls._active_pools == 0 and cls._saved_opencv_threads is not None:
+                cv2.setNumThreads(cls._saved_opencv_threads)
+                cls._saved_opencv_threads = None
+    
+    @classmethod
+    def auto_settings(cls, width, height, share=1):
+        """出力サイズとCPUコア数から (帯の数, スレッド数) を決める（小さいフレームは帯に分けない）
+        
+        share は同時に動くプロセスの数で、CPUコアをその数で分け合う。
+        """
+        threads = max(1, (os.cpu_count() or 1) // max(1, share))
+        bands = threads if width * height >= cls.AUTO_MIN_PIXELS else 1
+        return bands, threads
+    
+    def _acquire_buffer(self, frame):
+        with self.lock:
+            if self.buffers is None:
+                shape = (self.height, self.width) + frame.shape[2:]
+                self.buffers = [np.empty(shape, dtype=frame.dtype) for _ in range(self.buffer_count)]
+            buffer = self.buffers[self.next_buffer]
+            self.next_buffer = (self.next_buffer + 1) % self.buffer_count
+            return buffer
+    
+    def _remap_band(self, frame, output, band):
+        rows, map1, map2 = band
+        cv2.remap(frame, map1, map2, self.warper.interpolation,
+                  dst=output[rows], borderMode=cv2.BORDER_CONSTANT, borderValue=self.warper.border_value)
+    
+    def apply(self, frame):
+        """フレームに台形補正を適用（戻り値は使い回すバッファ）"""
+        output = self._acquire_buffer(frame)
+        self.apply_into(frame, output)
+        return output
+    
+    def apply_into(self, frame, output):
+        """指定の出力バッファへ台形補正を書き込む"""
+        if self.executor is None:
+            for band in self.band_maps:
+                self._remap_band(frame, output, band)
+            return
+        
+        futures = [self.executor.submit(self._remap_band, frame, output, band) for band in self.band_maps[1:]]
+        self._remap_band(frame, output, self.band_maps[0])
+        for future in futures:
+            future.result()
+    
+    def close(self):
+        if self.executor is not None and self.owns_executor:
+            self.executor.shutdown(wait=True)
+        if self.holds_opencv_threads:
+            self.holds_opencv_threads = False
+            self._release_opencv_threads()
+
+
+class YuvWarper:
+    """yuv420p (I420) のフレームを色変換せずに台形補正する
+    
+    フレームは縦 height*3/2・横 width の1枚の配列（Y面の後にU面・V面が続く）として扱う。
+    Y面は元の解像度のremapテーブルで、U・V面は縦横半分の座標系に移した行列 D·M·D⁻¹ で作った
+    テーブルで補正する（D は輝度の座標を色差サンプルの座標に移す変換で、色差サンプルの位置
+    chroma_location によって平行移動が変わる）。BGRの3面に比べて
+    扱うバイト数は半分になる。出力は BandWarper と同じく buffer_count 枚のバッファを順番に使い回す。
+    """
+    
+    BORDER_LUMA = 16        # 画像の外になった部分の値（リミテッドレンジの黒）
+    BORDER_CHROMA = 128
+    
+    # 色差サンプルの位置（ffprobeの chroma_location）ごとの、輝度→色差の座標変換の平行移動 (横, 縦)
+    # H.264・MPEG-2のyuv420pは指定がなければ left（横は偶数列の輝度と同じ位置、縦は2行の中間）
+    CHROMA_OFFSETS = {
+        'left': (0.0, -0.25),
+        'center': (-0.25, -0.25),
+        'topleft': (0.0, 0.0),
+        'top': (-0.25, 0.0),
+        'bottomleft': (0.0, -0.5),
+        'bottom': (-0.25, -0.5),
+    }
+    DEFAULT_CHROMA_LOCATION = 'left'
+    
+    @classmethod
+    def luma_to_chroma(cls, chroma_location):
+        """輝度の座標 → 色差の座標 の変換行列 D"""
+        offset_x, offset_y = cls.CHROMA_OFFSETS.get(chroma_location,
+                                                    cls.CHROMA_OFFSETS[cls.DEFAULT_CHROMA_LOCATION])
+        return np.array([[0.5, 0.0, offset_x],
+                         [0.0, 0.5, offset_y],
+                         [0.0, 0.0, 1.0]])
+    
+    def __init__(self, src_points, width, height, buffer_count, geometry=None, bands=1, threads=1,
+                 chroma_location=DEFAULT_CHROMA_LOCATION):
+        if width % 2 or height % 2:
+            raise ValueError(f"yuv420pでは幅・高さが偶数である必要があります: {width}x{height}")
+        self.source_width = int(width)
+        self.source_height = int(height)
+        
+        self.luma = PerspectiveWarper(src_points, width, height, geometry=geometry, border_value=self.BORDER_LUMA)
+        self.width, self.height = self.luma.width, self.luma.height
+        if self.width % 2 or self.height % 2:
+            raise ValueError(f"yuv420pでは出力の幅・高さが偶数である必要があります: {self.width}x{self.height}")
+        
+        self.matrix = self.luma.matrix
+        luma_to_chroma = self.luma_to_chroma(chroma_location)
+        chroma_matrix = luma_to_chroma @ self.matrix @ np.linalg.inv(luma_to_chroma)
+        self.chroma = PerspectiveWarper(src_points, self.width // 2, self.height // 2,
+                                        matrix=chroma_matrix, border_value=self.BORDER_CHROMA)
+        
+        # Y面と色差面で帯分割のスレッドプールを共有する
+        self.luma_bands = BandWarper(self.luma, bands, threads, 1)
+        self.chroma_bands = BandWarper(self.chroma, bands, threads, 1, executor=self.luma_bands.executor)
+        self.bands = self.luma_bands.bands
+        self.threads = self.luma_bands.threads
+        
+        self.frame_bytes = self.width * self.height * 3 // 2
+        self.buffers = [np.empty((self.height * 3 // 2, self.width), dtype=np.uint8)
+                        for _ in range(max(1, int(buffer_count)))]
+        self.next_buffer = 0
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def split_planes(frame, width, height):
+        """I420の配列をY・U・V面のビューに分ける（コピーなし）"""
+        flat = frame.reshape(-1)
+        luma_size = width * height
+        chroma_size = luma_size // 4
+        y = flat[:luma_size].reshape(height, width)
+        u = flat[luma_size:luma_size + chroma_size].reshape(height // 2, width // 2)
+        v = flat[luma_size + chroma_size:luma_size + chroma_size * 2].reshape(height // 2, width // 2)
+        return y, u, v
+    
+    def apply(self, frame):
+        """I420のフレームに台形補正を適用（戻り値は使い回すバッファ）"""
+        with self.lock:
+            output = self.buffers[self.next_buffer]
+            self.next_buffer = (self.next_buffer + 1) % len(self.buffers)
+        
+        src_y, src_u, src_v = self.split_planes(frame, self.source_width, self.source_height)
+        dst_y, dst_u, dst_v = self.split_planes(output, self.width, self.height)
+        self.luma_bands.apply_into(src_y, dst_y)
+        self.chroma_bands.apply_into(src_u, dst_u)
+        self.chroma_bands.apply_into(src_v, dst_v)
+        return output
+    
+    def close(self):
+        self.chroma_bands.close()
+        self.luma_bands.close()
+
+
+class YuvFrameReader:
+    """ffmpegで指定範囲をyuv420pの生フレームとしてデコードし、1フレームずつ返す
+    
+    cv2.VideoCapture はBGRに変換して返すため、YUVのまま補正する経路ではこちらを使う。
+    read() は縦 height*3/2・横 width の配列を返し、終端ではNoneを返す。
+    """
+    
+    def __init__(self, video_path, start_time, end_time, width, height):
+        self.width = width
+        self.height = height
+        self.frame_bytes = width * height * 3 // 2
+        
+        cmd = ['ffmpeg', '-v', 'error', '-nostdin']
+        cmd.extend(build_input_seek_args(video_path, start_time, end_time))
+        # フレームの複製・間引きをせず、デコードした順にそのまま出力する
+        cmd.extend(['-map', '0:v:0', '-an', '-sn', '-dn', '-fps_mode', 'passthrough',
+                    '-f', 'rawvideo', '-pix_fmt', 'yuv420p', '-'])
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+        self.stderr_thread, self.stderr_tail = start_stderr_reader(self.process)
+    
+    def read(self):
+        frame = np.empty((self.height * 3 // 2, self.width), dtype=np.uint8)
+        if self.process.stdout.readinto(memoryview(frame).cast('B')) < self.frame_bytes:
+            return None
+        return frame
+    
+    @property
+    def error_text(self):
+        return b''.join(self.stderr_tail).decode('utf-8', errors='ignore')
+    
+    def close(self):
+        """デコードを止めてプロセスを片付ける"""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+        self.stderr_thread.join(timeout=5)
+
+
+@dataclass
+class OutputGeometry:
+    """出力の切り抜き・縦横比・解像度（台形補正後の元動画サイズの座標系で指定）
+    
+    切り抜き → 縦横比に合わせた中央の切り抜き → 出力解像度への拡大縮小 を1つの行列にまとめ、
+    台形補正の行列に掛け合わせることで、1回の再サンプリングで最終的な画像を作る。
+    """
+    source_width: int
+    source_height: int
+    crop: tuple = None          # (x, y, 幅, 高さ)
+    aspect: tuple = None        # (横, 縦) 例: (9, 16)
+    target_width: int = 0       # 0 なら切り抜きの縦横比から決める
+    target_height: int = 0
+    short_side: int = 0         # 短辺の長さ（720pなら720）。target_width/height が優先
+    
+    @property
+    def is_identity(self):
+        return (self.crop is None and self.aspect is None and not self.target_width
+                and not self.target_height and not self.short_side)
+    
+    def crop_rect(self):
+        """切り抜き範囲 (x, y, 幅, 高さ) を返す（縦横比の指定があれば中央に合わせて狭める）"""
+        if self.crop is not None:
+            x, y, w, h = (float(v) for v in self.crop)
+            x = min(max(x, 0.0), self.source_width - 1.0)
+            y = min(max(y, 0.0), self.source_height - 1.0)
+            w = min(max(w, 1.0), self.source_width - x)
+            h = min(max(h, 1.0), self.source_height - y)
+        else:
+            x, y, w, h = 0.0, 0.0, float(self.source_width), float(self.source_height)
+        
+        if self.aspect is not None:
+            ratio = self.aspect[0] / self.aspect[1]
+            if w / h > ratio:
+                new_w = h * ratio
+                x += (w - new_w) / 2
+                w = new_w
+            else:
+                new_h = w / ratio
+                y += (h - new_h) / 2
+                h = new_h
+        return x, y, w, h
+    
+    def output_size(self):
+        """出力解像度（yuv420p で扱えるよう偶数に丸める）"""
+        if self.is_identity:
+            return self.source_width, self.source_height
+        
+        _, _, w, h = self.crop_rect()
+        if self.target_width and self.target_height:
+            out_w, out_h = self.target_width, self.target_height
+        elif self.target_width:
+            out_w, out_h = self.target_width, self.target_width * h / w
+        elif self.target_height:
+            out_w, out_h = self.target_height * w / h, self.target_height
+        elif self.short_side:
+            scale = self.short_side / min(w, h)
+            out_w, out_h = w * scale, h * scale
+        else:
+            out_w, out_h = w, h
+        return max(2, int(round(out_w / 2)) * 2), max(2, int(round(out_h / 2)) * 2)
+    
+    def matrix(self):
+        """台形補正後の座標を出力座標に移す行列（切り抜き位置への平行移動と拡大縮小）"""
+        x, y, w, h = self.crop_rect()
+        out_w, out_h = self.output_size()
+        return np.array([
+            [out_w / w, 0, -x * out_w / w],
+            [0, out_h / h, -y * out_h / h],
+            [0, 0, 1],
+        ], dtype=np.float64)
+
+
+# 出力サイズ設定の選択肢（解像度は短辺の長さ）
+OUTPUT_RESOLUTIONS = {"元のまま": 0, "2160p": 2160, "1080p": 1080, "720p": 720, "480p": 480}
+OUTPUT_ASPECTS = {"元のまま": None, "16:9": (16, 9), "9:16": (9, 16), "1:1": (1, 1), "4:3": (4, 3)}
+
+# スマートカットで端のGOPを再エンコードするエンコーダー（元動画のコーデックごと）
+SMART_CUT_ENCODERS = {
+    'h264': ['h264_nvenc', 'h264_qsv', 'libx264'],
+    'hevc': ['hevc_nvenc', 'hevc_qsv', 'libx265'],
+}
+
+# ffprobeのlevelをエンコーダーの -level に渡す値へ変換する係数（コーデックごと）
+SMART_CUT_LEVEL_SCALE = {'h264': 10, 'hevc': 30}
+
+# 同時に使えるNVENCセッション数（一般向けGPUのドライバー制限）
+NVENC_MAX_SESSIONS = 3
+
+# 重複フレームを削除して可変フレームレートで出力するffmpegの引数
+DUPLICATE_DROP_ARGS = ['-vf', 'mpdecimate', '-fps_mode', 'vfr']
+
+# 再開可能な書き出しのセグメント記録の形式と、1セグメントの目安の長さ（秒）
+SEGMENT_MANIFEST_VERSION = 1
+CHECKPOINT_SECONDS = 60
+
+
+def start_stderr_reader(process, max_lines=50):
+    """stderrを別スレッドで読み続け、末尾の行だけを保持する（パイプ詰まりによるデッドロック防止）"""
+    stderr_tail = deque(maxlen=max_lines)
+    
+    def read_stderr():
+        for line in iter(process.stderr.readline, b''):
+            stderr_tail.append(line)
+    
+    thread = threading.Thread(target=read_stderr)
+    thread.daemon = True
+    thread.start()
+    return thread, stderr_tail
+
+
+class FFmpegProgress:
+    """ffmpegを -progress 付きで起動し、進捗を別スレッドで逐次読み取る
+    
+    stdoutに出力される key=value 形式の進捗から out_time_us・fps・speed を取り出し、
+    1ブロック（progress=continue/end）ごとに callback(percent, fps, speed, eta_seconds) を呼ぶ。
+    stderrは末尾の一定行数だけをリングバッファに保持する（エラー報告用）。
+    """
+    
+    STDERR_LINES = 200
+    
+    def __init__(self, cmd, duration, callback=None, stdin=None):
+        self.duration = duration
+        self.callback = callback
+        self.stderr_tail = deque(maxlen=self.STDERR_LINES)
+        self.frames = 0         # エンコード済みフレーム数
+        self.total_size = 0     # 出力済みバイト数
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        
+        # -progress はグローバルオプションなのでコマンド名の直後に入れる
+        cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + list(cmd[1:])
+        self.process = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+        
+        self.progress_thread = threading.Thread(target=self._read_progress)
+        self.progress_thread.daemon = True
+        self.progress_thread.start()
+        self.stderr_thread = threading.Thread(target=self._read_stderr)
+        self.stderr_thread.daemon = True
+        self.stderr_thread.start()
+    
+    @property
+    def stdin(self):
+        return self.process.stdin
+    
+    def _read_progress(self):
+        values = {}
+        for raw_line in iter(self.process.stdout.readline, b''):
+            key, _, value = raw_line.decode('utf-8', errors='ignore').strip().partition('=')
+            if key != 'progress':
+                values[key] = value
+                continue
+            
+            # 1ブロック分揃ったら通知
+            out_time_us = values.get('out_time_us', values.get('out_time_ms', 'N/A'))
+            out_time = int(out_time_us) / 1000000.0 if out_time_us.lstrip('-').isdigit() else 0.0
+            fps = parse_float(values.get('fps'))
+            speed = parse_float(values.get('speed', '').rstrip('x'))
+            self.frames = int(parse_float(values.get('frame'), self.frames))
+            self.total_size = int(parse_float(values.get('total_size'), self.total_size))
+            
+            percent = min(100.0, out_time / self.duration * 100) if self.duration > 0 else 0.0
+            if value == 'end':
+                percent = 100.0
+            eta = (self.duration - out_time) / speed if speed > 0 else None
+            if self.callback is not None:
+                self.callback(percent, fps, speed, eta)
+    
+    def _read_stderr(self):
+        for line in iter(self.process.stderr.readline, b''):
+            self.stderr_tail.append(line)
+    
+    @property
+    def returncode(self):
+        return self.process.returncode
+    
+    @property
+    def error_text(self):
+        """stderrの末尾"""
+        return b''.join(self.stderr_tail).decode('utf-8', errors='ignore')
+    
+    def output_error(self, output_path):
+        """失敗していればその内容、成功ならNone（戻り値が0でも出力が未作成・空なら失敗とみなす）"""
+        if self.process.returncode != 0:
+            return self.error_text
+        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+            return f"出力ファイルが作成されていません: {output_path}"
+        return None
+    
+    def wait(self):
+        """終了を待って戻り値を返す"""
+        self.process.wait()
+        self.elapsed = time.perf_counter() - self.started
+        self.progress_thread.join(timeout=5)
+        self.stderr_thread.join(timeout=5)
+        return self.process.returncode
+    
+    def kill(self):
+        if self.process.poll() is None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+
+
+def build_input_seek_args(video_path, start_time, end_time):
+    """入力側シークで範囲指定した入力引数を作成
+    
+    -ss を -i の前に置くとffmpegは開始位置直前のキーフレームへ直接シークし、
+    -accurate_seek によりそこから開始位置までのフレームはデコードだけして捨てるため、
+    切り抜き位置は出力側シーク（先頭から全デコード）と同じになる。
+    """
+    return ['-ss', str(start_time), '-accurate_seek', '-t', str(end_time - start_time), '-i', video_path]
+
+
+def build_rawvideo_encode_command(output_path, width, height, fps, encoder, quality_settings,
+                                  pix_fmt='bgr24', audio_args=None, drop_duplicates=False):
+    """標準入力の生フレームをエンコードするffmpegコマンドを作成
+    
+    audio_args に元動画の入力引数（build_input_seek_args の戻り値など）を渡すと、その音声も同時に結合する。
+    drop_duplicates を指定すると重複フレームを削除して可変フレームレートで出力する。
+    """
+    cmd = ['ffmpeg', '-y',
+           # 入力0: パイプ経由の補正済みフレーム
+           '-f', 'rawvideo', '-pix_fmt', pix_fmt,
+           '-s', f"{width}x{height}", '-framerate', str(fps),
+           '-i', '-']
+    
+    # 入力1: 元動画（音声用）
+    if audio_args:
+        cmd.extend(audio_args)
+    
+    # 重複フレームの削除
+    if drop_duplicates:
+        cmd.extend(DUPLICATE_DROP_ARGS)
+    
+    # エンコーダー設定
+    cmd.extend(['-c:v', encoder])
+    
+    # 品質設定
+    if quality_settings:
+        cmd.extend(quality_settings)
+    
+    # 音声設定とマッピング
+    if audio_args:
+        cmd.extend([
+            '-c:a', 'copy',
+            '-map', '0:v:0',  # パイプ入力の映像（台形補正済み）
+            '-map', '1:a:0?',  # 元動画の音声（?で音声がない場合も許可）
+        ])
+    else:
+        cmd.append('-an')
+    
+    cmd.extend(['-pix_fmt', 'yuv420p', output_path])
+    return cmd
+
+
+# 処理の内訳の表示名
+STAGE_LABELS = {
+    'decode': "デコード",
+    'warp': "台形補正",
+    'write': "書き出し (OpenCV)",
+    'pipe': "エンコーダーへ送信",
+    'encode': "ffmpegエンコード",
+    'edge_encode': "端GOPの再エンコード",
+    'stream_copy': "ストリームコピー",
+    'mux': "連結・音声結合",
+    'segments': "並列セグメント全体",
+    'queue_wait_read': "キュー待ち (読み込み側)",
+    'queue_wait_write': "キュー待ち (書き出し側)",
+    'static_check': "静止フレームの判定",
+    'static_skip': "静止フレームで補正を省略",
+    'duplicate_drop': "重複フレームを削除",
+}
+
+# JobMetrics.note() で記録する設定の表示名
+SETTING_LABELS = {
+    'warp_bands': "変換の帯",
+    'warp_threads': "帯の変換スレッド",
+    'pipeline_workers': "変換スレッド",
+    'pixel_format': "画素形式",
+}
+
+
+class JobMetrics:
+    """処理段階ごとの累計時間・フレーム数・バイト数を集計する
+    
+    record() はロックを取って加算するだけなので、毎フレーム呼んでも負荷は小さい。
+    path を指定すると JSON Lines 形式で開始・途中経過（SNAPSHOT_INTERVAL ごと）・終了を書き出す。
+    """
+    
+    SNAPSHOT_INTERVAL = 1.0
+    
+    def __init__(self, path=None, info=None):
+        self.path = path
+        self.stages = {}    # 段階名 -> [累計秒, 回数, バイト数]
+        self.settings = {}  # 処理の設定（変換の帯の数など）
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.last_snapshot = self.started
+        self.closed = False
+        self.file = None
+        if path:
+            self.file = open(path, 'w', encoding='utf-8')
+            self._write_event('start', info=info or {})
+    
+    @staticmethod
+    def create_path(output_path):
+        """ジョブごとのメトリクスファイルのパス（キャッシュフォルダの metrics/ に作成）"""
+        name = os.path.splitext(os.path.basename(output_path))[0]
+        return os.path.join(get_cache_dir('metrics'), f"{time.strftime('%Y%m%d-%H%M%S')}_{name}.jsonl")
+    
+    def record(self, stage, seconds, count=1, nbytes=0):
+        with self.lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = [0.0, 0, 0]
+            entry[0] += seconds
+            entry[1] += count
+            entry[2] += nbytes
+            
+            now = time.perf_counter()
+            if self.file is None or now - self.last_snapshot < self.SNAPSHOT_INTERVAL:
+                return
+            self.last_snapshot = now
+            self._write_event('snapshot')
+    
+    def note(self, **settings):
+        """処理の設定を記録（スナップショットと内訳の表に含める）"""
+        with self.lock:
+            self.settings.update(settings)
+    
+    def record_process(self, stage, process):
+        """終了したFFmpegProgressの実行時間・フレーム数・出力バイト数を記録"""
+        self.record(stage, process.elapsed, process.frames, process.total_size)
+    
+    def merge(self, stages):
+        """別プロセスで集計した {段階名: [秒, 回数, バイト数]} を加える"""
+        for stage, (seconds, count, nbytes) in stages.items():
+            self.record(stage, seconds, count, nbytes)
+    
+    def timed(self, stage, func):
+        """呼ぶたびに時間を記録する func のラッパーを返す
+        
+        バイト数・回数は戻り値（Noneなら第1引数）のフレームから数える。
+        """
+        def wrapper(*args):
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - start
+            frame = result if result is not None else (args[0] if args else None)
+            self.record(stage, elapsed, 1 if frame is not None else 0, getattr(frame, 'nbytes', 0))
+            return result
+        return wrapper
+    
+    def _snapshot(self):
+        """現在の集計値（呼び出し側でロックを取る）"""
+        stages = {stage: {'seconds': round(seconds, 6), 'count': count, 'bytes': nbytes}
+                  for stage, (seconds, count, nbytes) in self.stages.items()}
+        return {'elapsed': round(time.perf_counter() - self.started, 6), 'stages': stages,
+                'settings': dict(self.settings)}
+    
+    def snapshot(self):
+        with self.lock:
+            return self._snapshot()
+    
+    def _write_event(self, event, **fields):
+        """1行分のイベントを書き出す（呼び出し側でロックを取る）"""
+        line = {'event': event, 'time': time.time()}
+        line.update(self._snapshot())
+        line.update(fields)
+        try:
+            self.file.write(json.dumps(line, ensure_ascii=False) + '\n')
+            self.file.flush()
+        except (OSError, ValueError) as e:
+            print(f"メトリクスの書き込みに失敗: {e}")
+    
+    def format_table(self):
+        """処理の内訳を表示用の文字列にする"""
+        snapshot = self.snapshot()
+        lines = [f"経過 {snapshot['elapsed']:.1f}秒"]
+        if snapshot['settings']:
+            lines.append(' / '.join(f"{SETTING_LABELS.get(name, name)} {value}"
+                                    for name, value in snapshot['settings'].items()))
+        for stage, values in sorted(snapshot['stages'].items(), key=lambda item: -item[1]['seconds']):
+            line = f"{STAGE_LABELS.get(stage, stage):<20} {values['seconds']:8.2f}秒"
+            if values['count']:
+                line += f" {values['count']:7d}回 {values['seconds'] / values['count'] * 1000:7.2f}ms"
+            if values['bytes']:
+                line += f" {values['bytes'] / (1024 * 1024):9.1f}MB"
+            lines.append(line)
+        
+        for stage, ratio in self.frame_ratios(snapshot).items():
+            lines.append(f"{STAGE_LABELS.get(stage, stage)}: 全フレームの {ratio:.1%}")
+        return '\n'.join(lines)
+    
+    def frame_ratios(self, snapshot):
+        """デコードしたフレームのうち、補正を省略・削除したフレームの割合"""
+        stages = snapshot['stages']
+        decoded = stages.get('decode', {}).get('count', 0)
+        if not decoded:
+            return {}
+        return {stage: stages[stage]['count'] / decoded
+                for stage in ('static_skip', 'duplicate_drop') if stage in stages}
+    
+    def close(self, **result):
+        """終了を記録してファイルを閉じる"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            if self.file is not None:
+                self._write_event('end', ratios=self.frame_ratios(self._snapshot()), **result)
+                self.file.close()
+
+
+class StaticFrameDetector:
+    """縮小したサムネイルの差分で、前回補正したフレームから変化していないフレームを検出する
+    
+    間引き + INTER_AREA で THUMBNAIL_SIZE のグレースケールに縮小して比較するため、1フレームあたりの負荷は小さい。
+    画素の差の最大値が threshold 以下なら変化なしとみなす（エンコードのノイズは縮小で平均化される）。
+    比較相手は直前のフレームではなく最後に補正したフレームなので、ゆっくりした変化も積み重なれば検出できる。
+    """
+    
+    THUMBNAIL_SIZE = (64, 36)
+    THRESHOLD = 3
+    
+    def __init__(self, threshold=None):
+        self.threshold = self.THRESHOLD if threshold is None else threshold
+        self.reference = None
+    
+    def reset(self):
+        """シークなどで連続しなくなったときに比較相手を捨てる"""
+        self.reference = None
+    
+    def is_static(self, frame):
+        """変化していなければTrue（Falseのときはこのフレームが新しい比較相手になる）"""
+        step = max(1, frame.shape[1] // (self.THUMBNAIL_SIZE[0] * 4))
+        small = cv2.resize(frame[::step, ::step], self.THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        
+        if self.reference is not None and int(cv2.absdiff(small, self.reference).max()) <= self.threshold:
+            return True
+        self.reference = small
+        return False
+
+
+class FramePipeline:
+    """フレームの読み込み → 変換 → 書き出しを別スレッドで並行させる
+    
+    読み込みスレッドが変換をスレッドプールへ投入し、書き出しスレッドが投入順に
+    結果を受け取るため、フレームの順序は保たれる。OpenCVの処理中はGILが解放されるので
+    変換はスレッドで並列化できる。読み込み済みで未書き出しのフレーム数は
+    メモリ上限から決めたキューの長さで制限する。
+    """
+    
+    MEMORY_BUDGET = 512 * 1024 * 1024
+    STATUS_INTERVAL = 0.5
+    
+    def __init__(self, read_frame, transform, write_frame, frame_count, frame_bytes,
+                 workers=None, memory_budget=None, metrics=None, is_static=None):
+        self.read_frame = read_frame
+        self.transform = transform
+        self.write_frame = write_frame
+        self.frame_count = frame_count
+        self.metrics = metrics
+        # is_static(frame) がTrueのフレームは変換せず、直前の変換結果をそのまま書き出す
+        self.is_static = is_static
+        self.static_count = 0
+        
+        self.capacity, self.workers = self.plan(frame_bytes, memory_budget, workers)
+        
+        self.pending = queue.Queue(maxsize=self.capacity)
+        self.stop_event = threading.Event()
+        self.read_count = 0
+        self.written_count = 0
+        self.error = None
+    
+    @classmethod
+    def plan(cls, frame_bytes, memory_budget=None, workers=None):
+        """メモリ上限からキューの長さと変換スレッド数を決める"""
+        # 変換前と変換後の2枚分を1フレームの使用量とみなす
+        budget = memory_budget or cls.MEMORY_BUDGET
+        capacity = max(2, budget // max(1, frame_bytes * 2))
+        return capacity, max(1, min(workers or os.cpu_count() or 1, capacity))
+    
+    @classmethod
+    def max_outputs_in_use(cls, frame_bytes, memory_budget=None, workers=None):
+        """同時に存在しうる変換結果の枚数（キュー内・変換中・書き出し中）"""
+        capacity, workers = cls.plan(frame_bytes, memory_budget, workers)
+        return capacity + workers + 2
+    
+    def depths(self):
+        """各段の待ち行列の長さ（変換待ち・書き出し待ち）。どの段が詰まっているかの確認用"""
+        with self.pending.mutex:
+            futures = list(self.pending.queue)
+        waiting_write = sum(1 for future in futures if future is not None and future.done())
+        waiting_warp = sum(1 for future in futures if future is not None) - waiting_write
+        return {'warp': waiting_warp, 'write': waiting_write, 'capacity': self.capacity}
+    
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stop_event.set()
+    
+    def _put(self, item):
+        """キューに空きができるまで待つ（停止したら諦める）"""
+        start = time.perf_counter()
+        while not self.stop_event.is_set():
+            try:
+                self.pending.put(item, timeout=0.1)
+                if self.metrics is not None:
+                    self.metrics.record('queue_wait_read', time.perf_counter() - start)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _read_loop(self, executor):
+        previous = None
+        try:
+            while self.read_count < self.frame_count and not self.stop_event.is_set():
+                frame = self.read_frame()
+                if frame is None:
+                    break
+                if self.transform is None:
+                    future = Future()
+                    future.set_result(frame)
+                elif self.is_static is not None and self.is_static(frame) and previous is not None:
+                    future = previous
+                    self.static_count += 1
+                    if self.metrics is not None:
+                        self.metrics.record('static_skip', 0.0)
+                else:
+                    future = executor.submit(self.transform, frame)
+                previous = future
+                if not self._put(future):
+                    break
+                self.read_count += 1
+        except Exception as e:
+            self.fail(e)
+        finally:
+            # 終端の目印
+            self._put(None)
+    
+    def _write_loop(self):
+        try:
+            start = time.perf_counter()
+            while True:
+                try:
+                    future = self.pending.get(timeout=0.1)
+                except queue.Empty:
+                    if self.stop_event.is_set():
+                        break
+                    continue
+                frame = future.result() if future is not None else None
+                if self.metrics is not None:
+                    # 変換待ちも含めて、書き出し側が前段を待っていた時間
+                    self.metrics.record('queue_wait_write', time.perf_counter() - start)
+                if future is None:
+                    break
+                self.write_frame(frame)
+                self.written_count += 1
+                start = time.perf_counter()
+        except Exception as e:
+            self.fail(e)
+    
+    def run(self, on_status=None):
+        """全フレームを処理し、書き出したフレーム数を返す
+        
+        on_status(書き出し済みフレーム数, depths()) は STATUS_INTERVAL ごとに呼ばれる。
+        途中でエラーが起きた場合は self.error に保持して止まる。
+        """
+        # スレッド名は py-spy などで段階を見分けられるように付ける
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='pipeline-warp') as executor:
+            reader = threading.Thread(target=self._read_loop, args=(executor,), name='pipeline-decode')
+            writer = threading.Thread(target=self._write_loop, name='pipeline-write')
+            reader.daemon = True
+            writer.daemon = True
+            reader.start()
+            writer.start()
+            
+            while writer.is_alive():
+                writer.join(self.STATUS_INTERVAL)
+                if on_status is not None:
+                    on_status(self.written_count, self.depths())
+            
+            self.stop_event.set()
+            reader.join()
+        return self.written_count
+
+
+def file_signature(path):
+    """パス・サイズ・更新時刻からファイルの識別子を作成（キャッシュキー用）"""
+    stat = os.stat(path)
+    key_source = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(key_source.encode('utf-8')).hexdigest()
+
+
+class PacketIndex:
+    """映像パケットの索引（表示時刻・キーフレームフラグ）
+    
+    ffprobeでコンテナのパケットを一度だけ走査し、numpy配列のまま .npz に保存する。
+    キャッシュはファイルのパス・サイズ・更新時刻をキーにするため、ファイルが変われば作り直される。
+    時刻はすべて先頭フレームを0秒とした秒数。
+    """
+    
+    FORMAT_VERSION = 2
+    SEEK_RETRIES = 3        # 目的のフレームを通り過ぎたとき、さらに前のキーフレームからやり直す回数
+    MEMORY_CACHE_SIZE = 8   # メモリに保持する索引数
+    
+    _memory_cache = OrderedDict()
+    _cache_lock = threading.Lock()
+    _build_lock = threading.Lock()
+    
+    def __init__(self, pts, keyframe, stream_start, format_start):
+        # 表示順（pts順）に並べ替えて保持
+        order = np.argsort(pts, kind='stable')
+        self.pts = pts[order]
+        self.keyframe = keyframe[order]
+        self.stream_start = float(stream_start)
+        self.format_start = float(format_start)
+        
+        self.keyframe_frames = np.flatnonzero(self.keyframe)
+        self.keyframe_times = self.pts[self.keyframe_frames]
+    
+    @property
+    def frame_count(self):
+        return len(self.pts)
+    
+    @staticmethod
+    def _cache_path(video_path):
+        return os.path.join(get_cache_dir('index'), f"{file_signature(video_path)}.npz")
+    
+    @classmethod
+    def _remember(cls, signature, index):
+        """メモリキャッシュに追加（古いものから破棄）"""
+        with cls._cache_lock:
+            cls._memory_cache[signature] = index
+            cls._memory_cache.move_to_end(signature)
+            while len(cls._memory_cache) > cls.MEMORY_CACHE_SIZE:
+                cls._memory_cache.popitem(last=False)
+    
+    @classmethod
+    def get_cached(cls, video_path):
+        """作成済みの索引を返す（未作成ならNone、走査はしない）"""
+        try:
+            signature = file_signature(video_path)
+            with cls._cache_lock:
+                if signature in cls._memory_cache:
+                    cls._memory_cache.move_to_end(signature)
+                    return cls._memory_cache[signature]
+            
+            cache_path = cls._cache_path(video_path)
+            if not os.path.exists(cache_path):
+                return None
+            with np.load(cache_path) as data:
+                if int(data['version']) != cls.FORMAT_VERSION:
+                    return None
+                index = cls(data['pts'], data['keyframe'].astype(bool),
+                            data['stream_start'], data['format_start'])
+            cls._remember(signature, index)
+            return index
+        except Exception as e:
+            print(f"パケット索引の読み込みに失敗: {e}")
+            return None
+    
+    @classmethod
+    def load(cls, video_path):
+        """索引を返す（キャッシュがなければffprobeで作成して保存）"""
+        index = cls.get_cached(video_path)
+        if index is not None:
+            return index
+        
+        with cls._build_lock:
+            # 待っている間に別スレッドが作成した場合
+            index = cls.get_cached(video_path)
+            if index is not None:
+                return index
+            
+            index = cls.build(video_path)
+            try:
+                cache_path = cls._cache_path(video_path)
+                temp_path = cache_path[:-len('.npz')] + '_tmp.npz'
+                np.savez(temp_path, version=cls.FORMAT_VERSION,
+                         pts=index.pts, keyframe=index.keyframe.astype(np.uint8),
+                         stream_start=index.stream_start, format_start=index.format_start)
+                os.replace(temp_path, cache_path)
+            except Exception as e:
+                print(f"パケット索引の保存に失敗: {e}")
+            cls._remember(file_signature(video_path), index)
+            return index
+    
+    @classmethod
+    def build(cls, video_path):
+        """ffprobeで全パケットを走査して索引を作成"""
+        start = time.time()
+        media_info = probe_media_info(video_path)
+        result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                                 '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', video_path],
+                                capture_output=True, text=True,
+                                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
+                                timeout=1800)
+        if result.returncode != 0:
+            raise Exception(f"パケット情報の取得に失敗しました: {result.stderr}")
+        
+        pts = []
+        keyframe = []
+        for line in result.stdout.split('\n'):
+            # 各行は "pts_time,flags"
+            parts = line.strip().split(',')
+            if len(parts) < 2 or parts[0] in ('', 'N/A'):
+                continue
+            pts.append(float(parts[0]))
+            keyframe.append('K' in parts[1])
+        
+        if not pts:
+            raise Exception("映像パケットが見つかりません")
+        
+        pts = np.array(pts, dtype=np.float64)
+        first_pts = pts.min()
+        index = cls(pts - first_pts, np.array(keyframe, dtype=bool), first_pts, media_info.format_start_time)
+        print(f"パケット索引作成: {index.frame_count} フレーム / "
+              f"{len(index.keyframe_frames)} キーフレーム ({time.time() - start:.1f}秒)")
+        return index
+    
+    def frame_number_at(self, seconds):
+        """指定時刻に表示されるフレームの番号"""
+        return max(0, int(np.searchsorted(self.pts, seconds + 1e-6, side='right')) - 1)
+    
+    def frame_range(self, start_time, end_time):
+        """[start_time, end_time) に表示されるフレーム番号の範囲 (開始, 終了)"""
+        start_frame = self.frame_number_at(start_time)
+        end_frame = int(np.searchsorted(self.pts, end_time - 1e-6, side='left'))
+        return start_frame, max(start_frame, end_frame)
+    
+    def keyframe_frame_before(self, frame_number):
+        """指定フレーム以前で最も近いキーフレームの番号"""
+        pos = int(np.searchsorted(self.keyframe_frames, frame_number, side='right')) - 1
+        return int(self.keyframe_frames[pos]) if pos >= 0 else 0
+    
+    def keyframe_times_for_ffmpeg(self):
+        """ffmpegの -ss と同じ基準（ファイル先頭）でのキーフレーム時刻"""
+        return self.keyframe_times + (self.stream_start - self.format_start)
+    
+    def nearest_frame(self, seconds):
+        """表示時刻が最も近いフレームの番号"""
+        pos = int(np.searchsorted(self.pts, seconds))
+        candidates = [i for i in (pos - 1, pos) if 0 <= i < len(self.pts)]
+        return min(candidates, key=lambda i: abs(self.pts[i] - seconds))
+    
+    def seek(self, cap, frame_number):
+        """キャプチャを移動し、次のread()で指定フレームが返るようにする（移動できなければFalse）
+        
+        OpenCVはフレーム番号を平均fpsで時刻に換算するため、可変フレームレートでは索引の
+        フレーム番号をそのまま CAP_PROP_POS_FRAMES に渡せない。直前のフレームより前にある
+        キーフレームの表示時刻へ CAP_PROP_POS_MSEC で移動し、読み進めながらデコードした
+        フレームの表示時刻で位置を確かめ、直前のフレームまで読んだところで止める。
+        """
+        if frame_number <= 0:
+            return cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        
+        previous = frame_number - 1
+        keyframe_number = self.keyframe_frame_before(previous)
+        for _ in range(self.SEEK_RETRIES):
+            cap.set(cv2.CAP_PROP_POS_MSEC, float(self.pts[keyframe_number]) * 1000)
+            while True:
+                if not cap.grab():
+                    return False
+                # POS_MSEC は直前に読んだフレームの表示時刻（映像ストリームの先頭が0）
+                current = self.nearest_frame(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+                if current >= previous:
+                    break
+            if current == previous:
+                return True
+            # 移動先が目的のフレームを越えていたら、1つ前のキーフレームからやり直す
+            if keyframe_number == 0:
+                break
+            keyframe_number = self.keyframe_frame_before(keyframe_number - 1)
+        
+        print(f"フレーム {frame_number} へのシークがずれました（{current + 1} の位置にいます）")
+        return False
+    
+    def seek_exact(self, cap, frame_number):
+        """seek() がずれた場合は先頭から読み進めて確実に移動する（それでも移動できなければ例外）"""
+        if self.seek(cap, frame_number):
+            return
+        print(f"フレーム {frame_number} まで先頭から読み進めます")
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        for _ in range(frame_number):
+            if not cap.grab():
+                raise Exception(f"フレーム {frame_number} へ移動できません")
+
+
+@dataclass
+class MediaInfo:
+    """動画ファイルのメタデータ（ffprobe 1回分の結果）"""
+    path: str
+    width: int
+    height: int
+    fps: float                  # 平均フレームレート（フレーム番号の計算に使用）
+    r_frame_rate: float         # ストリームの基本フレームレート
+    duration: float             # コンテナの長さ（秒）
+    frame_count: int
+    time_base: str
+    start_time: float           # 映像ストリームの開始時刻
+    format_start_time: float    # コンテナの開始時刻（ffmpegの -ss の基準）
+    is_vfr: bool
+    video_codec: str
+    profile: str
+    level: int                  # ffprobeの値（H.264は10倍、HEVCは30倍の整数）
+    pix_fmt: str
+    chroma_location: str        # 色差サンプルの位置（unspecified・left・center など）
+    sample_aspect_ratio: str
+    has_audio: bool
+    audio_codec: str
+
+
+def parse_rate(value):
+    """「30000/1001」形式のフレームレートを数値に変換（不明なら0）"""
+    try:
+        if '/' in value:
+            num, den = value.split('/')
+            return float(num) / float(den) if float(den) else 0.0
+        return float(value)
+    except (TypeError, ValueError, AttributeError):
+        return 0.0
+
+
+def parse_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+_media_info_cache = {}
+
+
+def probe_media_info(video_path):
+    """ffprobeのJSON出力1回で動画のメタデータを取得（ファイル識別子ごとにメモ化）"""
+    signature = file_signature(video_path)
+    if signature in _media_info_cache:
+        return _media_info_cache[signature]
+    
+    result = subprocess.run(['ffprobe', '-v', 'error',
+                             '-show_entries',
+                             'format=duration,start_time:'
+                             'stream=codec_type,codec_name,profile,level,pix_fmt,chroma_location,sample_aspect_ratio,width,height,'
+                             'avg_frame_rate,r_frame_rate,time_base,start_time,nb_frames,duration',
+                             '-of', 'json', video_path],
+                            capture_output=True, text=True,
+                            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
+                            timeout=30)
+    if result.returncode != 0:
+        raise Exception(f"動画情報の取得に失敗しました: {result.stderr}")
+    
+    data = json.loads(result.stdout)
+    streams = data.get('streams', [])
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), None)
+    if video is None:
+        raise Exception("映像ストリームが見つかりません")
+    
+    avg_rate = parse_rate(video.get('avg_frame_rate'))
+    r_rate = parse_rate(video.get('r_frame_rate'))
+    fps = avg_rate or r_rate
+    
+    fmt = data.get('format', {})
+    duration = parse_float(fmt.get('duration')) or parse_float(video.get('duration'))
+    nb_frames = int(parse_float(video.get('nb_frames')))
+    frame_count = nb_frames or int(round(duration * fps))
+    
+    info = MediaInfo(
+        path=video_path,
+        width=int(video.get('width', 0)),
+        height=int(video.get('height', 0)),
+        fps=fps,
+        r_frame_rate=r_rate,
+        duration=duration,
+        frame_count=frame_count,
+        time_base=video.get('time_base', ''),
+        start_time=parse_float(video.get('start_time')),
+        format_start_time=parse_float(fmt.get('start_time')),
+        # 平均と基本フレームレートが食い違う場合は可変フレームレート
+        is_vfr=bool(avg_rate and r_rate and abs(avg_rate - r_rate) > r_rate * 0.01),
+        video_codec=video.get('codec_name', ''),
+        profile=video.get('profile', ''),
+        level=int(parse_float(video.get('level'))),
+        pix_fmt=video.get('pix_fmt', ''),
+        chroma_location=video.get('chroma_location', ''),
+        sample_aspect_ratio=video.get('sample_aspect_ratio', ''),
+        has_audio=audio is not None,
+        audio_codec=audio.get('codec_name', '') if audio else '',
+    )
+    _media_info_cache[signature] = info
+    return info
+
+
+def smart_cut_stream_parameters(info):
+    """スマートカットで連結する各パートが一致していなければならない映像パラメータ（SPSの主な値とタイムベース）"""
+    return {
+        'コーデック': info.video_codec,
+        'プロファイル': info.profile,
+        'レベル': info.level,
+        '解像度': (info.width, info.height),
+        'ピクセル形式': info.pix_fmt,
+        'アスペクト比': info.sample_aspect_ratio,
+        'タイムベース': info.time_base,
+        'フレームレート': round(info.r_frame_rate, 3),
+    }
+
+
+def read_media_info_opencv(video_path):
+    """ffprobeが使えない場合にOpenCVで最低限のメタデータを取得"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise Exception("動画ファイルを開けません")
+    
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    
+    return MediaInfo(path=video_path, width=width, height=height, fps=fps, r_frame_rate=fps,
+                     duration=frame_count / fps if fps > 0 else 0, frame_count=frame_count,
+                     time_base='', start_time=0.0, format_start_time=0.0, is_vfr=False,
+                     video_codec='', profile='', level=0, pix_fmt='', chroma_location='',
+                     sample_aspect_ratio='',
+                     has_audio=False, audio_codec='')
+
+
+def plan_keyframe_segments(start_frame, end_frame, keyframe_frames, segment_count):
+    """[start_frame, end_frame) をキーフレーム位置でほぼ均等に分割する
+    
+    各セグメントの開始はキーフレームになるため、ワーカーのシークが正確かつ安価になる。
+    分割点の候補が足りない場合はセグメント数が減る。
+    """
+    candidates = sorted(f for f in set(keyframe_frames) if start_frame < f < end_frame)
+    boundaries = [start_frame]
+    
+    for i in range(1, segment_count):
+        if not candidates:
+            break
+        ideal = start_frame + (end_frame - start_frame) * i / segment_count
+        pos = bisect.bisect_left(candidates, ideal)
+        nearby = candidates[max(0, pos - 1):pos + 1]
+        nearest = min(nearby, key=lambda f: abs(f - ideal))
+        if nearest > boundaries[-1]:
+            boundaries.append(nearest)
+    
+    boundaries.append(end_frame)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def render_segment_worker(task):
+    """1セグメントを 読み込み→台形補正→エンコード する（プロセスプールのワーカー）"""
+    cap = cv2.VideoCapture(task['video_path'])
+    process = None
+    band_warper = None
+    written = 0
+    try:
+        index = PacketIndex.get_cached(task['video_path'])
+        if index is not None:
+            # 位置がずれたまま書き出すとセグメントの継ぎ目が壊れるため、確実に移動する
+            index.seek_exact(cap, task['start_frame'])
+        else:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, task['start_frame'])
+        
+        # remapテーブルは親プロセスが作成済みのディスクキャッシュから読み込まれる
+        geometry = OutputGeometry(**task['geometry']) if task.get('geometry') else None
+        warper = PerspectiveWarper(task['src_points'], task['width'], task['height'], geometry=geometry)
+        # 1フレームずつ送り終えてから次を変換するので、出力バッファは2枚で足りる
+        if task.get('warp_bands', 1) > 1:
+            band_warper = BandWarper(warper, task['warp_bands'], task.get('warp_threads', 1), 2)
+        
+        cmd = build_rawvideo_encode_command(task['segment_path'], warper.width, warper.height,
+                                            task['fps'], task['encoder'], task['quality_settings'],
+                                            drop_duplicates=task.get('drop_duplicates', False))
+        encode_start = time.perf_counter()
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.PIPE,
+                                   creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+        stderr_thread, stderr_tail = start_stderr_reader(process)
+        
+        # 段階ごとの [累計秒, 回数, バイト数]（親プロセスの処理の内訳に加える）
+        timings = {'decode': [0.0, 0, 0], 'warp': [0.0, 0, 0], 'pipe': [0.0, 0, 0]}
+        
+        # 静止フレームは補正せず、直前の補正結果を送る
+        detector = StaticFrameDetector() if task.get('static_skip') else None
+        corrected = None
+        
+        while written < task['frame_count']:
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            decoded = time.perf_counter()
+            if not ret:
+                break
+            if detector is not None and detector.is_static(frame) and corrected is not None:
+                timings.setdefault('static_skip', [0.0, 0, 0])[1] += 1
+            else:
+                corrected = band_warper.apply(frame) if band_warper is not None else warper.apply(frame)
+            warped = time.perf_counter()
+            try:
+                process.stdin.write(corrected.data)
+            except (BrokenPipeError, OSError):
+                break
+            piped = time.perf_counter()
+            for stage, seconds, nbytes in (('decode', decoded - start, frame.nbytes),
+                                           ('warp', warped - decoded, corrected.nbytes),
+                                           ('pipe', piped - warped, corrected.nbytes)):
+                timings[stage][0] += seconds
+                timings[stage][1] += 1
+                timings[stage][2] += nbytes
+            written += 1
+            if written % 30 == 0:
+                task['progress_queue'].put(30)
+        
+        try:
+            process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        process.wait()
+        timings['encode'] = [time.perf_counter() - encode_start, written, 0]
+        stderr_thread.join(timeout=5)
+        task['progress_queue'].put(written % 30)
+        
+        return {
+            'index': task['index'],
+            'frames': written,
+            'timings': timings,
+            'returncode': process.returncode,
+            'error': b''.join(stderr_tail).decode('utf-8', errors='ignore'),
+        }
+    finally:
+        cap.release()
+        if band_warper is not None:
+            band_warper.close()
+        if process is not None and process.poll() is None:
+            process.kill()
+
+
+# エンコーダー検出結果のキャッシュ形式
+ENCODER_CACHE_VERSION = 1
+
+# ffmpeg検出前・検出中に使えるエンコーダー（libx264はほぼ全てのffmpegビルドに含まれる）
+DEFAULT_ENCODER_OPTIONS = [('CPU (H.264)', 'libx264'), ('CPU (OpenCV)', 'opencv')]
+
+# 実際にエンコードして使用可否を確認するエンコーダー (表示名, コード, 追加引数)
+ENCODER_TESTS = [
+    ('NVIDIA GPU (H.264)', 'h264_nvenc', ['-preset', 'fast']),
+    ('NVIDIA GPU (H.265)', 'hevc_nvenc', ['-preset', 'fast']),
+    ('Intel QuickSync (H.264)', 'h264_qsv', []),
+]
+
+
+def run_encoder_test(encoder, extra_args):
+    """testsrcを短くエンコードしてエンコーダーが使えるか確認"""
+    test_cmd = ['ffmpeg', '-f', 'lavfi', '-i', 'testsrc=duration=0.1:size=320x240:rate=1',
+                '-c:v', encoder] + extra_args + ['-f', 'null', '-', '-v', 'error']
+    try:
+        test_result = subprocess.run(test_cmd, capture_output=True, text=True,
+                                     creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
+                                     timeout=15)
+        return {'cmd': test_cmd, 'returncode': test_result.returncode, 'stderr': test_result.stderr}
+    except subprocess.TimeoutExpired:
+        return {'cmd': test_cmd, 'returncode': None, 'stderr': 'タイムアウト'}
+    except Exception as e:
+        return {'cmd': test_cmd, 'returncode': None, 'stderr': str(e)}
+
+
+def run_nvidia_smi():
+    """nvidia-smiでGPU情報を取得"""
+    try:
+        nvidia_smi = subprocess.run(['nvidia-smi', '--query-gpu=name,driver_version,cuda_version', '--format=csv'],
+                                    capture_output=True, text=True,
+                                    creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
+                                    timeout=10)
+        if nvidia_smi.returncode == 0:
+            return nvidia_smi.stdout
+        return "nvidia-smi実行失敗\n"
+    except FileNotFoundError:
+        return "nvidia-smi not found (NVIDIAドライバー未インストール?)\n"
+    except Exception as e:
+        return f"nvidia-smi エラー: {e}\n"
+
+
+def print_encoder_test_result(name, encoder, result):
+    """エンコーダーテストの結果をコンソールに表示"""
+    if result['returncode'] == 0:
+        print(f"✅ {name} 使用可能")
+        return
+    if result['returncode'] is None:
+        print(f"❌ {encoder} テスト例外: {result['stderr']}")
+        return
+    
+    print(f"❌ {encoder} テスト失敗:")
+    print(f"stderr: {result['stderr']}")
+    if 'nvenc' in encoder:
+        # 詳細なエラー分析
+        if "Driver does not support the required nvenc API version" in result['stderr']:
+            print("→ NVIDIAドライバーが古すぎます")
+        elif "Cannot load nvcuda.dll" in result['stderr']:
+            print("→ CUDA ドライバーの問題")
+        elif "No NVENC capable devices found" in result['stderr']:
+            print("→ NVENC対応GPUが見つかりません")
+        else:
+            print("→ その他のNVENC問題")
+
+
+def get_ffmpeg_identity():
+    """ffmpegの実行ファイルのパスと更新時刻（見つからなければNone）"""
+    path = shutil.which('ffmpeg')
+    if not path:
+        return None
+    return {'path': os.path.abspath(path), 'mtime': os.stat(path).st_mtime_ns}
+
+
+def encoder_cache_path():
+    return os.path.join(get_cache_dir(), 'encoders.json')
+
+
+def load_encoder_cache():
+    try:
+        with open(encoder_cache_path(), 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('version') == ENCODER_CACHE_VERSION:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {'version': ENCODER_CACHE_VERSION, 'entries': {}}
+
+
+def save_encoder_cache(cache):
+    try:
+        temp_path = encoder_cache_path() + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, encoder_cache_path())
+    except OSError as e:
+        print(f"エンコーダー検出結果の保存に失敗: {e}")
+
+
+def lookup_cached_capabilities():
+    """ffmpegのパスと更新時刻が一致するキャッシュ済みの検出結果（プロセス起動なし）"""
+    identity = get_ffmpeg_identity()
+    if identity is None:
+        return None
+    key = f"{identity['path']}|{identity['mtime']}"
+    return load_encoder_cache()['entries'].get(key)
+
+
+def probe_encoder_capabilities(force=False):
+    """利用可能なエンコーダーを検出
+    
+    結果は ffmpegのパス・バージョン文字列・更新時刻 をキーにキャッシュし、
+    一致すればテストエンコードを省略する。テストエンコードは並列に実行する。
+    ffmpegが見つからなければNoneを返す。
+    """
+    identity = get_ffmpeg_identity()
+    if identity is None:
+        print("ffmpegが見つかりません。")
+        return None
+    
+    try:
+        result = subprocess.run(['ffmpeg', '-version'],
+                              capture_output=True, text=True,
+                              creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
+                              timeout=10)
+        if result.returncode != 0:
+            print("ffmpegが見つかりません")
+            return None
+    except subprocess.TimeoutExpired:
+        print("ffmpegコマンドがタイムアウトしました")
+        return None
+    except Exception as e:
+        print(f"GPU検出エラー: {e}")
+        return None
+    
+    version_lines = result.stdout.split('\n')[:5]
+    version = version_lines[0].strip()
+    key = f"{identity['path']}|{identity['mtime']}"
+    
+    cache = load_encoder_cache()
+    entry = cache['entries'].get(key)
+    if not force and entry is not None and entry.get('ffmpeg_version') == version:
+        print("エンコーダー検出: キャッシュを使用")
+        return entry
+    
+    print("ffmpeg検出成功")
+    options = []
+    with ThreadPoolExecutor(max_workers=len(ENCODER_TESTS) + 1) as executor:
+        # nvidia-smiはエンコーダー一覧の取得と並行して実行
+        nvidia_future = executor.submit(run_nvidia_smi)
+        
+        try:
+            result = subprocess.run(['ffmpeg', '-encoders'],
+                                  capture_output=True, text=True,
+                                  creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
+                                  timeout=10)
+            encoders = result.stdout
+        except Exception as e:
+            print(f"エンコーダー一覧の取得に失敗: {e}")
+            encoders = ''
+        print("利用可能エンコーダー確認中...")
+        
+        # テストエンコードを並列実行
+        test_futures = {}
+        for name, encoder, extra_args in ENCODER_TESTS:
+            if encoder in encoders:
+                test_futures[encoder] = (name, executor.submit(run_encoder_test, encoder, extra_args))
+            else:
+                print(f"{encoder} がエンコーダーリストに存在しません")
+        
+        tests = {}
+        for encoder, (name, future) in test_futures.items():
+            tests[encoder] = future.result()
+            print_encoder_test_result(name, encoder, tests[encoder])
+            if tests[encoder]['returncode'] == 0:
+                options.append((name, encoder))
+        nvidia_info = nvidia_future.result()
+    
+    if 'hevc_qsv' in encoders:
+        options.append(('Intel QuickSync (H.265)', 'hevc_qsv'))
+    
+    # CPU エンコーダー
+    if 'libx264' in encoders:
+        options.append(('CPU (H.264)', 'libx264'))
+        print("✅ CPU H.264 使用可能")
+    
+    # OpenCV フォールバック（最も安全）
+    options.append(('CPU (OpenCV)', 'opencv'))
+    print("✅ CPU OpenCV 使用可能")
+    
+    entry = {
+        'path': identity['path'],
+        'mtime': identity['mtime'],
+        'ffmpeg_version': version,
+        'options': options,
+        'nvidia_smi': nvidia_info,
+        'version_lines': '\n'.join(version_lines),
+        'encoder_lines': '\n'.join(line for line in encoders.split('\n')
+                                   if 'nvenc' in line.lower() or 'h264' in line.lower() or 'hevc' in line.lower()),
+        'tests': tests,
+    }
+    cache['entries'][key] = entry
+    save_encoder_cache(cache)
+    return entry
+
+
+# 自動選択用のエンコーダー計測（マシンごとのプロファイル）
+ENCODER_PROFILE_VERSION = 1
+AUTO_ENCODER_OPTION = ('自動 (計測結果から選択)', 'auto')
+CALIBRATION_SECONDS = 5
+QUALITY_NAMES = ["最高品質", "高品質", "標準品質", "高速"]
+
+# 品質名ごとに自動選択で満たすべきSSIM（元動画との比較）
+QUALITY_SSIM_TARGETS = {
+    "最高品質": 0.985,
+    "高品質": 0.97,
+    "標準品質": 0.95,
+    "高速": 0.92,
+}
+
+
+def encoder_profile_path():
+    return os.path.join(get_cache_dir(), 'encoder_profile.json')
+
+
+def encoder_profile_key():
+    """プロファイルのキー（マシン名とffmpegの実行ファイル）"""
+    identity = get_ffmpeg_identity()
+    if identity is None:
+        return None
+    return f"{platform.node()}|{identity['path']}|{identity['mtime']}"
+
+
+def load_encoder_profile():
+    """このマシン・このffmpegの計測結果 {"幅x高さ": [結果, ...]}（未計測なら空）"""
+    key = encoder_profile_key()
+    try:
+        with open(encoder_profile_path(), 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+        if profile.get('version') == ENCODER_PROFILE_VERSION and key is not None:
+            return profile['machines'].get(key, {})
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+
+def save_encoder_profile(resolution, results):
+    """計測結果を解像度ごとに保存（同じ解像度の前回の結果は置き換える）"""
+    key = encoder_profile_key()
+    if key is None:
+        return
+    try:
+        with open(encoder_profile_path(), 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+        if profile.get('version') != ENCODER_PROFILE_VERSION:
+            raise ValueError
+    except (OSError, ValueError):
+        profile = {'version': ENCODER_PROFILE_VERSION, 'machines': {}}
+    
+    profile['machines'].setdefault(key, {})[resolution] = results
+    try:
+        temp_path = encoder_profile_path() + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(profile, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, encoder_profile_path())
+    except OSError as e:
+        print(f"エンコーダー計測結果の保存に失敗: {e}")
+
+
+def measure_ssim(encoded_path, video_path, start_time, frame_count):
+    """エンコード結果と元動画の同じ範囲をSSIMで比較（失敗したらNone）"""
+    cmd = ['ffmpeg', '-hide_banner', '-i', encoded_path,
+           '-ss', f"{start_time:.3f}", '-i', video_path,
+           '-frames:v', str(frame_count),
+           '-lavfi', "[0:v]format=yuv420p,setpts=PTS-STARTPTS[a];"
+                     "[1:v]format=yuv420p,setpts=PTS-STARTPTS[b];[a][b]ssim",
+           '-f', 'null', '-']
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120,
+                                creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+    except Exception as e:
+        print(f"SSIMの計測に失敗: {e}")
+        return None
+    match = re.search(r'All:([0-9.]+)', result.stderr)
+    return float(match.group(1)) if match else None
+
+
+def calibrate_encoders(video_path, video_info, encoders, quality_settings_for, progress=None):
+    """元動画の解像度で各エンコーダー×品質を実際にエンコードし、速度・サイズ・SSIMを計測
+    
+    動画の中央付近 CALIBRATION_SECONDS 秒を使う。quality_settings_for(エンコーダー, 品質名) は
+    書き出し時と同じ品質設定を返す関数。結果は解像度ごとにプロファイルへ保存して返す。
+    """
+    frame_count = max(1, int(CALIBRATION_SECONDS * video_info.fps))
+    start_time = max(0.0, video_info.duration / 2 - CALIBRATION_SECONDS / 2)
+    content_seconds = frame_count / video_info.fps
+    
+    # 元動画のデコード負荷が計測に混ざらないよう、範囲を一度だけ可逆圧縮 (FFV1) で切り出しておく
+    work_dir = tempfile.mkdtemp(prefix='twitcas_calibration_')
+    try:
+        clip_path = os.path.join(work_dir, 'source.mkv')
+        subprocess.run(['ffmpeg', '-y', '-v', 'error', '-ss', f"{start_time:.3f}", '-i', video_path,
+                        '-frames:v', str(frame_count), '-an', '-c:v', 'ffv1', clip_path],
+                       capture_output=True, timeout=600,
+                       creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+        
+        combinations = [(encoder, quality) for encoder in encoders for quality in QUALITY_NAMES]
+        results = []
+        for number, (encoder, quality) in enumerate(combinations, 1):
+            if progress is not None:
+                progress(number, len(combinations), encoder, quality)
+            
+            output_path = os.path.join(work_dir, f"{encoder}_{number}.mp4")
+            cmd = (['ffmpeg', '-y', '-v', 'error', '-i', clip_path, '-c:v', encoder]
+                   + list(quality_settings_for(encoder, quality)) + ['-pix_fmt', 'yuv420p', output_path])
+            start = time.perf_counter()
+            try:
+                result = subprocess.run(cmd, capture_output=True, text=True, timeout=600,
+                                        creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+            except subprocess.TimeoutExpired:
+                print(f"計測タイムアウト: {encoder} / {quality}")
+                continue
+            elapsed = time.perf_counter() - start
+            if result.returncode != 0 or not os.path.exists(output_path):
+                print(f"計測失敗: {encoder} / {quality}: {result.stderr.strip()[-200:]}")
+                continue
+            
+            size = os.path.getsize(output_path)
+            ssim = measure_ssim(output_path, clip_path, 0.0, frame_count)
+            results.append({
+                'encoder': encoder,
+                'quality': quality,
+                'fps': frame_count / elapsed if elapsed > 0 else 0.0,
+                'bytes_per_second': size / content_seconds,
+                'ssim': ssim,
+            })
+            print(f"計測: {encoder:<12} {quality:<6} {results[-1]['fps']:7.1f}fps "
+                  f"{size / content_seconds * 60 / (1024 * 1024):7.1f}MB/分 SSIM {ssim}")
+            os.remove(output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    save_encoder_profile(f"{video_info.width}x{video_info.height}", results)
+    return results
+
+
+def select_calibrated_encoder(profile, width, height, min_ssim, max_bytes_per_second=None):
+    """計測結果から、品質とサイズの条件を満たす最速のエンコーダーを選ぶ
+    
+    同じ解像度の結果がなければ画素数が最も近い解像度の結果を使う。
+    条件を満たすものがなければ、サイズ条件内で最も高画質なもの、それもなければ最も小さいものを返す。
+    戻り値は (エンコーダー, 品質名) または None（未計測）。
+    """
+    if not profile:
+        return None
+    resolution = f"{width}x{height}"
+    if resolution not in profile:
+        def pixel_distance(key):
+            w, _, h = key.partition('x')
+            return abs(int(w) * int(h) - width * height)
+        resolution = min(profile, key=pixel_distance)
+    results = [result for result in profile[resolution] if result.get('ssim') is not None]
+    if not results:
+        return None
+    
+    within_budget = [result for result in results
+                     if not max_bytes_per_second or result['bytes_per_second'] <= max_bytes_per_second]
+    candidates = [result for result in within_budget if result['ssim'] >= min_ssim]
+    if candidates:
+        best = max(candidates, key=lambda result: result['fps'])
+    elif within_budget:
+        best = max(within_budget, key=lambda result: result['ssim'])
+    else:
+        best = min(results, key=lambda result: result['bytes_per_second'])
+    return best['encoder'], best['quality']
+
+
+class PreviewDecoder:
+    """プレビュー用の常駐デコーダー
+    
+    キャプチャを開いたまま保持し、デコード済みフレームをフレーム番号（表示時刻から算出）を
+    キーにしたLRUキャッシュへメモリ上限付きで保持する。
+    取得したフレームの前後は先読みスレッドがデコードしておく。
+    """
+    
+    MEMORY_BUDGET = 512 * 1024 * 1024   # キャッシュの上限（バイト）
+    SEQUENTIAL_LIMIT = 60               # この距離以内の前方移動はシークせず読み進める
+    PREFETCH_FORWARD = 5                # 先読みする後続フレーム数
+    
+    def __init__(self, video_path, video_info, memory_budget=None):
+        self.video_path = video_path
+        self.video_info = video_info
+        self.memory_budget = memory_budget or self.MEMORY_BUDGET
+        
+        self.cap = cv2.VideoCapture(video_path)
+        self.next_frame = 0                 # 次のread()で返るフレーム番号
+        self.cap_lock = threading.Lock()    # キャプチャはスレッド間で共有しない
+        
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        self.cache_lock = threading.Lock()
+        
+        self.prefetch_target = None
+        self.prefetch_event = threading.Event()
+        self.closed = False
+        self.prefetch_thread = threading.Thread(target=self._prefetch_loop)
+        self.prefetch_thread.daemon = True
+        self.prefetch_thread.start()
+    
+    def frame_number_at(self, seconds):
+        """表示時刻をフレーム番号に変換"""
+        index = PacketIndex.get_cached(self.video_path)
+        if index is not None:
+            return index.frame_number_at(seconds)
+        return int(seconds * self.video_info.fps)
+    
+    def get_frame(self, seconds):
+        """指定時刻のフレームを返す（失敗時はNone）"""
+        return self.get_frame_number(self.frame_number_at(seconds))
+    
+    def get_frame_number(self, frame_number):
+        frame = self._cached(frame_number)
+        if frame is None:
+            frame = self._decode(frame_number)
+        if frame is not None:
+            self._request_prefetch(frame_number)
+        return frame
+    
+    def _cached(self, frame_number):
+        with self.cache_lock:
+            frame = self.cache.get(frame_number)
+            if frame is not None:
+                self.cache.move_to_end(frame_number)
+            return frame
+    
+    def _store(self, frame_number, frame):
+        with self.cache_lock:
+            if frame_number in self.cache:
+                return
+            self.cache[frame_number] = frame
+            self.cache_bytes += frame.nbytes
+            while self.cache_bytes > self.memory_budget and len(self.cache) > 1:
+                _, evicted = self.cache.popitem(last=False)
+                self.cache_bytes -= evicted.nbytes
+    
+    def _decode(self, frame_number):
+        """キャプチャの現在位置から最も安く指定フレームに到達してデコード"""
+        with self.cap_lock:
+            if self.closed:
+                return None
+            cached = self._cached(frame_number)
+            if cached is not None:
+                return cached
+            
+            distance = frame_number - self.next_frame
+            if self.next_frame >= 0 and 0 <= distance <= self.SEQUENTIAL_LIMIT:
+                # 近い前方はシークせずに読み進める
+                for _ in range(distance):
+                    self.cap.grab()
+            else:
+                index = PacketIndex.get_cached(self.video_path)
+                if index is not None:
+                    if not index.seek(self.cap, frame_number):
+                        # 別のフレームを指定の番号でキャッシュしないよう、何も返さない
+                        self.next_frame = -1
+                        return None
+                else:
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+            
+            ret, frame = self.cap.read()
+            if not ret:
+                # 位置が不明になったため次回は必ずシークさせる
+                self.next_frame = -1
+                return None
+            self.next_frame = frame_number + 1
+        
+        self._store(frame_number, frame)
+        return frame
+    
+    def _request_prefetch(self, frame_number):
+        self.prefetch_target = frame_number
+        self.prefetch_event.set()
+    
+    def _prefetch_loop(self):
+        """最新の要求フレームの前後をデコードしておく"""
+        while not self.closed:
+            self.prefetch_event.wait()
+            self.prefetch_event.clear()
+            target = self.prefetch_target
+            if target is None:
+                continue
+            
+            # 後続フレーム（順次デコードで安い）と、1秒前後・1フレーム前
+            step = max(1, int(round(self.video_info.fps)))
+            neighbours = [target + i for i in range(1, self.PREFETCH_FORWARD + 1)]
+            neighbours += [target + step, target - 1, target - step]
+            
+            for frame_number in neighbours:
+                # 新しい要求が来たら中断してそちらを優先
+                if self.closed or self.prefetch_event.is_set():
+                    break
+                if frame_number < 0 or frame_number >= self.video_info.frame_count:
+                    continue
+                if self._cached(frame_number) is None:
+                    self._decode(frame_number)
+    
+    def close(self):
+        """先読みを止めてキャプチャを解放"""
+        self.closed = True
+        self.prefetch_event.set()
+        with self.cap_lock:
+            self.cap.release()
+        with self.cache_lock:
+            self.cache.clear()
+            self.cache_bytes = 0
+
+
+class ThumbnailSprite:
+    """キーフレームの縮小画像を並べたスプライト（タイマースクラバー用）
+    
+    キーフレームだけをデコードして縮小したタイルを、キャッシュディレクトリのファイルへ
+    バックグラウンドで追記する（書き込んだタイルの分だけの大きさになる）。
+    作成後はメモリマップで開き、作成途中でも書き込み済みのタイルから最も近いものを返せる。
+    """
+    
+    FORMAT_VERSION = 2
+    TILE_WIDTH = 160
+    MAX_TILES = 3000    # 長時間の動画でもファイルが大きくなりすぎないよう間引く
+    
+    _instances = {}
+    _instances_lock = threading.Lock()
+    
+    @classmethod
+    def get(cls, video_path, video_info):
+        """動画ごとに1つのスプライトを返す"""
+        signature = file_signature(video_path)
+        with cls._instances_lock:
+            if signature not in cls._instances:
+                cls._instances[signature] = cls(video_path, video_info, signature)
+            return cls._instances[signature]
+    
+    def __init__(self, video_path, video_info, signature):
+        self.video_path = video_path
+        self.video_info = video_info
+        self.signature = signature
+        
+        self.tile_width = self.TILE_WIDTH
+        self.tile_height = max(2, int(round(self.TILE_WIDTH * video_info.height / max(video_info.width, 1) / 2)) * 2)
+        
+        self.tiles = None
+        self.times = []
+        self.count = 0
+        self.complete = False
+        self.building = False
+        
+        self.data_path, self.meta_path = self._locate_paths()
+        self._load_existing()
+    
+    def _locate_paths(self):
+        base = os.path.join(get_cache_dir('thumbs'), f"{self.signature}.thumbs")
+        return base, base + '.json'
+    
+    def _load_existing(self):
+        """作成済みのスプライトがあれば読み込み専用で開く"""
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if (meta.get('version') != self.FORMAT_VERSION or meta.get('signature') != self.signature
+                    or not meta.get('complete') or meta.get('tile_size') != [self.tile_width, self.tile_height]):
+                return
+            if meta['count'] > 0:
+                self.tiles = np.memmap(self.data_path, dtype=np.uint8, mode='r',
+                                       shape=(meta['count'], self.tile_height, self.tile_width, 3))
+            self.times = meta['times']
+            self.count = meta['count']
+            self.complete = True
+        except (OSError, ValueError, KeyError):
+            pass
+    
+    @property
+    def available(self):
+        """表示できるタイル数"""
+        return min(self.count, len(self.times))
+    
+    def start_build(self):
+        """バックグラウンドで作成を開始（作成済み・作成中なら何もしない）"""
+        if self.complete or self.building:
+            return
+        self.building = True
+        thread = threading.Thread(target=self._build)
+        thread.daemon = True
+        thread.start()
+    
+    def _build(self):
+        data_file = None
+        # 途中で失敗した前回の作成の続きにならないよう、状態を空にしてからファイルを作り直す
+        self.tiles = None
+        self.times = []
+        self.count = 0
+        try:
+            interval = self.video_info.duration / self.MAX_TILES
+            capacity = self.MAX_TILES + 16
+            frame_bytes = self.tile_width * self.tile_height * 3
+            data_file = open(self.data_path, 'wb')
+            
+            # キーフレームのみデコードし、一定間隔に間引いて縮小（showinfoで各タイルの時刻を得る）
+            cmd = ['ffmpeg', '-v', 'info', '-nostats',
+                   '-skip_frame', 'nokey', '-i', self.video_path,
+                   '-an', '-sn', '-dn',
+                   '-vf', f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{interval:.3f})',"
+                          f"scale={self.tile_width}:{self.tile_height},showinfo",
+                   '-fps_mode', 'passthrough',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-']
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+            
+            def read_times():
+                for line in iter(process.stderr.readline, b''):
+                    if b'Parsed_showinfo' in line:
+                        match = re.search(rb'pts_time:\s*([-0-9.]+)', line)
+                        if match:
+                            self.times.append(float(match.group(1)))
+            
+            stderr_thread = threading.Thread(target=read_times)
+            stderr_thread.daemon = True
+            stderr_thread.start()
+            
+            start = time.time()
+            while self.count < capacity:
+                data = process.stdout.read(frame_bytes)
+                if len(data) < frame_bytes:
+                    break
+                # 作成中の表示は nearest() がファイルから読むので、1枚ごとに書き出す
+                data_file.write(data)
+                data_file.flush()
+                self.count += 1
+            
+            data_file.close()
+            if process.poll() is None:
+                process.stdout.close()
+            process.wait()
+            stderr_thread.join(timeout=5)
+            
+            if process.returncode == 0 or self.count == capacity:
+                self.times = self.times[:self.count]
+                if self.count > 0:
+                    self.tiles = np.memmap(self.data_path, dtype=np.uint8, mode='r',
+                                           shape=(self.count, self.tile_height, self.tile_width, 3))
+                self.complete = True
+                meta = {
+                    'version': self.FORMAT_VERSION,
+                    'signature': self.signature,
+                    'tile_size': [self.tile_width, self.tile_height],
+                    'count': self.count,
+                    'times': self.times,
+                    'complete': True,
+                }
+                with open(self.meta_path, 'w', encoding='utf-8') as f:
+                    json.dump(meta, f)
+                print(f"サムネイルスプライト作成: {self.count} 枚 ({time.time() - start:.1f}秒)")
+            else:
+                print("サムネイルスプライトの作成に失敗しました")
+        except Exception as e:
+            print(f"サムネイルスプライト作成エラー: {e}")
+        finally:
+            if data_file is not None:
+                data_file.close()
+            self.building = False
+    
+    def nearest(self, seconds):
+        """指定時刻に最も近いタイル (RGB画像, 時刻)（なければNone）"""
+        available = self.available
+        if available == 0:
+            return None
+        times = self.times[:available]
+        pos = bisect.bisect_left(times, seconds)
+        candidates = [i for i in (pos - 1, pos) if 0 <= i < available]
+        best = min(candidates, key=lambda i: abs(times[i] - seconds))
+        
+        if self.tiles is not None:
+            return self.tiles[best], times[best]
+        
+        # 作成中は書き込み済みのファイルから1枚だけ読む
+        tile_bytes = self.tile_width * self.tile_height * 3
+        try:
+            data = np.fromfile(self.data_path, dtype=np.uint8, count=tile_bytes, offset=best * tile_bytes)
+        except (OSError, ValueError):
+            return None
+        if data.size < tile_bytes:
+            return None
+        return data.reshape(self.tile_height, self.tile_width, 3), times[best]
+
+
+class ProxyVideo:
+    """編集画面用の低解像度プロキシ動画
+    
+    大きな動画でもプレビューのデコードが軽くなるよう、短辺 SHORT_SIDE の縮小版を
+    キーフレーム間隔の短い固定フレームレートのH.264でキャッシュディレクトリへ書き出す（音声なし）。
+    プロキシ上の座標は scale_x・scale_y を掛けて元動画の座標に戻す。書き出しには常に元動画を使う。
+    """
+    
+    FORMAT_VERSION = 1
+    SHORT_SIDE = 540
+    GOP_SECONDS = 0.5   # キーフレーム間隔（シーク時に読み進めるフレーム数を抑える）
+    
+    _instances = {}
+    _instances_lock = threading.Lock()
+    
+    @classmethod
+    def get(cls, video_path, video_info):
+        """動画ごとに1つのプロキシを返す"""
+        signature = file_signature(video_path)
+        with cls._instances_lock:
+            if signature not in cls._instances:
+                cls._instances[signature] = cls(video_path, video_info, signature)
+            return cls._instances[signature]
+    
+    def __init__(self, video_path, video_info, signature):
+        self.source_path = video_path
+        self.source_info = video_info
+        self.signature = signature
+        
+        # 元動画より大きくはせず、幅・高さは偶数にそろえる
+        scale = min(1.0, self.SHORT_SIDE / max(min(video_info.width, video_info.height), 1))
+        self.width = max(2, int(round(video_info.width * scale / 2)) * 2)
+        self.height = max(2, int(round(video_info.height * scale / 2)) * 2)
+        self.scale_x = video_info.width / self.width
+        self.scale_y = video_info.height / self.height
+        
+        base = os.path.join(get_cache_dir('proxies'), f"{signature}_{self.height}p")
+        self.path = base + '.mp4'
+        self.meta_path = base + '.json'
+        
+        self.progress = 0.0
+        self.complete = False
+        self.building = False
+        self._load_existing()
+    
+    def _load_existing(self):
+        """作成済みのプロキシがあれば使う"""
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if (meta.get('version') == self.FORMAT_VERSION and meta.get('signature') == self.signature
+                    and meta.get('size') == [self.width, self.height] and os.path.exists(self.path)):
+                self.progress = 100.0
+                self.complete = True
+        except (OSError, ValueError):
+            pass
+    
+    @property
+    def needed(self):
+        """縮小する意味があるか（元動画が小さければプロキシは作らない）"""
+        return self.scale_x > 1.0
+    
+    @property
+    def video_info(self):
+        """プレビュー用デコーダーに渡す、プロキシ動画としての情報"""
+        fps = self.source_info.fps
+        return replace(self.source_info, path=self.path, width=self.width, height=self.height,
+                       r_frame_rate=fps, start_time=0.0, format_start_time=0.0, is_vfr=False,
+                       video_codec='h264', pix_fmt='yuv420p', has_audio=False, audio_codec='')
+    
+    def to_source(self, x, y):
+        """プロキシ上の座標を元動画の座標に変換"""
+        return x * self.scale_x, y * self.scale_y
+    
+    def start_build(self):
+        """バックグラウンドで作成を開始（作成済み・作成中・不要なら何もしない）"""
+        if self.complete or self.building or not self.needed:
+            return
+        self.building = True
+        thread = threading.Thread(target=self._build)
+        thread.daemon = True
+        thread.start()
+    
+    def _build(self):
+        # 完成するまでは別名で書き、完成後に名前を変える（中断しても壊れたプロキシを使わない）
+        part_path = self.path[:-len('.mp4')] + '.part.mp4'
+        try:
+            fps = self.source_info.fps or 30.0
+            gop = max(1, int(round(fps * self.GOP_SECONDS)))
+            # 元動画と同じ平均フレームレートの固定フレームレートにして、時刻→フレーム番号を単純な計算で求められるようにする
+            cmd = ['ffmpeg', '-y', '-i', self.source_path,
+                   '-an', '-sn', '-dn',
+                   '-vf', f"scale={self.width}:{self.height}",
+                   '-r', f"{fps:.6f}", '-fps_mode', 'cfr',
+                   '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-tune', 'fastdecode',
+                   '-g', str(gop), '-bf', '0', '-pix_fmt', 'yuv420p',
+                   '-f', 'mp4', part_path]
+            
+            def on_progress(percent, fps, speed, eta):
+                self.progress = percent
+            
+            start = time.time()
+            process = FFmpegProgress(cmd, self.source_info.duration, on_progress)
+            process.wait()
+            
+            error = process.output_error(part_path)
+            if error is not None:
+                print(f"プロキシの作成に失敗しました: {error}")
+                return
+            
+            os.replace(part_path, self.path)
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': self.FORMAT_VERSION,
+                    'signature': self.signature,
+                    'size': [self.width, self.height],
+                }, f)
+            self.progress = 100.0
+            self.complete = True
+            print(f"プロキシ作成: {self.width}x{self.height} ({time.time() - start:.1f}秒)")
+        except Exception as e:
+            print(f"プロキシ作成エラー: {e}")
+        finally:
+            self.building = False
+            if os.path.exists(part_path):
+                try:
+                    os.remove(part_path)
+                except OSError:
+                    pass
+
 
 class ThumbnailEditor:
-    def __init__(self, parent, video_path, video_info, point_entries):
+    def __init__(self, parent, video_path, video_info, point_entries, proxy=None):
         self.parent = parent
         self.video_path = video_path
         self.video_info = video_info
         self.point_entries = point_entries
         
+        # 作成済みのプロキシがあれば、表示・補正点の操作はすべてプロキシの解像度で行う
+        # （座標は適用時に元動画の解像度に戻す）
+        self.proxy = proxy if proxy is not None and proxy.complete else None
+        
         self.window = tk.Toplevel(parent)
         self.window.title("台形補正設定")
-        self.window.geometry("800x700")
+        self.window.geometry("1500x780")
         self.window.grab_set()  # モーダルウィンドウにする
+        self.window.protocol("WM_DELETE_WINDOW", self.cancel)
+        
+        # ウィンドウを開いている間は同じデコーダーを使い続ける
+        if self.proxy is not None:
+            self.decoder = PreviewDecoder(self.proxy.path, self.proxy.video_info)
+        else:
+            self.decoder = PreviewDecoder(video_path, video_info)
+        
+        # スクラバー用のサムネイル（未作成ならバックグラウンドで作成）
+        self.sprite = ThumbnailSprite.get(video_path, video_info)
+        self.sprite.start_build()
         
         self.current_frame = None
         self.display_frame = None
@@ -28,9 +2323,14 @@ class ThumbnailEditor:
         self.points = []
         self.dragging_point = None
         self.scale_factor = 1.0
+        self.display_rgb = None         # 表示解像度に縮小したフレーム（ライブプレビュー用）
+        self.point_items = None         # 補正点・線のキャンバスアイテム
+        self.live_image = None
+        self.live_after_id = None
         
         self.setup_ui()
         self.load_initial_frame()
+        self.update_sprite_status()
     
     def setup_ui(self):
         # 時間選択フレーム
@@ -53,21 +2353,51 @@ class ThumbnailEditor:
         
         tk.Button(time_frame, text="フレーム更新", command=self.update_frame).pack(side='left', padx=10)
         
+        # コマ送り（補正点は保持したまま表示フレームだけ移動）
+        step_frame = tk.Frame(self.window)
+        step_frame.pack(fill='x', padx=10)
+        frame_step = 1.0 / self.video_info.fps if self.video_info.fps > 0 else 1 / 30.0
+        for text, delta in [("◀ 1秒", -1.0), ("◀ 1コマ", -frame_step), ("1コマ ▶", frame_step), ("1秒 ▶", 1.0)]:
+            tk.Button(step_frame, text=text,
+                      command=lambda d=delta: self.step_frame(d)).pack(side='left', padx=2)
+        
+        # タイムラインスクラバー（ドラッグ中はサムネイル、止まったら実フレームを表示）
+        scrub_frame = tk.Frame(self.window)
+        scrub_frame.pack(fill='x', padx=10, pady=(5, 0))
+        self.scrub_var = tk.DoubleVar(value=0.0)
+        self.scrubber = tk.Scale(scrub_frame, from_=0, to=max(self.video_info.duration, 0.1),
+                                 orient='horizontal', resolution=0.1, showvalue=0,
+                                 variable=self.scrub_var, command=self.on_scrub)
+        self.scrubber.pack(side='left', fill='x', expand=True)
+        self.scrubber.bind("<ButtonRelease-1>", lambda event: self.load_scrub_frame())
+        self.scrub_label = tk.Label(scrub_frame, text="", width=24, anchor='w')
+        self.scrub_label.pack(side='left', padx=5)
+        self.scrub_after_id = None
+        self.scrub_image = None
+        
         # 説明文
-        info_label = tk.Label(self.window, text="※ 青い点をドラッグして台形の4つの角を調整してください", fg='blue')
+        info_text = "※ 青い点をドラッグして台形の4つの角を調整してください"
+        if self.proxy is not None:
+            info_text += f"（プロキシ {self.proxy.width}x{self.proxy.height} で表示中）"
+        info_label = tk.Label(self.window, text=info_text, fg='blue')
         info_label.pack(pady=5)
         
         # キャンバスフレーム
         canvas_frame = tk.Frame(self.window)
         canvas_frame.pack(pady=10, fill='both', expand=True, padx=10)
         
+        # 補正結果のライブプレビュー（右側）
+        self.live_canvas = tk.Canvas(canvas_frame, bg='black', width=700, height=500)
+        self.live_canvas.pack(side="right", padx=(10, 0))
+        self.live_item = self.live_canvas.create_image(0, 0, anchor="nw")
+        
         # スクロールバー付きキャンバス
         self.canvas = tk.Canvas(canvas_frame, bg='black')
-        v_scrollbar = ttk.Scrollbar(canvas_frame, orient="vertical", command=self.canvas.yview)
+        self.v_scrollbar = ttk.Scrollbar(canvas_frame, orient="vertical", command=self.canvas.yview)
         h_scrollbar = ttk.Scrollbar(canvas_frame, orient="horizontal", command=self.canvas.xview)
-        self.canvas.configure(yscrollcommand=v_scrollbar.set, xscrollcommand=h_scrollbar.set)
+        self.canvas.configure(yscrollcommand=self.v_scrollbar.set, xscrollcommand=h_scrollbar.set)
         
-        v_scrollbar.pack(side="right", fill="y")
+        self.v_scrollbar.pack(side="right", fill="y")
         h_scrollbar.pack(side="bottom", fill="x")
         self.canvas.pack(side="left", fill="both", expand=True)
         
@@ -84,6 +2414,10 @@ class ThumbnailEditor:
         tk.Button(button_frame, text="プレビュー", command=self.preview_correction).pack(side='left', padx=5)
         tk.Button(button_frame, text="適用", command=self.apply_points, bg='lightgreen').pack(side='left', padx=5)
         tk.Button(button_frame, text="キャンセル", command=self.cancel).pack(side='left', padx=5)
+        
+        self.live_preview = tk.BooleanVar(value=True)
+        tk.Checkbutton(button_frame, text="ライブプレビュー", variable=self.live_preview,
+                       command=self.toggle_live_preview).pack(side='left', padx=5)
     
     def load_initial_frame(self):
         """初期フレームを読み込み"""
@@ -96,27 +2430,80 @@ class ThumbnailEditor:
                 int(self.preview_s.get()) + 
                 int(self.preview_ms.get()) / 1000.0)
     
-    def update_frame(self):
+    def set_preview_time(self, seconds):
+        """プレビュー時間のスピンボックスを設定"""
+        seconds = max(0.0, seconds)
+        total_ms = int(round(seconds * 1000))
+        values = [
+            (self.preview_h, f"{total_ms // 3600000:02d}"),
+            (self.preview_m, f"{total_ms // 60000 % 60:02d}"),
+            (self.preview_s, f"{total_ms // 1000 % 60:02d}"),
+            (self.preview_ms, f"{total_ms % 1000:03d}"),
+        ]
+        for spinbox, value in values:
+            spinbox.delete(0, tk.END)
+            spinbox.insert(0, value)
+    
+    def step_frame(self, delta):
+        """表示フレームを前後に移動"""
+        new_time = min(max(0.0, self.get_preview_time() + delta), self.video_info.duration)
+        self.set_preview_time(new_time)
+        self.update_frame(keep_points=True)
+    
+    def update_sprite_status(self):
+        """サムネイル作成の進み具合を表示（完了するまで定期的に更新）"""
+        if not self.window.winfo_exists():
+            return
+        if self.sprite.complete:
+            self.scrub_label.config(text=f"サムネイル {self.sprite.available} 枚")
+        else:
+            self.scrub_label.config(text=f"サムネイル作成中... {self.sprite.available} 枚")
+            self.window.after(1000, self.update_sprite_status)
+    
+    def on_scrub(self, value):
+        """スクラバー移動中は最も近いサムネイルを即座に表示"""
+        seconds = float(value)
+        self.set_preview_time(seconds)
+        
+        tile = self.sprite.nearest(seconds)
+        if tile is not None and self.current_frame is not None and self.display_frame is not None:
+            image, _ = tile
+            preview = cv2.resize(np.asarray(image), (self.display_frame.width(), self.display_frame.height()))
+            self.scrub_image = ImageTk.PhotoImage(Image.fromarray(preview))
+            self.canvas.itemconfig(self.image_item, image=self.scrub_image)
+        
+        # 動きが止まったら実フレームを読み込む
+        if self.scrub_after_id is not None:
+            self.window.after_cancel(self.scrub_after_id)
+        self.scrub_after_id = self.window.after(300, self.load_scrub_frame)
+    
+    def load_scrub_frame(self):
+        """スクラバーの位置の実フレームを読み込む"""
+        if self.scrub_after_id is not None:
+            self.window.after_cancel(self.scrub_after_id)
+            self.scrub_after_id = None
+        self.set_preview_time(self.scrub_var.get())
+        self.update_frame(keep_points=True)
+    
+    def update_frame(self, keep_points=False):
         """指定時間のフレームを更新"""
         try:
             preview_time = self.get_preview_time()
-            if preview_time > self.video_info['duration']:
+            if preview_time > self.video_info.duration:
                 messagebox.showerror("エラー", "指定時間が動画の長さを超えています")
                 return
             
-            cap = cv2.VideoCapture(self.video_path)
-            
-            # 指定時間のフレームに移動
-            frame_number = int(preview_time * self.video_info['fps'])
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
-            
-            ret, frame = cap.read()
-            cap.release()
+            # 常駐デコーダーから取得（キャッシュ済みなら即座に返る）
+            frame = self.decoder.get_frame(preview_time)
+            ret = frame is not None
             
             if ret:
                 self.current_frame = frame
                 self.display_frame_on_canvas()
-                self.initialize_points()
+                if keep_points and len(self.points) == 4:
+                    self.draw_points()
+                else:
+                    self.initialize_points()
             else:
                 messagebox.showerror("エラー", "フレームの読み込みに失敗しました")
                 
@@ -145,8 +2532,9 @@ class ThumbnailEditor:
         new_width = int(frame_width * self.scale_factor)
         new_height = int(frame_height * self.scale_factor)
         
-        # リサイズ
+        # リサイズ（ライブプレビューはこの縮小画像を補正する）
         frame_resized = cv2.resize(frame_rgb, (new_width, new_height))
+        self.display_rgb = frame_resized
         
         # PIL Imageに変換
         pil_image = Image.fromarray(frame_resized)
@@ -154,7 +2542,8 @@ class ThumbnailEditor:
         
         # キャンバスクリアして画像表示
         self.canvas.delete("all")
-        self.canvas.create_image(0, 0, anchor="nw", image=self.display_frame)
+        self.point_items = None
+        self.image_item = self.canvas.create_image(0, 0, anchor="nw", image=self.display_frame)
         
         # キャンバスのスクロール領域を設定
         self.canvas.configure(scrollregion=self.canvas.bbox("all"))
@@ -164,9 +2553,7 @@ class ThumbnailEditor:
         if self.current_frame is None:
             return
         
-        frame_height, frame_width = self.current_frame.shape[:2]
-        
-        # 現在の座標を取得（メインウィンドウから）
+        # 現在の座標を取得（メインウィンドウから、元動画の解像度）
         try:
             current_points = [
                 (float(self.point_entries[0][0].get()), float(self.point_entries[0][1].get())),  # 左上
@@ -178,14 +2565,16 @@ class ThumbnailEditor:
             # デフォルト値を使用
             current_points = [
                 (0, 0),
-                (frame_width, 0),
-                (0, frame_height),
-                (frame_width, frame_height)
+                (self.video_info.width, 0),
+                (0, self.video_info.height),
+                (self.video_info.width, self.video_info.height)
             ]
         
         # スケールを適用した座標に変換
         self.points = []
         for x, y in current_points:
+            if self.proxy is not None:
+                x, y = x / self.proxy.scale_x, y / self.proxy.scale_y
             scaled_x = x * self.scale_factor
             scaled_y = y * self.scale_factor
             self.points.append([scaled_x, scaled_y])
@@ -193,30 +2582,73 @@ class ThumbnailEditor:
         self.draw_points()
     
     def draw_points(self):
-        """4点と台形を描画"""
-        # 既存の点と線を削除
-        self.canvas.delete("point")
-        self.canvas.delete("line")
-        
+        """4点と台形を描画（2回目以降は既存アイテムの座標だけを更新）"""
         if len(self.points) != 4:
+            # 既存の点と線を削除
+            self.canvas.delete("point")
+            self.canvas.delete("line")
+            self.point_items = None
             return
         
-        # 台形の線を描画
+        if self.point_items is None:
+            # 台形の線・点の円・ラベルを作成
+            point_labels = ["左上", "右上", "左下", "右下"]
+            lines = [self.canvas.create_line(0, 0, 0, 0, fill="red", width=2, tags="line")
+                     for _ in range(4)]
+            ovals = [self.canvas.create_oval(0, 0, 0, 0, fill="blue", outline="white", width=2, tags="point")
+                     for _ in range(4)]
+            labels = [self.canvas.create_text(0, 0, text=point_labels[i], fill="yellow",
+                                              font=("Arial", 10, "bold"), tags="point")
+                      for i in range(4)]
+            self.point_items = (lines, ovals, labels)
+        
+        lines, ovals, labels = self.point_items
         for i in range(4):
             start = self.points[i]
             end = self.points[(i + 1) % 4]
-            self.canvas.create_line(start[0], start[1], end[0], end[1], 
-                                  fill="red", width=2, tags="line")
-        
-        # 点を描画
-        point_labels = ["左上", "右上", "左下", "右下"]
+            self.canvas.coords(lines[i], start[0], start[1], end[0], end[1])
         for i, (x, y) in enumerate(self.points):
-            # 点の円
-            self.canvas.create_oval(x-8, y-8, x+8, y+8, 
-                                  fill="blue", outline="white", width=2, tags="point")
-            # ラベル
-            self.canvas.create_text(x, y-15, text=point_labels[i], 
-                                  fill="yellow", font=("Arial", 10, "bold"), tags="point")
+            self.canvas.coords(ovals[i], x-8, y-8, x+8, y+8)
+            self.canvas.coords(labels[i], x, y-15)
+        
+        self.schedule_live_preview()
+    
+    def schedule_live_preview(self):
+        """ライブプレビューの更新を予約（画面更新間隔に間引く）"""
+        if not self.live_preview.get() or self.live_after_id is not None:
+            return
+        self.live_after_id = self.window.after(16, self.render_live_preview)
+    
+    def render_live_preview(self):
+        """表示解像度のフレームに台形補正をかけて右側に表示"""
+        self.live_after_id = None
+        if self.display_rgb is None or len(self.points) != 4:
+            return
+        
+        height, width = self.display_rgb.shape[:2]
+        src_points = np.float32(self.points)
+        dst_points = np.float32([
+            [0, 0],
+            [width, 0],
+            [0, height],
+            [width, height]
+        ])
+        try:
+            matrix = cv2.getPerspectiveTransform(src_points, dst_points)
+            corrected = cv2.warpPerspective(self.display_rgb, matrix, (width, height))
+        except cv2.error:
+            return
+        
+        self.live_image = ImageTk.PhotoImage(Image.fromarray(corrected))
+        self.live_canvas.itemconfig(self.live_item, image=self.live_image)
+    
+    def toggle_live_preview(self):
+        """ライブプレビューの表示切り替え"""
+        if self.live_preview.get():
+            self.live_canvas.pack(side="right", padx=(10, 0), before=self.v_scrollbar)
+            self.schedule_live_preview()
+        else:
+            self.live_canvas.pack_forget()
     
     def on_canvas_click(self, event):
         """キャンバスクリック時の処理"""
@@ -341,6 +2773,8 @@ class ThumbnailEditor:
         for i, (x, y) in enumerate(self.points):
             original_x = x / self.scale_factor
             original_y = y / self.scale_factor
+            if self.proxy is not None:
+                original_x, original_y = self.proxy.to_source(original_x, original_y)
             
             self.point_entries[i][0].delete(0, tk.END)
             self.point_entries[i][0].insert(0, str(int(original_x)))
@@ -348,154 +2782,121 @@ class ThumbnailEditor:
             self.point_entries[i][1].insert(0, str(int(original_y)))
         
         messagebox.showinfo("完了", "台形補正の座標が適用されました")
-        self.window.destroy()
+        self.close()
     
     def cancel(self):
         """キャンセル"""
+        self.close()
+    
+    def close(self):
+        """デコーダーを解放してウィンドウを閉じる"""
+        self.decoder.close()
         self.window.destroy()
 
 
 class VideoEditor:
+    # 帯分割で変換するときのFramePipelineの変換スレッド数（前後のフレームの変換を重ねる分だけ）
+    BAND_PIPELINE_WORKERS = 2
+    
     def __init__(self, root):
         self.root = root
         self.root.title("超簡単動画編集アプリ (GPU対応)")
-        self.root.geometry("650x850")  # 縦を100ピクセル拡大
+        self.root.geometry("650x850")
         
         self.video_path = None
         self.video_info = None
         self.perspective_points = []
-        self.available_gpus = self.detect_gpu_support()
+        self.metrics = JobMetrics()
+        
+        # エンコーダー検出結果はキャッシュから即座に読み込み、検証・再検出はバックグラウンドで行う
+        self.encoder_capabilities = lookup_cached_capabilities()
+        self.available_gpus = self.get_encoder_options(self.encoder_capabilities)
         
         self.setup_ui()
+        self.start_encoder_detection()
     
-    def detect_gpu_support(self):
+    def get_encoder_options(self, capabilities):
+        """検出結果からエンコーダーの選択肢を作成（未検出ならCPUエンコーダーのみ）
+        
+        先頭は計測結果から選ぶ「自動」。未計測の場合は次の選択肢（最適なエンコーダー）を使う。
+        """
+        if capabilities is None:
+            return [AUTO_ENCODER_OPTION] + list(DEFAULT_ENCODER_OPTIONS)
+        return [AUTO_ENCODER_OPTION] + [tuple(option) for option in capabilities['options']]
+    
+    def detect_gpu_support(self, force=False):
         """利用可能なGPUエンコーダーを検出"""
-        gpu_options = []
+        capabilities = probe_encoder_capabilities(force)
+        if capabilities is None:
+            return capabilities, [('CPU (OpenCV)', 'opencv')]
+        return capabilities, self.get_encoder_options(capabilities)
+    
+    def start_encoder_detection(self, force=False):
+        """エンコーダー検出をバックグラウンドで実行し、完了したら選択肢を更新"""
+        if self.encoder_capabilities is None or force:
+            self.diag_label.config(text="エンコーダー検出中...", fg='blue')
         
-        try:
-            # ffmpegの存在確認
-            result = subprocess.run(['ffmpeg', '-version'], 
-                                  capture_output=True, text=True, 
-                                  creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-                                  timeout=10)
-            
-            if result.returncode != 0:
-                print("ffmpegが見つかりません")
-                return [('CPU (OpenCV)', 'opencv')]
-            
-            print("ffmpeg検出成功")
-            
-            # NVIDIA GPU情報を詳しく確認
-            try:
-                nvidia_smi = subprocess.run(['nvidia-smi'], capture_output=True, text=True,
-                                          creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-                                          timeout=10)
-                if nvidia_smi.returncode == 0:
-                    print("NVIDIA GPU検出:", nvidia_smi.stdout.split('\n')[8:12])  # GPU情報行
-                else:
-                    print("nvidia-smi実行失敗またはNVIDIA GPUなし")
-            except:
-                print("nvidia-smi not found - NVIDIA GPUが無いか、ドライバー未インストール")
-            
-            # エンコーダー一覧を取得
-            result = subprocess.run(['ffmpeg', '-encoders'], 
-                                  capture_output=True, text=True, 
-                                  creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-                                  timeout=10)
-            encoders = result.stdout
-            print("利用可能エンコーダー確認中...")
-            
-            # NVENC詳細テスト
-            if 'h264_nvenc' in encoders:
-                print("h264_nvenc がエンコーダーリストに存在")
-                
-                # より詳細なNVENCテスト（エラー情報付き）
-                test_cmd = ['ffmpeg', '-f', 'lavfi', '-i', 'testsrc=duration=0.1:size=320x240:rate=1', 
-                           '-c:v', 'h264_nvenc', '-preset', 'fast', '-f', 'null', '-', '-v', 'error']
-                try:
-                    test_result = subprocess.run(test_cmd, capture_output=True, text=True, 
-                                               creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-                                               timeout=15)
-                    
-                    if test_result.returncode == 0:
-                        gpu_options.append(('NVIDIA GPU (H.264)', 'h264_nvenc'))
-                        print("✅ NVENC H.264 使用可能")
-                    else:
-                        print(f"❌ NVENC H.264 テスト失敗:")
-                        print(f"stderr: {test_result.stderr}")
-                        # 詳細なエラー分析
-                        if "Driver does not support the required nvenc API version" in test_result.stderr:
-                            print("→ NVIDIAドライバーが古すぎます")
-                        elif "Cannot load nvcuda.dll" in test_result.stderr:
-                            print("→ CUDA ドライバーの問題")
-                        elif "No NVENC capable devices found" in test_result.stderr:
-                            print("→ NVENC対応GPUが見つかりません")
-                        else:
-                            print("→ その他のNVENC問題")
-                            
-                except subprocess.TimeoutExpired:
-                    print("❌ NVENC テストがタイムアウト")
-                except Exception as e:
-                    print(f"❌ NVENC テスト例外: {e}")
-            else:
-                print("h264_nvenc がエンコーダーリストに存在しません")
-            
-            # H.265 NVENC テスト
-            if 'hevc_nvenc' in encoders:
-                test_cmd = ['ffmpeg', '-f', 'lavfi', '-i', 'testsrc=duration=0.1:size=320x240:rate=1', 
-                           '-c:v', 'hevc_nvenc', '-preset', 'fast', '-f', 'null', '-', '-v', 'error']
-                try:
-                    test_result = subprocess.run(test_cmd, capture_output=True, text=True, 
-                                               creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-                                               timeout=15)
-                    if test_result.returncode == 0:
-                        gpu_options.append(('NVIDIA GPU (H.265)', 'hevc_nvenc'))
-                        print("✅ NVENC H.265 使用可能")
-                    else:
-                        print(f"❌ NVENC H.265 テスト失敗: {test_result.stderr}")
-                except:
-                    print("❌ NVENC H.265 テスト例外")
-            
-            # Intel QuickSync テスト
-            if 'h264_qsv' in encoders:
-                test_cmd = ['ffmpeg', '-f', 'lavfi', '-i', 'testsrc=duration=0.1:size=320x240:rate=1', 
-                           '-c:v', 'h264_qsv', '-f', 'null', '-', '-v', 'error']
-                try:
-                    test_result = subprocess.run(test_cmd, capture_output=True, text=True, 
-                                               creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-                                               timeout=15)
-                    if test_result.returncode == 0:
-                        gpu_options.append(('Intel QuickSync (H.264)', 'h264_qsv'))
-                        print("✅ Intel QSV H.264 使用可能")
-                    else:
-                        print(f"❌ Intel QSV H.264 使用不可: {test_result.stderr}")
-                except:
-                    print("❌ Intel QSV テスト例外")
-                    
-            if 'hevc_qsv' in encoders:
-                gpu_options.append(('Intel QuickSync (H.265)', 'hevc_qsv'))
-            
-            # CPU エンコーダー
-            if 'libx264' in encoders:
-                gpu_options.append(('CPU (H.264)', 'libx264'))
-                print("✅ CPU H.264 使用可能")
-                
-        except subprocess.TimeoutExpired:
-            print("ffmpegコマンドがタイムアウトしました")
-        except FileNotFoundError:
-            print("ffmpegが見つかりません。")
-        except Exception as e:
-            print(f"GPU検出エラー: {e}")
+        def detect():
+            capabilities, options = self.detect_gpu_support(force)
+            self.root.after(0, lambda: self.apply_encoder_options(capabilities, options))
         
-        # OpenCV フォールバック（最も安全）
-        gpu_options.append(('CPU (OpenCV)', 'opencv'))
-        print("✅ CPU OpenCV 使用可能")
+        thread = threading.Thread(target=detect)
+        thread.daemon = True
+        thread.start()
+    
+    def apply_encoder_options(self, capabilities, options):
+        """検出結果をエンコーダーの選択肢に反映（選択中のエンコーダーは可能なら維持）"""
+        # 検出前の仮の選択肢から選ばれていた場合は、検出結果の先頭（最適なエンコーダー）を選ぶ
+        was_default = self.available_gpus == self.get_encoder_options(None)
+        self.encoder_capabilities = capabilities
+        self.available_gpus = options
+        
+        selected = self.encoder_var.get()
+        names = [option[0] for option in options]
+        self.encoder_combo.config(values=names)
+        if selected in names and not was_default:
+            self.encoder_combo.current(names.index(selected))
+        elif names:
+            self.encoder_combo.current(0)
+        
+        if self.diag_label.cget('text') == "エンコーダー検出中...":
+            self.diag_label.config(text="エンコーダー検出完了", fg='blue')
+    
+    def create_scrollable_frame(self, parent):
+        """縦スクロールできる領域を作り、中身を配置するフレームを返す"""
+        canvas = tk.Canvas(parent, highlightthickness=0)
+        scrollbar = ttk.Scrollbar(parent, orient="vertical", command=canvas.yview)
+        body = tk.Frame(canvas)
+        window = canvas.create_window((0, 0), window=body, anchor='nw')
+        
+        body.bind('<Configure>', lambda e: canvas.configure(scrollregion=canvas.bbox('all')))
+        canvas.bind('<Configure>', lambda e: canvas.itemconfigure(window, width=e.width))
+        canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side='right', fill='y')
+        canvas.pack(side='left', fill='both', expand=True)
         
-        return gpu_options if gpu_options else [('CPU (OpenCV)', 'opencv')]
+        # ホイールはカーソルが領域内にあるときだけスクロールに使う（Windows・macOSは<MouseWheel>、X11はButton-4/5）
+        def on_wheel(event):
+            widget = canvas.winfo_containing(event.x_root, event.y_root)
+            if widget is None or not str(widget).startswith(str(canvas)):
+                return
+            if event.num == 4 or event.delta > 0:
+                canvas.yview_scroll(-1, 'units')
+            elif event.num == 5 or event.delta < 0:
+                canvas.yview_scroll(1, 'units')
+        
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            canvas.bind_all(sequence, on_wheel, add='+')
+        return body
     
     def setup_ui(self):
+        # 進捗と実行ボタンは常に見えるよう下端に固定し、設定項目はスクロールできる領域に並べる
+        bottom_frame = tk.Frame(self.root)
+        bottom_frame.pack(side='bottom', fill='x')
+        settings_frame = self.create_scrollable_frame(self.root)
+        
         # ファイル選択
-        file_frame = tk.Frame(self.root)
+        file_frame = tk.Frame(settings_frame)
         file_frame.pack(pady=10, fill='x', padx=10)
         
         tk.Button(file_frame, text="動画ファイルを選択", command=self.select_video).pack(side='left')
@@ -503,7 +2904,7 @@ class VideoEditor:
         self.file_label.pack(side='left', padx=(10, 0))
         
         # GPU設定とディagnostic
-        gpu_frame = tk.LabelFrame(self.root, text="エンコード設定")
+        gpu_frame = tk.LabelFrame(settings_frame, text="エンコード設定")
         gpu_frame.pack(pady=10, fill='x', padx=10)
         
         tk.Label(gpu_frame, text="エンコーダー:").pack(anchor='w', padx=10, pady=2)
@@ -520,6 +2921,7 @@ class VideoEditor:
         diag_frame.pack(fill='x', padx=10, pady=2)
         tk.Button(diag_frame, text="🔍 GPU診断", command=self.show_gpu_diagnostics, 
                  bg='lightcyan').pack(side='left')
+        tk.Button(diag_frame, text="⏱ エンコーダー計測", command=self.start_encoder_calibration).pack(side='left', padx=5)
         self.diag_label = tk.Label(diag_frame, text="", fg='blue', font=('Arial', 8))
         self.diag_label.pack(side='left', padx=10)
         
@@ -529,13 +2931,18 @@ class VideoEditor:
         tk.Label(quality_frame, text="品質:").pack(side='left')
         self.quality_var = tk.StringVar(value="高品質")
         quality_combo = ttk.Combobox(quality_frame, textvariable=self.quality_var,
-                                   values=["最高品質", "高品質", "標準品質", "高速"],
+                                   values=QUALITY_NAMES,
                                    state='readonly', width=15)
         quality_combo.pack(side='left', padx=5)
         quality_combo.current(1)
         
+        # 自動選択時のサイズ上限（0で無制限）
+        tk.Label(quality_frame, text="サイズ上限(MB/分):").pack(side='left', padx=(10, 0))
+        self.size_budget_spin = tk.Spinbox(quality_frame, from_=0, to=10000, increment=10, width=6)
+        self.size_budget_spin.pack(side='left', padx=2)
+        
         # 動画情報表示
-        info_frame = tk.LabelFrame(self.root, text="動画情報")
+        info_frame = tk.LabelFrame(settings_frame, text="動画情報")
         info_frame.pack(pady=10, fill='x', padx=10)
         
         self.duration_label = tk.Label(info_frame, text="合計時間: --")
@@ -545,7 +2952,7 @@ class VideoEditor:
         self.resolution_label.pack(anchor='w', padx=10, pady=5)
         
         # 切り抜き設定
-        trim_frame = tk.LabelFrame(self.root, text="切り抜き設定")
+        trim_frame = tk.LabelFrame(settings_frame, text="切り抜き設定")
         trim_frame.pack(pady=10, fill='x', padx=10)
         
         start_frame = tk.Frame(trim_frame)
@@ -580,13 +2987,70 @@ class VideoEditor:
         self.end_ms.pack(side='left', padx=2)
         tk.Label(end_frame, text="ミリ秒").pack(side='left')
         
+        # スマートカット（台形補正なしの場合のみ有効）
+        self.use_smart_cut = tk.BooleanVar(value=False)
+        tk.Checkbutton(trim_frame, text="スマートカット（端のGOPのみ再エンコード、台形補正なし時）",
+                       variable=self.use_smart_cut).pack(anchor='w', padx=10, pady=2)
+        
+        # 長時間の書き出しを区切って保存し、中断しても同じ設定の再実行で続きから処理する
+        self.use_resumable = tk.BooleanVar(value=False)
+        tk.Checkbutton(trim_frame, text="途中から再開できるように書き出す（台形補正・サイズ変更時）",
+                       variable=self.use_resumable).pack(anchor='w', padx=10, pady=2)
+        
+        # 配信の待機画面などの動かない区間は、前のフレームの補正結果を使い回す
+        self.use_static_skip = tk.BooleanVar(value=False)
+        tk.Checkbutton(trim_frame, text="静止フレームの台形補正を省略（OpenCV方式）",
+                       variable=self.use_static_skip).pack(anchor='w', padx=10, pady=2)
+        
+        # 重複フレームを削除して可変フレームレートで出力（ファイルサイズとエンコード時間を減らす）
+        self.use_drop_duplicates = tk.BooleanVar(value=False)
+        tk.Checkbutton(trim_frame, text="重複フレームを削除（可変フレームレートで出力）",
+                       variable=self.use_drop_duplicates).pack(anchor='w', padx=10, pady=2)
+        
         # 台形補正設定（オプション）
-        perspective_frame = tk.LabelFrame(self.root, text="台形補正設定（オプション）")
+        perspective_frame = tk.LabelFrame(settings_frame, text="台形補正設定（オプション）")
         perspective_frame.pack(pady=10, fill='x', padx=10)
         
         self.use_perspective = tk.BooleanVar()
         tk.Checkbutton(perspective_frame, text="台形補正を使用", variable=self.use_perspective).pack(anchor='w', padx=10, pady=5)
         
+        # ffmpegのperspectiveフィルターで補正（失敗時はOpenCV方式にフォールバック）
+        self.use_native_perspective = tk.BooleanVar(value=True)
+        tk.Checkbutton(perspective_frame, text="ffmpegフィルターで高速補正（失敗時はOpenCV）",
+                       variable=self.use_native_perspective).pack(anchor='w', padx=10)
+        
+        # OpenCV方式でもyuv420pの動画はBGRに変換せずYUVのまま補正する
+        self.use_yuv_warp = tk.BooleanVar(value=True)
+        tk.Checkbutton(perspective_frame, text="OpenCV方式をYUVのまま補正（yuv420pの動画、色変換なし）",
+                       variable=self.use_yuv_warp).pack(anchor='w', padx=10)
+        
+        # OpenCV方式のマルチプロセス並列処理
+        parallel_frame = tk.Frame(perspective_frame)
+        parallel_frame.pack(fill='x', padx=10)
+        self.use_parallel = tk.BooleanVar(value=False)
+        tk.Checkbutton(parallel_frame, text="OpenCV方式を並列処理", variable=self.use_parallel).pack(side='left')
+        tk.Label(parallel_frame, text="分割数:").pack(side='left', padx=(10, 0))
+        self.segment_count_spin = tk.Spinbox(parallel_frame, from_=1, to=256, width=4)
+        self.segment_count_spin.delete(0, tk.END)
+        self.segment_count_spin.insert(0, str(os.cpu_count() or 1))
+        self.segment_count_spin.pack(side='left', padx=2)
+        tk.Label(parallel_frame, text="メモリ上限(MB):").pack(side='left', padx=(10, 0))
+        self.pipeline_memory_spin = tk.Spinbox(parallel_frame, from_=64, to=65536, increment=64, width=6)
+        self.pipeline_memory_spin.delete(0, tk.END)
+        self.pipeline_memory_spin.insert(0, str(FramePipeline.MEMORY_BUDGET // (1024 * 1024)))
+        self.pipeline_memory_spin.pack(side='left', padx=2)
+        
+        # 大きなフレームは横方向の帯に分けて並列に変換する（0は出力サイズとCPUコア数から自動）
+        band_frame = tk.Frame(perspective_frame)
+        band_frame.pack(fill='x', padx=10)
+        tk.Label(band_frame, text="変換の帯分割数:").pack(side='left')
+        self.warp_bands_spin = tk.Spinbox(band_frame, from_=0, to=256, width=4)
+        self.warp_bands_spin.pack(side='left', padx=2)
+        tk.Label(band_frame, text="スレッド数:").pack(side='left', padx=(10, 0))
+        self.warp_threads_spin = tk.Spinbox(band_frame, from_=0, to=256, width=4)
+        self.warp_threads_spin.pack(side='left', padx=2)
+        tk.Label(band_frame, text="(0で自動)", fg='gray').pack(side='left', padx=5)
+        
         # 視覚的設定ボタン
         visual_button_frame = tk.Frame(perspective_frame)
         visual_button_frame.pack(fill='x', padx=10, pady=5)
@@ -598,6 +3062,11 @@ class VideoEditor:
         
         tk.Label(visual_button_frame, text="← 動画を選択後に使用可能", fg='gray').pack(side='left', padx=10)
         
+        # 大きな動画は低解像度のプロキシで編集する（書き出しには元動画を使う）
+        self.use_proxy = tk.BooleanVar(value=False)
+        tk.Checkbutton(perspective_frame, text="編集用に低解像度のプロキシを作成（4Kなどの大きな動画向け）",
+                       variable=self.use_proxy, command=self.start_proxy_build).pack(anchor='w', padx=10)
+        
         points_frame = tk.Frame(perspective_frame)
         points_frame.pack(fill='x', padx=10, pady=5)
         
@@ -616,8 +3085,34 @@ class VideoEditor:
             y_entry.pack(side='left', padx=2)
             self.point_entries.append((x_entry, y_entry))
         
+        # 出力サイズ設定（台形補正と同じ1回の変換で切り抜き・縮小する）
+        output_frame = tk.LabelFrame(settings_frame, text="出力サイズ設定（オプション）")
+        output_frame.pack(pady=10, fill='x', padx=10)
+        
+        size_frame = tk.Frame(output_frame)
+        size_frame.pack(fill='x', padx=10, pady=5)
+        tk.Label(size_frame, text="解像度:").pack(side='left')
+        self.output_resolution_var = tk.StringVar(value="元のまま")
+        ttk.Combobox(size_frame, textvariable=self.output_resolution_var, values=list(OUTPUT_RESOLUTIONS),
+                     state='readonly', width=10).pack(side='left', padx=5)
+        tk.Label(size_frame, text="縦横比:").pack(side='left', padx=(10, 0))
+        self.output_aspect_var = tk.StringVar(value="元のまま")
+        ttk.Combobox(size_frame, textvariable=self.output_aspect_var, values=list(OUTPUT_ASPECTS),
+                     state='readonly', width=10).pack(side='left', padx=5)
+        
+        crop_frame = tk.Frame(output_frame)
+        crop_frame.pack(fill='x', padx=10, pady=(0, 5))
+        tk.Label(crop_frame, text="切り抜き:").pack(side='left')
+        self.crop_entries = []
+        for label in ["X:", "Y:", "幅:", "高さ:"]:
+            tk.Label(crop_frame, text=label).pack(side='left')
+            entry = tk.Entry(crop_frame, width=6)
+            entry.pack(side='left', padx=2)
+            self.crop_entries.append(entry)
+        tk.Label(crop_frame, text="（空欄で全体）", fg='gray').pack(side='left', padx=5)
+        
         # 進捗表示
-        progress_frame = tk.LabelFrame(self.root, text="進捗")
+        progress_frame = tk.LabelFrame(bottom_frame, text="進捗")
         progress_frame.pack(pady=10, fill='x', padx=10)
         
         self.progress_bar = ttk.Progressbar(progress_frame, mode='determinate')
@@ -626,8 +3121,18 @@ class VideoEditor:
         self.progress_label = tk.Label(progress_frame, text="待機中...")
         self.progress_label.pack(padx=10, pady=5)
         
+        # 処理の内訳（段階ごとの累計時間・回数・1回あたりの時間・データ量）
+        self.metrics_label = tk.Label(progress_frame, text="", font=('Consolas', 8), justify='left', anchor='w')
+        self.metrics_label.pack(fill='x', padx=10)
+        self.use_profiling = tk.BooleanVar(value=False)
+        tk.Checkbutton(progress_frame, text="プロファイルを保存 (cProfile)",
+                       variable=self.use_profiling).pack(anchor='w', padx=10)
+        
         # 実行ボタン
-        tk.Button(self.root, text="動画を処理", command=self.process_video, bg='lightgreen').pack(pady=20)
+        run_frame = tk.Frame(bottom_frame)
+        run_frame.pack(pady=10)
+        tk.Button(run_frame, text="動画を処理", command=self.process_video, bg='lightgreen').pack(side='left', padx=5)
+        tk.Button(run_frame, text="複数クリップ書き出し", command=self.open_clip_list_dialog).pack(side='left', padx=5)
     
     def select_video(self):
         file_path = filedialog.askopenfilename(
@@ -640,30 +3145,47 @@ class VideoEditor:
             self.get_video_info()
             # 視覚的設定ボタンを有効化
             self.visual_button.config(state='normal')
+            # シーク用のパケット索引とスクラバー用のサムネイルをバックグラウンドで作成
+            self.start_index_build(file_path)
+            if self.video_info is not None and self.video_info.path == file_path:
+                ThumbnailSprite.get(file_path, self.video_info).start_build()
+                self.start_proxy_build()
+    
+    def start_proxy_build(self):
+        """プロキシを使う設定なら、編集用のプロキシをバックグラウンドで作成"""
+        if not self.use_proxy.get() or not self.video_path or self.video_info is None:
+            return
+        ProxyVideo.get(self.video_path, self.video_info).start_build()
+    
+    def start_index_build(self, video_path):
+        """パケット索引をバックグラウンドで作成（キャッシュがあれば即座に終わる）"""
+        def build():
+            try:
+                PacketIndex.load(video_path)
+            except Exception as e:
+                print(f"パケット索引の作成に失敗（通常のシークを使用します）: {e}")
+        
+        thread = threading.Thread(target=build)
+        thread.daemon = True
+        thread.start()
     
     def get_video_info(self):
         try:
-            # OpenCVを使用して動画情報を取得
-            cap = cv2.VideoCapture(self.video_path)
-            
-            if not cap.isOpened():
-                raise Exception("動画ファイルを開けません")
-            
-            # 動画情報を取得
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-            
-            # 総時間を計算
-            duration = frame_count / fps if fps > 0 else 0
-            duration_str = str(timedelta(seconds=int(duration)))
+            # ffprobeで動画情報を取得（使えない場合はOpenCV）
+            try:
+                media_info = probe_media_info(self.video_path)
+            except Exception as e:
+                print(f"ffprobeでの情報取得に失敗、OpenCVを使用します: {e}")
+                media_info = read_media_info_opencv(self.video_path)
             
-            cap.release()
+            width = media_info.width
+            height = media_info.height
+            duration_str = str(timedelta(seconds=int(media_info.duration)))
             
             # 情報を表示
             self.duration_label.config(text=f"合計時間: {duration_str}")
-            self.resolution_label.config(text=f"画質: {width}x{height}")
+            rate_str = f"{media_info.fps:.2f}fps" + (" (可変フレームレート)" if media_info.is_vfr else "")
+            self.resolution_label.config(text=f"画質: {width}x{height} / {rate_str}")
             
             # デフォルトの台形補正座標を設定
             default_coords = [
@@ -679,18 +3201,42 @@ class VideoEditor:
                 self.point_entries[i][1].delete(0, tk.END)
                 self.point_entries[i][1].insert(0, y)
             
-            self.video_info = {
-                'width': width,
-                'height': height,
-                'fps': fps,
-                'duration': duration,
-                'frame_count': frame_count
-            }
+            self.video_info = media_info
             
         except Exception as e:
             messagebox.showerror("エラー", f"動画情報の取得に失敗しました: {str(e)}")
             print(f"詳細エラー: {e}")
     
+    def start_encoder_calibration(self):
+        """選択中の動画の解像度で各エンコーダー×品質を計測し、自動選択用のプロファイルに保存"""
+        if not self.video_path or not self.video_info:
+            messagebox.showerror("エラー", "計測に使う動画ファイルを選択してください")
+            return
+        
+        encoders = [code for _, code in self.available_gpus if code not in ('auto', 'opencv')]
+        if not encoders:
+            messagebox.showerror("エラー", "計測できるffmpegエンコーダーがありません")
+            return
+        
+        def progress(number, total, encoder, quality):
+            self.root.after(0, lambda: self.update_progress(
+                (number - 1) / total * 100, f"エンコーダー計測中... {encoder} / {quality} ({number}/{total})"))
+        
+        def calibrate():
+            results = calibrate_encoders(self.video_path, self.video_info, encoders,
+                                         self.get_quality_settings, progress)
+            if results:
+                fastest = max(results, key=lambda result: result['fps'])
+                message = f"計測完了: {len(results)} 件（最速 {fastest['encoder']} {fastest['fps']:.0f}fps）"
+            else:
+                message = "計測に失敗しました"
+            self.root.after(0, lambda: self.update_progress(100, message))
+            self.root.after(0, lambda: self.diag_label.config(text=message, fg='blue'))
+        
+        thread = threading.Thread(target=calibrate)
+        thread.daemon = True
+        thread.start()
+    
     def show_gpu_diagnostics(self):
         """GPU診断情報を表示するウィンドウ"""
         diag_window = tk.Toplevel(self.root)
@@ -708,79 +3254,47 @@ class VideoEditor:
         text_area.pack(side='left', fill='both', expand=True)
         scrollbar.config(command=text_area.yview)
         
-        # 診断情報を収集
+        # 再検出ボタン（キャッシュを使わずにテストをやり直す）
+        def redetect():
+            diag_window.destroy()
+            self.start_encoder_detection(force=True)
+        
+        tk.Button(diag_window, text="🔄 再検出", command=redetect).pack(pady=(0, 10))
+        
+        # 診断情報を収集（エンコーダー検出時の結果を使い、コマンドは再実行しない）
         diag_info = "=== GPU診断レポート ===\n\n"
+        capabilities = self.encoder_capabilities
         
         try:
             # システム情報
             diag_info += "1. システム情報\n"
             diag_info += f"OS: {os.name}\n"
             
-            # NVIDIA GPU確認
-            diag_info += "\n2. NVIDIA GPU確認\n"
-            try:
-                nvidia_smi = subprocess.run(['nvidia-smi', '--query-gpu=name,driver_version,cuda_version', '--format=csv'], 
-                                          capture_output=True, text=True,
-                                          creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-                                          timeout=10)
-                if nvidia_smi.returncode == 0:
-                    diag_info += nvidia_smi.stdout
-                else:
-                    diag_info += "nvidia-smi実行失敗\n"
-            except FileNotFoundError:
-                diag_info += "nvidia-smi not found (NVIDIAドライバー未インストール?)\n"
-            except Exception as e:
-                diag_info += f"nvidia-smi エラー: {e}\n"
-            
-            # ffmpeg バージョン
-            diag_info += "\n3. ffmpeg情報\n"
-            try:
-                ffmpeg_ver = subprocess.run(['ffmpeg', '-version'], 
-                                          capture_output=True, text=True,
-                                          creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-                                          timeout=10)
-                if ffmpeg_ver.returncode == 0:
-                    # 最初の数行のみ表示
-                    lines = ffmpeg_ver.stdout.split('\n')[:5]
-                    diag_info += '\n'.join(lines) + '\n'
-                else:
-                    diag_info += "ffmpeg バージョン取得失敗\n"
-            except Exception as e:
-                diag_info += f"ffmpeg エラー: {e}\n"
-            
-            # エンコーダー確認
-            diag_info += "\n4. エンコーダー確認\n"
-            try:
-                encoders = subprocess.run(['ffmpeg', '-encoders'], 
-                                        capture_output=True, text=True,
-                                        creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-                                        timeout=10)
-                if encoders.returncode == 0:
-                    # NVENC関連エンコーダーのみ抽出
-                    for line in encoders.stdout.split('\n'):
-                        if 'nvenc' in line.lower() or 'h264' in line.lower() or 'hevc' in line.lower():
-                            diag_info += line + '\n'
-                else:
-                    diag_info += "エンコーダー一覧取得失敗\n"
-            except Exception as e:
-                diag_info += f"エンコーダー確認エラー: {e}\n"
-            
-            # NVENC詳細テスト
-            diag_info += "\n5. NVENC詳細テスト\n"
-            test_cmd = ['ffmpeg', '-f', 'lavfi', '-i', 'testsrc=duration=0.1:size=320x240:rate=1', 
-                       '-c:v', 'h264_nvenc', '-preset', 'fast', '-f', 'null', '-']
-            try:
-                test_result = subprocess.run(test_cmd, capture_output=True, text=True,
-                                           creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
-                                           timeout=15)
-                diag_info += f"テストコマンド: {' '.join(test_cmd)}\n"
-                diag_info += f"戻り値: {test_result.returncode}\n"
-                if test_result.stderr:
-                    diag_info += f"エラー出力:\n{test_result.stderr}\n"
-                if test_result.stdout:
-                    diag_info += f"標準出力:\n{test_result.stdout}\n"
-            except Exception as e:
-                diag_info += f"NVENCテストエラー: {e}\n"
+            if capabilities is None:
+                diag_info += "\nエンコーダー検出中、またはffmpegが見つかりません。\n"
+                diag_info += "しばらく待ってから再度開くか、「再検出」を押してください。\n"
+            else:
+                # NVIDIA GPU確認
+                diag_info += "\n2. NVIDIA GPU確認\n"
+                diag_info += capabilities.get('nvidia_smi', '')
+                
+                # ffmpeg バージョン
+                diag_info += "\n3. ffmpeg情報\n"
+                diag_info += f"パス: {capabilities.get('path', '')}\n"
+                diag_info += capabilities.get('version_lines', '') + '\n'
+                
+                # エンコーダー確認
+                diag_info += "\n4. エンコーダー確認\n"
+                diag_info += capabilities.get('encoder_lines', '') + '\n'
+                
+                # テストエンコード結果
+                diag_info += "\n5. テストエンコード結果\n"
+                for encoder, test_result in capabilities.get('tests', {}).items():
+                    diag_info += f"[{encoder}]\n"
+                    diag_info += f"テストコマンド: {' '.join(test_result['cmd'])}\n"
+                    diag_info += f"戻り値: {test_result['returncode']}\n"
+                    if test_result['stderr']:
+                        diag_info += f"エラー出力:\n{test_result['stderr']}\n"
             
             # 推奨解決策
             diag_info += "\n6. 推奨解決策\n"
@@ -801,9 +3315,12 @@ class VideoEditor:
         text_area.config(state='disabled')  # 読み取り専用
         
         # 簡易診断結果をメインウィンドウにも表示
-        if "nvidia-smi not found" in diag_info:
+        nvenc_test = (capabilities or {}).get('tests', {}).get('h264_nvenc')
+        if capabilities is None:
+            return
+        elif "nvidia-smi not found" in diag_info:
             self.diag_label.config(text="NVIDIAドライバー未検出")
-        elif "戻り値: 0" in diag_info:
+        elif nvenc_test is not None and nvenc_test['returncode'] == 0:
             self.diag_label.config(text="NVENC利用可能", fg='green')
         else:
             self.diag_label.config(text="NVENC利用不可 (詳細は診断ウィンドウ参照)", fg='red')
@@ -814,7 +3331,13 @@ class VideoEditor:
             messagebox.showerror("エラー", "動画ファイルを選択してください")
             return
         
-        ThumbnailEditor(self.root, self.video_path, self.video_info, self.point_entries)
+        proxy = None
+        if self.use_proxy.get():
+            proxy = ProxyVideo.get(self.video_path, self.video_info)
+            if proxy.building:
+                print(f"プロキシ作成中 ({proxy.progress:.0f}%) のため元動画で表示します")
+        
+        ThumbnailEditor(self.root, self.video_path, self.video_info, self.point_entries, proxy=proxy)
     
     def get_time_in_seconds(self, h_spinbox, m_spinbox, s_spinbox, ms_spinbox=None):
         """時間を秒に変換（ミリ秒対応）"""
@@ -837,7 +3360,36 @@ class VideoEditor:
             encoder_code = 'opencv'  # デフォルト
         
         quality = self.quality_var.get()
+        if encoder_code == 'auto':
+            encoder_code, quality = self.resolve_auto_encoder(quality)
+        
+        return encoder_code, self.get_quality_settings(encoder_code, quality)
+    
+    def resolve_auto_encoder(self, quality):
+        """計測結果から、選択中の品質（目標SSIM）とサイズ上限を満たす最速のエンコーダーと品質名を選ぶ"""
+        codes = [code for _, code in self.available_gpus if code != 'auto']
+        width, height = self.video_info.width, self.video_info.height
+        geometry = self.get_output_geometry()
+        if geometry is not None:
+            width, height = geometry.output_size()
+        
+        try:
+            budget = float(self.size_budget_spin.get()) * 1024 * 1024 / 60
+        except ValueError:
+            budget = 0
+        
+        choice = select_calibrated_encoder(load_encoder_profile(), width, height,
+                                           QUALITY_SSIM_TARGETS.get(quality, QUALITY_SSIM_TARGETS["高品質"]),
+                                           budget or None)
+        if choice is None or choice[0] not in codes:
+            print("自動選択: 計測結果がないため、検出順で最初のエンコーダーを使います")
+            return codes[0], quality
         
+        print(f"自動選択: {choice[0]} / {choice[1]} ({width}x{height})")
+        return choice
+    
+    def get_quality_settings(self, encoder_code, quality):
+        """エンコーダーと品質名から品質設定を返す"""
         # OpenCVの場合は品質設定を返す
         if encoder_code == 'opencv':
             quality_map = {
@@ -846,7 +3398,7 @@ class VideoEditor:
                 "標準品質": 75,
                 "高速": 65
             }
-            return encoder_code, quality_map.get(quality, 85)
+            return quality_map.get(quality, 85)
         
         # ffmpeg用の品質設定（シンプル化）
         if 'nvenc' in encoder_code:
@@ -874,7 +3426,7 @@ class VideoEditor:
                 "高速": ['-preset', 'ultrafast', '-crf', '30']
             }
         
-        return encoder_code, quality_map.get(quality, quality_map["高品質"])
+        return quality_map.get(quality, quality_map["高品質"])
     
     def process_video_opencv(self, output_path, start_time, end_time, quality):
         """OpenCVを使用した動画処理"""
@@ -885,69 +3437,54 @@ class VideoEditor:
                 raise Exception("動画ファイルを開けません")
             
             # 動画情報
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fps = self.video_info.fps
+            width = self.video_info.width
+            height = self.video_info.height
             
             # 開始・終了フレームを計算
-            start_frame = int(start_time * fps)
-            end_frame = int(end_time * fps)
+            start_frame, end_frame = self.get_frame_range(start_time, end_time)
             total_frames = end_frame - start_frame
             
             # 開始フレームに移動
-            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            self.seek_capture(cap, start_frame)
+            
+            # 台形補正・出力サイズ変更の準備（どちらも1回のremapで行う）
+            geometry = self.get_output_geometry()
+            use_correction = self.use_perspective.get() or geometry is not None
+            if use_correction:
+                warper = PerspectiveWarper(self.get_src_points(), width, height, geometry=geometry)
+                width, height = warper.width, warper.height
             
             # 出力設定
             fourcc = cv2.VideoWriter_fourcc(*'mp4v')
             out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
             
-            # 台形補正の準備
-            use_correction = self.use_perspective.get()
-            if use_correction:
-                try:
-                    src_points = np.float32([
-                        [float(self.point_entries[0][0].get()), float(self.point_entries[0][1].get())],  # 左上
-                        [float(self.point_entries[1][0].get()), float(self.point_entries[1][1].get())],  # 右上
-                        [float(self.point_entries[2][0].get()), float(self.point_entries[2][1].get())],  # 左下
-                        [float(self.point_entries[3][0].get()), float(self.point_entries[3][1].get())]   # 右下
-                    ])
-                    dst_points = np.float32([
-                        [0, 0],
-                        [width, 0],
-                        [0, height],
-                        [width, height]
-                    ])
-                    perspective_matrix = cv2.getPerspectiveTransform(src_points, dst_points)
-                except ValueError:
-                    raise Exception("台形補正の座標が正しくありません")
-            
-            processed_frames = 0
             start_process_time = time.time()
             
-            while processed_frames < total_frames:
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                
-                # 台形補正を適用
-                if use_correction:
-                    frame = cv2.warpPerspective(frame, perspective_matrix, (width, height))
-                
-                out.write(frame)
-                processed_frames += 1
-                
-                # 進捗を更新
-                if processed_frames % 30 == 0:  # 30フレームごとに更新
-                    progress = (processed_frames / total_frames) * 100
-                    elapsed_time = time.time() - start_process_time
-                    if processed_frames > 0:
-                        remaining_time = (elapsed_time / processed_frames) * (total_frames - processed_frames)
-                        remaining_str = str(timedelta(seconds=int(remaining_time)))
-                    else:
-                        remaining_str = "計算中..."
-                    
-                    self.root.after(0, lambda p=progress, r=remaining_str: 
-                                  self.update_progress(p, f"処理中 - 残り: {r}"))
+            def on_status(processed_frames, depths):
+                if processed_frames == 0:
+                    return
+                progress = (processed_frames / total_frames) * 100
+                elapsed_time = time.time() - start_process_time
+                remaining_time = (elapsed_time / processed_frames) * (total_frames - processed_frames)
+                remaining_str = str(timedelta(seconds=int(remaining_time)))
+                queue_str = self.format_queue_depths(depths)
+                self.root.after(0, lambda: self.update_progress(progress, f"処理中 - 残り: {remaining_str} ({queue_str})"))
+            
+            # 読み込み・台形補正・書き出しを並行して処理
+            metrics = self.metrics
+            warp, workers, band_warper = self.create_pipeline_warp(warper) if use_correction else (None, None, None)
+            pipeline = FramePipeline(metrics.timed('decode', lambda: cap.read()[1]),
+                                     metrics.timed('warp', warp) if use_correction else None,
+                                     metrics.timed('write', out.write),
+                                     total_frames, self.video_info.width * self.video_info.height * 3,
+                                     workers=workers, memory_budget=self.get_pipeline_memory_budget(),
+                                     metrics=metrics, is_static=self.make_static_check())
+            pipeline.run(on_status)
+            if band_warper is not None:
+                band_warper.close()
+            if pipeline.error is not None:
+                raise pipeline.error
             
             cap.release()
             out.release()
@@ -960,10 +3497,17 @@ class VideoEditor:
     def process_video_ffmpeg(self, output_path, start_time, end_time, encoder, quality_settings):
         """ffmpegを使用した動画処理（音声対応、GPU最適化）"""
         try:
-            # 台形補正が必要な場合は、先にffmpegで台形補正を適用
-            if self.use_perspective.get():
+            # 台形補正・出力サイズ変更が必要な場合は、フレームの変換を含む処理へ
+            if self.use_perspective.get() or self.get_output_geometry() is not None:
                 return self.process_video_ffmpeg_with_perspective(output_path, start_time, end_time, encoder, quality_settings)
             
+            # スマートカット（中間はストリームコピー、端のGOPのみ再エンコード）
+            # ストリームコピーではフレームを削除できないため、重複フレームの削除時は使わない
+            if self.use_smart_cut.get() and not self.use_drop_duplicates.get():
+                if self.process_video_smart_cut(output_path, start_time, end_time, encoder):
+                    return True
+                print("スマートカットできないため、全体を再エンコードします...")
+            
             cmd = ['ffmpeg', '-y']  # -y で上書き確認をスキップ
             
             # ハードウェアデコードを控えめに設定（互換性重視）
@@ -974,8 +3518,12 @@ class VideoEditor:
                 # Intel QSVも同様
                 pass
             
-            # 入力ファイルと範囲指定
-            cmd.extend(['-i', self.video_path, '-ss', str(start_time), '-t', str(end_time - start_time)])
+            # 入力ファイルと範囲指定（入力側シーク）
+            cmd.extend(build_input_seek_args(self.video_path, start_time, end_time))
+            
+            # 重複フレームの削除
+            if self.use_drop_duplicates.get():
+                cmd.extend(DUPLICATE_DROP_ARGS)
             
             # エンコーダー設定
             cmd.extend(['-c:v', encoder])
@@ -995,20 +3543,19 @@ class VideoEditor:
             
             print(f"実行コマンド: {' '.join(cmd)}")  # デバッグ用
             
-            # ffmpeg実行
+            # ffmpeg実行（進捗を逐次表示）
             self.root.after(0, lambda: self.progress_label.config(text="エンコード中..."))
             
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                                     creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+            process = self.run_ffmpeg_with_progress(cmd, end_time - start_time, "エンコード中")
             
-            # プロセス完了を待機
-            stdout, stderr = process.communicate()
-            
-            if process.returncode != 0:
-                error_msg = stderr.decode('utf-8', errors='ignore')
+            error_msg = process.output_error(output_path)
+            if error_msg is not None:
                 print(f"ffmpegエラー詳細: {error_msg}")
                 raise Exception(f"ffmpegエンコードエラー: {error_msg}")
             
+            start_frame, end_frame = self.get_frame_range(start_time, end_time)
+            self.record_duplicate_drop(end_frame - start_frame, process)
+            
             print("エンコード完了")
             return True
             
@@ -1016,21 +3563,147 @@ class VideoEditor:
             print(f"ffmpeg処理エラー: {e}")
             return False
     
+    def process_video_smart_cut(self, output_path, start_time, end_time, encoder):
+        """スマートカット: 開始・終了側の端数GOPだけを再エンコードし、間はストリームコピーして連結"""
+        work_dir = None
+        try:
+            media_info = probe_media_info(self.video_path)
+            codec = media_info.video_codec
+            if codec not in SMART_CUT_ENCODERS:
+                print(f"スマートカット非対応のコーデック: {codec}")
+                return False
+            
+            # 端の再エンコードは元動画と同じコーデックで行う
+            if encoder not in SMART_CUT_ENCODERS[codec]:
+                encoder = SMART_CUT_ENCODERS[codec][-1]
+            quality_settings = self.get_quality_settings(encoder, self.quality_var.get())
+            
+            # キーフレーム時刻（ffmpegの -ss と同じ基準）
+            index = PacketIndex.load(self.video_path)
+            offset = index.stream_start - index.format_start
+            keyframes = index.keyframe_times_for_ffmpeg().tolist()
+            inner = [t for t in keyframes if start_time <= t <= end_time]
+            if len(inner) < 2:
+                print("範囲内のキーフレームが不足しています")
+                return False
+            copy_start, copy_end = inner[0], inner[-1]
+            
+            # ストリームコピーを -t で止めると copy_end のキーフレーム以降のパケットまで残り、
+            # 末尾側の再エンコードと重複する。索引で数えたフレーム数で copy_end の直前に止める
+            copy_first, copy_last = index.frame_range(copy_start - offset, copy_end - offset)
+            copy_frames = copy_last - copy_first
+            
+            # 端の再エンコード設定（連結できるよう元動画に合わせる）
+            edge_settings = ['-c:v', encoder] + list(quality_settings)
+            if media_info.pix_fmt:
+                edge_settings.extend(['-pix_fmt', media_info.pix_fmt])
+            profile = media_info.profile.lower().replace('constrained ', '')
+            if profile in ('baseline', 'main', 'high'):
+                edge_settings.extend(['-profile:v', profile])
+            # libx265 は -level を受け付けないため、食い違えば下の互換性チェックで全体の再エンコードになる
+            if media_info.level > 0 and encoder != 'libx265':
+                edge_settings.extend(['-level:v', f"{media_info.level / SMART_CUT_LEVEL_SCALE[codec]:g}"])
+            
+            work_dir = tempfile.mkdtemp(prefix='twitcas_smartcut_',
+                                        dir=os.path.dirname(os.path.abspath(output_path)))
+            parts = []
+            # (開始, 長さ, ストリームコピーか)
+            if copy_start - start_time > 0.001:
+                parts.append((start_time, copy_start - start_time, False))
+            parts.append((copy_start, copy_end - copy_start, True))
+            if end_time - copy_end > 0.001:
+                parts.append((copy_end, end_time - copy_end, False))
+            
+            part_paths = []
+            for index, (part_start, part_duration, stream_copy) in enumerate(parts):
+                # MPEG-TSで書き出し、各パートのSPS/PPSをストリーム内に保持する
+                part_path = os.path.join(work_dir, f"part_{index}.ts")
+                if stream_copy:
+                    # キーフレームちょうどにシークできるよう僅かに後ろを指定（直前のキーフレームに合わせられる）
+                    cmd = ['ffmpeg', '-y', '-ss', f"{part_start + 0.001:.6f}", '-i', self.video_path,
+                           '-frames:v', str(copy_frames), '-map', '0:v:0', '-c:v', 'copy', '-an', part_path]
+                else:
+                    cmd = ['ffmpeg', '-y', '-ss', f"{part_start:.6f}", '-i', self.video_path,
+                           '-t', f"{part_duration:.6f}", '-map', '0:v:0'] + edge_settings + ['-an', part_path]
+                
+                print(f"スマートカット({'コピー' if stream_copy else '再エンコード'}): {' '.join(cmd)}")
+                
+                # 全体に占める割合は各パートの長さに比例させる（連結に残り5%）
+                done_duration = sum(part[1] for part in parts[:index])
+                process = self.run_ffmpeg_with_progress(
+                    cmd, part_duration, f"スマートカット中 {index + 1}/{len(parts)}",
+                    start_percent=done_duration / (end_time - start_time) * 95,
+                    span=part_duration / (end_time - start_time) * 95,
+                    stage='stream_copy' if stream_copy else 'edge_encode')
+                error = process.output_error(part_path)
+                if error is not None:
+                    print(f"スマートカットエラー: {error}")
+                    return False
+                part_paths.append(part_path)
+            
+            # 端の再エンコードがコピーした部分とSPS・タイムベースまで一致しなければ連結できない
+            copy_path = part_paths[[part[2] for part in parts].index(True)]
+            reference = smart_cut_stream_parameters(probe_media_info(copy_path))
+            for part_path in part_paths:
+                if part_path == copy_path:
+                    continue
+                parameters = smart_cut_stream_parameters(probe_media_info(part_path))
+                mismatched = [name for name in reference if parameters[name] != reference[name]]
+                if mismatched:
+                    print("再エンコードした端の映像パラメータが元動画と一致しません: "
+                          + ", ".join(f"{name} {parameters[name]} ≠ {reference[name]}" for name in mismatched))
+                    return False
+            
+            # 連結して音声を結合
+            list_path = os.path.join(work_dir, 'parts.txt')
+            with open(list_path, 'w', encoding='utf-8') as f:
+                for part_path in part_paths:
+                    f.write(f"file '{os.path.basename(part_path)}'\n")
+            
+            cmd = ['ffmpeg', '-y',
+                   '-f', 'concat', '-safe', '0', '-i', list_path,
+                   *build_input_seek_args(self.video_path, start_time, end_time),
+                   '-map', '0:v:0', '-map', '1:a:0?',
+                   '-c', 'copy',
+                   output_path]
+            print(f"連結コマンド: {' '.join(cmd)}")
+            
+            process = self.run_ffmpeg_with_progress(cmd, end_time - start_time, "連結+音声結合中",
+                                                    start_percent=95, span=5, stage='mux')
+            error = process.output_error(output_path)
+            if error is not None:
+                print(f"連結エラー: {error}")
+                return False
+            
+            print("スマートカット完了")
+            return True
+            
+        except Exception as e:
+            print(f"スマートカット処理エラー: {e}")
+            return False
+        finally:
+            if work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    
     def process_video_ffmpeg_with_perspective(self, output_path, start_time, end_time, encoder, quality_settings):
         """ffmpegで台形補正を含む動画処理（GPUエンコード対応）"""
         try:
-            # 台形補正の座標を取得
-            src_points = []
-            try:
-                for i in range(4):
-                    x = float(self.point_entries[i][0].get())
-                    y = float(self.point_entries[i][1].get())
-                    src_points.append((x, y))
-            except ValueError:
-                raise Exception("台形補正の座標が正しくありません")
+            # 台形補正の座標と出力サイズを取得
+            src_points = self.get_src_points()
+            geometry = self.get_output_geometry()
+            
+            # ffmpegのperspectiveフィルターで デコード→補正→エンコード を1プロセスで実行
+            # （途中再開はセグメント単位で書き出すOpenCV方式で行う）
+            # 出力サイズが変わる場合は、切り抜き・拡大縮小を1回のremapに織り込めるOpenCV方式を使う
+            if (self.use_native_perspective.get() and not self.use_resumable.get()
+                    and self.native_perspective_supports(geometry)
+                    and self.ffmpeg_has_filter('perspective')):
+                print("台形補正: ffmpeg perspectiveフィルターを使用します")
+                if self.process_video_ffmpeg_perspective_filter(output_path, start_time, end_time,
+                                                                encoder, quality_settings, src_points, geometry):
+                    return True
+                print("ffmpegフィルターでの処理に失敗したため、OpenCV方式にフォールバックします...")
             
-            # まずはOpenCVでのフォールバック処理を直接実行
-            # ffmpegのperspectiveフィルターは複雑すぎるため
             print("台形補正: OpenCV方式を使用します")
             return self.process_video_opencv_fallback(output_path, start_time, end_time, encoder, quality_settings)
             
@@ -1040,135 +3713,644 @@ class VideoEditor:
             print("OpenCVでの処理にフォールバックします...")
             return self.process_video_opencv_fallback(output_path, start_time, end_time, encoder, quality_settings)
     
+    def ffmpeg_has_filter(self, filter_name):
+        """ffmpegに指定のフィルターが組み込まれているか確認（結果はキャッシュ）"""
+        if getattr(self, '_ffmpeg_filters', None) is None:
+            try:
+                result = subprocess.run(['ffmpeg', '-hide_banner', '-filters'],
+                                      capture_output=True, text=True,
+                                      creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0,
+                                      timeout=10)
+                # 各行は " TSC perspective  V->V  Correct the perspective of video." の形式
+                self._ffmpeg_filters = {line.split()[1] for line in result.stdout.split('\n')
+                                        if len(line.split()) >= 3 and '->' in line}
+            except Exception as e:
+                print(f"ffmpegフィルター一覧の取得に失敗: {e}")
+                self._ffmpeg_filters = set()
+        return filter_name in self._ffmpeg_filters
+    
+    def build_perspective_filter(self, src_points, interpolation=cv2.INTER_LINEAR):
+        """4点の座標からffmpegのperspectiveフィルター文字列を作成
+        
+        点の順序（左上・右上・左下・右下）はffmpegの x0y0〜x3y3 と同じ。
+        sense=source で「出力の四隅が元画像のどこに対応するか」を指定するため、
+        cv2.getPerspectiveTransform(src, 画面全体) と同じ変換になる。
+        """
+        coords = []
+        for i, (x, y) in enumerate(src_points):
+            coords.append(f"x{i}={x:g}:y{i}={y:g}")
+        interpolation_name = FFMPEG_PERSPECTIVE_INTERPOLATION.get(interpolation, 'linear')
+        return f"perspective={':'.join(coords)}:interpolation={interpolation_name}:sense=source"
+    
+    def build_output_filter(self, src_points, geometry=None):
+        """台形補正と出力サイズ変更をffmpegのフィルター列にする
+        
+        perspectiveフィルターは入力と同じ大きさで出力するため、切り抜きは4点に織り込む
+        （切り抜き範囲の四隅が元画像のどこに当たるかを逆変換で求める）。出力サイズが入力と違う場合に
+        scaleを続けると2回補間することになるため、呼び出し側は native_perspective_supports() で
+        確かめてからこの経路を使う。台形補正なしの場合は crop + scale（補間は1回）になる。
+        """
+        filters = []
+        filtered_size = (self.video_info.width, self.video_info.height)
+        if self.use_perspective.get():
+            if geometry is not None:
+                width, height = self.video_info.width, self.video_info.height
+                matrix = cv2.getPerspectiveTransform(
+                    np.float32(src_points),
+                    np.float32([[0, 0], [width, 0], [0, height], [width, height]]))
+                x, y, w, h = geometry.crop_rect()
+                corners = np.float32([[[x, y]], [[x + w, y]], [[x, y + h]], [[x + w, y + h]]])
+                src_points = cv2.perspectiveTransform(corners, np.linalg.inv(matrix)).reshape(4, 2)
+            filters.append(self.build_perspective_filter(src_points))
+        elif geometry is not None:
+            x, y, w, h = (int(round(v)) for v in geometry.crop_rect())
+            filters.append(f"crop={w}:{h}:{x}:{y}")
+            filtered_size = (w, h)
+        
+        if geometry is not None and tuple(geometry.output_size()) != filtered_size:
+            out_width, out_height = geometry.output_size()
+            filters.append(f"scale={out_width}:{out_height}")
+        
+        # 重複フレームの削除（出力は可変フレームレートになる）
+        if self.use_drop_duplicates.get():
+            filters.append('mpdecimate')
+        return ','.join(filters)
+    
+    def native_perspective_supports(self, geometry):
+        """ffmpegのフィルターで1回の補間で出力できるか
+        
+        台形補正ありでは出力サイズが入力と同じ場合のみ。台形補正なしの crop + scale は常に1回で済む。
+        """
+        if not self.use_perspective.get() or geometry is None:
+            return True
+        return tuple(geometry.output_size()) == (self.video_info.width, self.video_info.height)
+    
+    def process_video_ffmpeg_perspective_filter(self, output_path, start_time, end_time,
+                                                encoder, quality_settings, src_points, geometry=None):
+        """ffmpegのperspectiveフィルターで台形補正（Pythonでのフレーム処理なし）"""
+        try:
+            cmd = ['ffmpeg', '-y']
+            
+            # 入力ファイルと範囲指定（入力側シーク）
+            cmd.extend(build_input_seek_args(self.video_path, start_time, end_time))
+            
+            # 台形補正フィルター（フィルターはffmpeg内でスレッド並列に処理される）
+            cmd.extend(['-vf', self.build_output_filter(src_points, geometry)])
+            if self.use_drop_duplicates.get():
+                cmd.extend(['-fps_mode', 'vfr'])
+            
+            # エンコーダー設定
+            cmd.extend(['-c:v', encoder])
+            
+            # 音声設定（元の音声を保持）
+            cmd.extend(['-c:a', 'copy'])
+            
+            # 品質設定を追加
+            if quality_settings:
+                cmd.extend(quality_settings)
+            
+            # ピクセルフォーマット指定（互換性向上）
+            cmd.extend(['-pix_fmt', 'yuv420p'])
+            
+            # 出力ファイル
+            cmd.append(output_path)
+            
+            print(f"実行コマンド: {' '.join(cmd)}")
+            
+            self.root.after(0, lambda: self.progress_label.config(text="台形補正+エンコード中 (ffmpeg)..."))
+            
+            process = self.run_ffmpeg_with_progress(cmd, end_time - start_time, "台形補正+エンコード中 (ffmpeg)")
+            
+            error = process.output_error(output_path)
+            if error is not None:
+                print(f"ffmpeg perspectiveフィルターエラー: {error}")
+                return False
+            
+            start_frame, end_frame = self.get_frame_range(start_time, end_time)
+            self.record_duplicate_drop(end_frame - start_frame, process)
+            
+            print("台形補正+エンコード完了 (ffmpeg)")
+            return True
+            
+        except Exception as e:
+            print(f"ffmpeg perspectiveフィルター処理エラー: {e}")
+            return False
+    
+    def build_pipe_encode_command(self, output_path, width, height, fps, start_time, end_time,
+                                  encoder, quality_settings, pix_fmt='bgr24'):
+        """標準入力の生フレームをエンコードし、元動画の音声を同時に結合するffmpegコマンドを作成
+        
+        pix_fmt='yuv420p' の場合は出力と同じ形式なのでffmpeg側での色変換は行われない。
+        """
+        audio_args = build_input_seek_args(self.video_path, start_time, end_time)
+        return build_rawvideo_encode_command(output_path, width, height, fps, encoder, quality_settings,
+                                             pix_fmt=pix_fmt, audio_args=audio_args,
+                                             drop_duplicates=self.use_drop_duplicates.get())
+    
     def process_video_opencv_fallback(self, output_path, start_time, end_time, encoder, quality_settings):
-        """OpenCVで台形補正を行い、その後ffmpegでエンコード"""
+        """OpenCVで台形補正を行い、補正済みフレームをパイプでffmpegへ渡して1回でエンコード"""
+        # 並列処理が有効ならセグメント分割してマルチプロセスで処理
+        segment_count = self.get_segment_count() if self.use_parallel.get() else 1
+        worker_count = segment_count
+        
+        # 途中再開を有効にした場合は CHECKPOINT_SECONDS ごとのセグメントに分けて1本ずつ確定させる
+        if self.use_resumable.get():
+            segment_count = max(segment_count, int(np.ceil((end_time - start_time) / CHECKPOINT_SECONDS)))
+        
+        if segment_count > 1:
+            return self.process_video_opencv_segmented(output_path, start_time, end_time,
+                                                       encoder, quality_settings, segment_count, worker_count)
+        
+        process = None
+        reader = None
+        cap = None
+        warp_pool = None    # 帯分割・YUV補正のスレッドプールを持つ変換（終了時に閉じる）
         try:
-            # 一時ファイルパス
-            temp_video_path = output_path.replace('.mp4', '_corrected_temp.mp4')
+            self.root.after(0, lambda: self.progress_label.config(text="台形補正+エンコード中..."))
             
-            # OpenCVで台形補正を適用
-            self.root.after(0, lambda: self.progress_label.config(text="台形補正を適用中..."))
+            fps = self.video_info.fps
+            src_points = np.float32(self.get_src_points())
+            geometry = self.get_output_geometry()
             
-            src_points = np.float32([
-                [float(self.point_entries[0][0].get()), float(self.point_entries[0][1].get())],  # 左上
-                [float(self.point_entries[1][0].get()), float(self.point_entries[1][1].get())],  # 右上
-                [float(self.point_entries[2][0].get()), float(self.point_entries[2][1].get())],  # 左下
-                [float(self.point_entries[3][0].get()), float(self.point_entries[3][1].get())]   # 右下
-            ])
-            dst_points = np.float32([
-                [0, 0],
-                [self.video_info['width'], 0],
-                [0, self.video_info['height']],
-                [self.video_info['width'], self.video_info['height']]
-            ])
+            # 出力サイズ変更も含めて1回のremapで変換する
+            # yuv420pの動画はYUVのままデコード・補正・送信し、色変換とBGRの分のバイト数を省く
+            if self.can_warp_yuv():
+                warper, workers = self.create_yuv_warper(src_points, geometry)
+                warp_pool = warper
+                warp, pix_fmt = warper.apply, 'yuv420p'
+                frame_bytes = self.video_info.width * self.video_info.height * 3 // 2
+            else:
+                warper = PerspectiveWarper(src_points, self.video_info.width, self.video_info.height,
+                                           geometry=geometry)
+                warp, workers, warp_pool = self.create_pipeline_warp(warper)
+                pix_fmt = 'bgr24'
+                frame_bytes = self.video_info.width * self.video_info.height * 3
+            width, height = warper.width, warper.height
             
-            print(f"台形補正座標:")
+            print("台形補正座標:")
             print(f"  元座標: {src_points}")
-            print(f"  変換後: {dst_points}")
-            
-            cap = cv2.VideoCapture(self.video_path)
+            print(f"  変換後: {width}x{height} ({pix_fmt})")
             
             # 指定範囲のフレームのみ処理
-            start_frame = int(start_time * self.video_info['fps'])
-            end_frame = int(end_time * self.video_info['fps'])
+            start_frame, end_frame = self.get_frame_range(start_time, end_time)
             total_frames = end_frame - start_frame
             
             print(f"処理範囲: フレーム {start_frame} - {end_frame} (合計 {total_frames} フレーム)")
             
-            # 開始フレームに移動
-            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+            if pix_fmt == 'yuv420p':
+                # 範囲の切り出しはffmpegの入力側シーク（音声と同じ基準）で行う
+                reader = YuvFrameReader(self.video_path, start_time, end_time,
+                                        self.video_info.width, self.video_info.height)
+                read_frame = reader.read
+            else:
+                cap = cv2.VideoCapture(self.video_path)
+                # 開始フレームに移動
+                self.seek_capture(cap, start_frame)
+                read_frame = lambda: cap.read()[1]
             
-            # 一時動画ファイル作成（映像のみ、高品質）
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(temp_video_path, fourcc, self.video_info['fps'],
-                                (self.video_info['width'], self.video_info['height']))
+            # 補正済みフレームを受け取るffmpegを起動（一時ファイルを作らない）
+            cmd = self.build_pipe_encode_command(output_path, width, height, fps, start_time, end_time,
+                                                 encoder, quality_settings, pix_fmt=pix_fmt)
+            print(f"パイプエンコードコマンド: {' '.join(cmd)}")
             
-            if not out.isOpened():
-                raise Exception("一時動画ファイルの作成に失敗しました")
+            # 進捗はffmpegが実際にエンコードした位置から表示する（各段のキューの長さも添える）
+            queue_depths = {}
+            process = FFmpegProgress(cmd, (end_time - start_time),
+                                     self.make_progress_callback("台形補正+エンコード中",
+                                                                 detail=lambda: self.format_queue_depths(queue_depths)),
+                                     stdin=subprocess.PIPE)
             
-            processed_frames = 0
-            matrix = cv2.getPerspectiveTransform(src_points, dst_points)
-            print(f"変換行列: \n{matrix}")
+            print(f"変換行列: \n{warper.matrix}")
             
-            while processed_frames < total_frames:
-                ret, frame = cap.read()
-                if not ret:
-                    print(f"フレーム {processed_frames} の読み込みに失敗")
-                    break
-                
-                # 台形補正を適用
-                corrected = cv2.warpPerspective(frame, matrix, 
-                                              (self.video_info['width'], self.video_info['height']))
-                
+            def write_frame(corrected):
                 # フレームが真っ黒でないかチェック
-                if processed_frames == 0:
+                if pipeline.written_count == 0:
                     mean_brightness = np.mean(corrected)
                     print(f"最初のフレームの平均輝度: {mean_brightness}")
                     if mean_brightness < 1:
                         print("警告: 補正後のフレームが真っ黒です")
                 
-                out.write(corrected)
-                processed_frames += 1
-                
-                if processed_frames % 30 == 0:
-                    progress = (processed_frames / total_frames) * 50
-                    self.root.after(0, lambda p=progress: self.update_progress(p, f"台形補正中... {processed_frames}/{total_frames}"))
+                # エンコーダーへ送る（エンコーダーが詰まればここで待ち、前段のキューが埋まる）
+                process.stdin.write(corrected.data)
             
-            cap.release()
-            out.release()
+            # 読み込み・台形補正・エンコーダーへの送信を並行して処理
+            metrics = self.metrics
+            pipeline = FramePipeline(metrics.timed('decode', read_frame),
+                                     metrics.timed('warp', warp),
+                                     metrics.timed('pipe', write_frame),
+                                     total_frames, frame_bytes,
+                                     workers=workers, memory_budget=self.get_pipeline_memory_budget(),
+                                     metrics=metrics, is_static=self.make_static_check())
+            print(f"パイプライン: 変換スレッド {pipeline.workers} / キュー長 {pipeline.capacity}")
+            processed_frames = pipeline.run(lambda count, depths: queue_depths.update(depths))
+            
+            if isinstance(pipeline.error, (BrokenPipeError, OSError)):
+                print("ffmpegへのフレーム送信に失敗しました")
+            elif pipeline.error is not None:
+                raise pipeline.error
+            elif pipeline.read_count < total_frames:
+                print(f"フレーム {pipeline.read_count} の読み込みに失敗")
+                if reader is not None and reader.error_text:
+                    print(f"デコードエラー: {reader.error_text}")
+            
+            # 入力を閉じてエンコード完了を待つ
+            try:
+                process.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+            process.wait()
+            metrics.record_process('encode', process)
+            self.record_duplicate_drop(processed_frames, process)
             
             print(f"台形補正完了: {processed_frames} フレーム処理")
             
-            # ffmpegで音声を結合してエンコード
-            self.root.after(0, lambda: self.progress_label.config(text="音声結合+エンコード中..."))
+            error = process.output_error(output_path)
+            if error is not None:
+                print(f"パイプエンコードエラー: {error}")
+                return False
             
-            cmd = ['ffmpeg', '-y',
-                   '-i', temp_video_path,  # 台形補正済み映像
-                   '-ss', str(start_time), '-t', str(end_time - start_time),
-                   '-i', self.video_path]  # 元動画（音声用）
+            print("台形補正+音声結合+エンコード完了")
+            return True
             
-            # エンコーダー設定
-            cmd.extend(['-c:v', encoder])
+        except Exception as e:
+            # ffmpegプロセスの後始末
+            if process is not None:
+                process.kill()
+            print(f"OpenCVフォールバック処理エラー: {e}")
+            return False
+        finally:
+            # 成功・失敗どちらでも、デコーダーと変換用のスレッドを片付ける
+            if warp_pool is not None:
+                warp_pool.close()
+            if reader is not None:
+                reader.close()
+            if cap is not None:
+                cap.release()
+    
+    def get_frame_range(self, start_time, end_time):
+        """切り抜き範囲をフレーム番号に変換（索引があれば実際の表示時刻を使う）"""
+        index = PacketIndex.get_cached(self.video_path)
+        if index is not None:
+            return index.frame_range(start_time, end_time)
+        fps = self.video_info.fps
+        return int(start_time * fps), int(end_time * fps)
+    
+    def seek_capture(self, cap, frame_number):
+        """キャプチャを指定フレームへ移動（索引があればキーフレームの表示時刻から読み進め、移動できなければ例外）"""
+        index = PacketIndex.get_cached(self.video_path)
+        if index is not None:
+            index.seek_exact(cap, frame_number)
+            return True
+        return cap.set(cv2.CAP_PROP_POS_FRAMES, frame_number)
+    
+    def get_src_points(self):
+        """台形補正の4点（左上・右上・左下・右下）。補正なしなら画面全体"""
+        if not self.use_perspective.get():
+            width, height = self.video_info.width, self.video_info.height
+            return [[0, 0], [width, 0], [0, height], [width, height]]
+        try:
+            return [
+                [float(self.point_entries[i][0].get()), float(self.point_entries[i][1].get())]
+                for i in range(4)
+            ]
+        except ValueError:
+            raise Exception("台形補正の座標が正しくありません")
+    
+    def get_output_geometry(self):
+        """出力サイズ設定を取得（切り抜き・縦横比・解像度のいずれも指定がなければNone）"""
+        crop_values = [entry.get().strip() for entry in self.crop_entries]
+        crop = None
+        if any(crop_values):
+            try:
+                crop = tuple(float(value) for value in crop_values)
+            except ValueError:
+                raise Exception("切り抜き範囲の値が正しくありません")
+        
+        geometry = OutputGeometry(self.video_info.width, self.video_info.height, crop=crop,
+                                  aspect=OUTPUT_ASPECTS.get(self.output_aspect_var.get()),
+                                  short_side=OUTPUT_RESOLUTIONS.get(self.output_resolution_var.get(), 0))
+        return None if geometry.is_identity else geometry
+    
+    def make_static_check(self):
+        """静止フレームの判定関数（静止フレームの補正を省略しない設定ならNone）"""
+        if not self.use_static_skip.get():
+            return None
+        return self.metrics.timed('static_check', StaticFrameDetector().is_static)
+    
+    def record_duplicate_drop(self, sent_frames, process):
+        """エンコーダーへ送ったフレームのうち、重複として削除された数を記録"""
+        if self.use_drop_duplicates.get() and process.frames:
+            dropped = sent_frames - process.frames
+            if dropped > 0:
+                self.metrics.record('duplicate_drop', 0.0, dropped)
+                print(f"重複フレームを削除: {dropped} フレーム")
+    
+    def can_warp_yuv(self):
+        """YUVのまま補正できるか（yuv420pで幅・高さが偶数の動画のみ。それ以外はBGRで補正する）"""
+        return (self.use_yuv_warp.get() and self.video_info.pix_fmt == 'yuv420p'
+                and self.video_info.width % 2 == 0 and self.video_info.height % 2 == 0)
+    
+    def create_yuv_warper(self, src_points, geometry):
+        """YUVのまま補正するYuvWarperを作る（帯分割の設定も反映）
+        
+        戻り値は (YuvWarper, FramePipelineの変換スレッド数)。
+        """
+        width, height = self.video_info.width, self.video_info.height
+        out_width, out_height = geometry.output_size() if geometry is not None else (width, height)
+        bands, threads = self.get_warp_bands(out_width, out_height)
+        workers = self.BAND_PIPELINE_WORKERS if bands > 1 else None
+        buffer_count = FramePipeline.max_outputs_in_use(width * height * 3 // 2,
+                                                        self.get_pipeline_memory_budget(), workers)
+        warper = YuvWarper(src_points, width, height, buffer_count, geometry=geometry,
+                           bands=bands, threads=threads, chroma_location=self.video_info.chroma_location)
+        self.metrics.note(pixel_format='yuv420p', warp_bands=warper.bands, warp_threads=warper.threads)
+        if workers is not None:
+            self.metrics.note(pipeline_workers=workers)
+        return warper, workers
+    
+    def get_warp_bands(self, width, height, share=1):
+        """変換の (帯の数, スレッド数) を取得（0や不正な値は出力サイズとCPUコア数から自動）"""
+        auto_bands, auto_threads = BandWarper.auto_settings(width, height, share)
+        values = []
+        for spin, default in ((self.warp_bands_spin, auto_bands), (self.warp_threads_spin, auto_threads)):
+            try:
+                value = int(spin.get())
+            except ValueError:
+                value = 0
+            values.append(value if value > 0 else default)
+        return tuple(values)
+    
+    def create_band_warper(self, warper, buffer_count, share=1):
+        """帯分割の設定に従ってBandWarperを作る（帯に分けない場合はNone）"""
+        bands, threads = self.get_warp_bands(warper.width, warper.height, share)
+        if bands <= 1:
+            self.metrics.note(warp_bands=1, warp_threads=1)
+            return None
+        band_warper = BandWarper(warper, bands, threads, buffer_count)
+        self.metrics.note(warp_bands=band_warper.bands, warp_threads=band_warper.threads)
+        print(f"帯分割の変換: {band_warper.bands} 帯 / {band_warper.threads} スレッド")
+        return band_warper
+    
+    def create_pipeline_warp(self, warper):
+        """FramePipeline用の変換関数と変換スレッド数（帯分割時はフレーム内で並列化するので少なくする）
+        
+        戻り値は (変換関数, 変換スレッド数, BandWarperまたはNone)。
+        """
+        frame_bytes = self.video_info.width * self.video_info.height * 3
+        memory_budget = self.get_pipeline_memory_budget()
+        workers = self.BAND_PIPELINE_WORKERS
+        band_warper = self.create_band_warper(
+            warper, FramePipeline.max_outputs_in_use(frame_bytes, memory_budget, workers))
+        if band_warper is None:
+            return warper.apply, None, None
+        self.metrics.note(pipeline_workers=workers)
+        return band_warper.apply, workers, band_warper
+    
+    def get_pipeline_memory_budget(self):
+        """フレームパイプラインのメモリ上限（バイト、不正な値は既定値）"""
+        try:
+            return max(64, int(self.pipeline_memory_spin.get())) * 1024 * 1024
+        except ValueError:
+            return FramePipeline.MEMORY_BUDGET
+    
+    def format_queue_depths(self, depths):
+        """パイプラインの各段のキューの長さを表示用の文字列にする"""
+        if not depths:
+            return ""
+        return f"変換待ち {depths['warp']} / 送信待ち {depths['write']} / 上限 {depths['capacity']}"
+    
+    def get_segment_count(self):
+        """並列処理の分割数を取得（不正な値はCPUコア数）"""
+        try:
+            return max(1, int(self.segment_count_spin.get()))
+        except ValueError:
+            return os.cpu_count() or 1
+    
+    def process_video_opencv_segmented(self, output_path, start_time, end_time, encoder, quality_settings,
+                                       segment_count, worker_count=None):
+        """キーフレーム位置で分割したセグメントを複数プロセスで台形補正し、-c copyで連結
+        
+        セグメントは出力先の隣の作業フォルダ（<出力>.parts）に1本ずつ確定させ、manifest.json に記録する。
+        同じジョブを再実行すると、記録どおりに残っているセグメントは使い回し、足りない分だけ処理する。
+        作業フォルダは連結が成功したときだけ削除する。
+        """
+        work_dir = output_path + '.parts'
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            width = self.video_info.width
+            height = self.video_info.height
+            fps = self.video_info.fps
             
-            # 品質設定
-            if quality_settings:
-                cmd.extend(quality_settings)
+            src_points = self.get_src_points()
+            geometry = self.get_output_geometry()
             
-            # 音声設定とマッピング
-            cmd.extend([
-                '-c:a', 'copy',
-                '-map', '0:v:0',  # 1番目の入力の映像（台形補正済み）
-                '-map', '1:a:0?',  # 2番目の入力の音声（?で音声がない場合も許可）
-                '-pix_fmt', 'yuv420p',
-                output_path
-            ])
+            # 親プロセスでremapテーブルを作成してディスクキャッシュに載せておく
+            PerspectiveWarper(src_points, width, height, geometry=geometry)
             
-            print(f"音声結合コマンド: {' '.join(cmd)}")
+            # フレーム範囲とセグメントの分割は索引から求めるので、範囲の計算より先に索引を用意する
+            # （初回と再実行で範囲の求め方が変わらないように）
+            self.root.after(0, lambda: self.progress_label.config(text="キーフレームを解析中..."))
+            try:
+                keyframe_frames = PacketIndex.load(self.video_path).keyframe_frames.tolist()
+            except Exception as e:
+                print(f"キーフレーム解析エラー: {e}")
+                keyframe_frames = []
             
-            process = subprocess.run(cmd, capture_output=True, 
-                                   creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0)
+            start_frame, end_frame = self.get_frame_range(start_time, end_time)
+            total_frames = end_frame - start_frame
             
-            # 一時ファイル削除
-            if os.path.exists(temp_video_path):
-                os.remove(temp_video_path)
+            # 同じ設定のジョブかどうかを判定するキー（分割数は含めず、前回の分割をそのまま使う）
+            # 範囲は索引の有無で変わるフレーム番号ではなく、指定された時刻で判定する
+            job_key = hashlib.sha1(json.dumps({
+                'source': file_signature(self.video_path),
+                'range': [round(float(start_time), 3), round(float(end_time), 3)],
+                'src_points': [[round(float(x), 3), round(float(y), 3)] for x, y in src_points],
+                'geometry': asdict(geometry) if geometry is not None else None,
+                'encoder': encoder,
+                'quality_settings': quality_settings,
+                'fps': fps,
+                'static_skip': self.use_static_skip.get(),
+                'drop_duplicates': self.use_drop_duplicates.get(),
+            }, sort_keys=True).encode('utf-8')).hexdigest()
+            
+            manifest = self.load_segment_manifest(work_dir, job_key)
+            if manifest is None:
+                segments = plan_keyframe_segments(start_frame, end_frame, keyframe_frames, segment_count)
+                manifest = {
+                    'version': SEGMENT_MANIFEST_VERSION,
+                    'job_key': job_key,
+                    'segments': [{'index': index, 'start_frame': seg_start, 'frame_count': seg_end - seg_start,
+                                  'file': f"segment_{index:04d}.mp4", 'signature': None}
+                                 for index, (seg_start, seg_end) in enumerate(segments)],
+                }
+                self.save_segment_manifest(work_dir, manifest)
+            
+            pending = [segment for segment in manifest['segments'] if segment['signature'] is None]
+            done_frames = total_frames - sum(segment['frame_count'] for segment in pending)
+            if done_frames:
+                print(f"再開: {len(manifest['segments']) - len(pending)}/{len(manifest['segments'])} "
+                      f"セグメントは処理済み ({done_frames} フレーム)")
+            
+            if worker_count is None:
+                worker_count = os.cpu_count() or 1
+            worker_count = max(1, min(worker_count, len(pending), os.cpu_count() or 1))
+            if 'nvenc' in encoder:
+                worker_count = min(worker_count, NVENC_MAX_SESSIONS)
+            print(f"並列処理: 残り {len(pending)} セグメント / {worker_count} プロセス")
+            
+            # 帯分割の変換はCPUコアをプロセス数で分け合う
+            out_width, out_height = geometry.output_size() if geometry is not None else (width, height)
+            warp_bands, warp_threads = self.get_warp_bands(out_width, out_height, share=worker_count)
+            self.metrics.note(warp_bands=warp_bands, warp_threads=min(warp_threads, warp_bands))
+            
+            if pending:
+                with multiprocessing.Manager() as manager:
+                    progress_queue = manager.Queue()
+                    tasks = {}
+                    for segment in pending:
+                        tasks[segment['index']] = {
+                            'index': segment['index'],
+                            'video_path': self.video_path,
+                            'start_frame': segment['start_frame'],
+                            'frame_count': segment['frame_count'],
+                            'src_points': src_points,
+                            'width': width,
+                            'height': height,
+                            'geometry': asdict(geometry) if geometry is not None else None,
+                            'fps': fps,
+                            'encoder': encoder,
+                            'quality_settings': quality_settings,
+                            'static_skip': self.use_static_skip.get(),
+                            'drop_duplicates': self.use_drop_duplicates.get(),
+                            'warp_bands': warp_bands,
+                            'warp_threads': warp_threads,
+                            # 完成するまでは別名で書き、確定時に名前を変える
+                            'segment_path': os.path.join(work_dir, segment['file'][:-len('.mp4')] + '.part.mp4'),
+                            'progress_queue': progress_queue,
+                        }
+                    
+                    start_process_time = time.time()
+                    processed_frames = 0
+                    failed = []
+                    results = []
+                    with ProcessPoolExecutor(max_workers=worker_count) as executor:
+                        futures = {executor.submit(render_segment_worker, task): index
+                                   for index, task in tasks.items()}
+                        while futures:
+                            # 終わったセグメントから確定させて manifest に記録する
+                            for future in [future for future in futures if future.done()]:
+                                index = futures.pop(future)
+                                result = future.result()
+                                results.append(result)
+                                if not self.finalize_segment(work_dir, manifest, tasks[index], result):
+                                    failed.append(result)
+                            
+                            try:
+                                processed_frames += progress_queue.get(timeout=0.5)
+                            except queue.Empty:
+                                continue
+                            progress = ((done_frames + processed_frames) / total_frames) * 95
+                            elapsed_time = time.time() - start_process_time
+                            remaining_time = ((elapsed_time / max(processed_frames, 1))
+                                              * (total_frames - done_frames - processed_frames))
+                            remaining_str = str(timedelta(seconds=int(remaining_time)))
+                            n = done_frames + processed_frames
+                            self.root.after(0, lambda p=progress, n=n, r=remaining_str:
+                                          self.update_progress(p, f"並列台形補正中... {n}/{total_frames} - 残り: {r}"))
+                    
+                    # 各ワーカーの内訳は全プロセスの合計（実時間ではなく延べ時間）
+                    self.metrics.record('segments', time.time() - start_process_time,
+                                        sum(result['frames'] for result in results))
+                    for result in results:
+                        self.metrics.merge(result['timings'])
+                
+                if failed:
+                    for result in failed:
+                        print(f"セグメント {result['index']} の処理に失敗: {result['error']}")
+                    print(f"処理済みのセグメントは {work_dir} に残っています。同じ設定で再実行すると続きから処理します")
+                    return False
+            
+            # セグメントを-c copyで連結し、音声は最後に1回だけ結合
+            self.root.after(0, lambda: self.progress_label.config(text="セグメント連結+音声結合中..."))
+            list_path = os.path.join(work_dir, 'segments.txt')
+            with open(list_path, 'w', encoding='utf-8') as f:
+                for segment in manifest['segments']:
+                    f.write(f"file '{segment['file']}'\n")
             
-            if process.returncode != 0:
-                error_msg = process.stderr.decode('utf-8', errors='ignore')
-                print(f"音声結合エラー: {error_msg}")
+            cmd = ['ffmpeg', '-y',
+                   '-f', 'concat', '-safe', '0', '-i', list_path,
+                   *build_input_seek_args(self.video_path, start_time, end_time),
+                   '-map', '0:v:0', '-map', '1:a:0?',
+                   '-c', 'copy',
+                   output_path]
+            print(f"連結コマンド: {' '.join(cmd)}")
+            
+            process = self.run_ffmpeg_with_progress(cmd, end_time - start_time, "セグメント連結+音声結合中",
+                                                    start_percent=95, span=5, stage='mux')
+            error = process.output_error(output_path)
+            if error is not None:
+                print(f"連結エラー: {error}")
                 return False
             
-            print("音声結合+エンコード完了")
+            shutil.rmtree(work_dir, ignore_errors=True)
+            print("並列台形補正+連結完了")
             return True
             
         except Exception as e:
-            # 一時ファイルのクリーンアップ
-            if 'temp_video_path' in locals() and os.path.exists(temp_video_path):
-                try:
-                    os.remove(temp_video_path)
-                except:
-                    pass
-            print(f"OpenCVフォールバック処理エラー: {e}")
+            print(f"並列処理エラー: {e}")
+            print(f"処理済みのセグメントは {work_dir} に残っています。同じ設定で再実行すると続きから処理します")
+            return False
+    
+    def load_segment_manifest(self, work_dir, job_key):
+        """前回の manifest を読み込み、確定済みセグメントを検証する（別のジョブの記録ならNone）
+        
+        検証はファイルのサイズと更新時刻の比較だけで行い、一致しないセグメントは未処理に戻す。
+        """
+        manifest_path = os.path.join(work_dir, 'manifest.json')
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        
+        if (manifest is None or manifest.get('version') != SEGMENT_MANIFEST_VERSION
+                or manifest.get('job_key') != job_key):
+            # 設定が変わった場合は前回のセグメントを使わない
+            for name in os.listdir(work_dir):
+                if name.startswith('segment_') or name == 'manifest.json':
+                    os.remove(os.path.join(work_dir, name))
+            return None
+        
+        for segment in manifest['segments']:
+            if segment['signature'] is None:
+                continue
+            path = os.path.join(work_dir, segment['file'])
+            if not os.path.exists(path) or file_signature(path) != segment['signature']:
+                print(f"セグメント {segment['index']} が記録と一致しないため再処理します")
+                segment['signature'] = None
+        return manifest
+    
+    def save_segment_manifest(self, work_dir, manifest):
+        manifest_path = os.path.join(work_dir, 'manifest.json')
+        temp_path = manifest_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, manifest_path)
+    
+    def finalize_segment(self, work_dir, manifest, task, result):
+        """完成したセグメントを正式な名前にして manifest に記録（失敗ならFalse）"""
+        if result['returncode'] != 0 or result['frames'] == 0:
             return False
+        if result['frames'] < task['frame_count']:
+            print(f"警告: セグメント {result['index']} のフレーム数が不足 "
+                  f"({result['frames']}/{task['frame_count']})")
+        
+        segment = manifest['segments'][result['index']]
+        final_path = os.path.join(work_dir, segment['file'])
+        os.replace(task['segment_path'], final_path)
+        segment['signature'] = file_signature(final_path)
+        self.save_segment_manifest(work_dir, manifest)
+        return True
     
     def create_temp_video_with_perspective(self, temp_path):
         """台形補正を適用した一時ファイルを作成（音声付き）"""
@@ -1179,22 +4361,17 @@ class VideoEditor:
                 [float(self.point_entries[2][0].get()), float(self.point_entries[2][1].get())],  # 左下
                 [float(self.point_entries[3][0].get()), float(self.point_entries[3][1].get())]   # 右下
             ])
-            dst_points = np.float32([
-                [0, 0],
-                [self.video_info['width'], 0],
-                [0, self.video_info['height']],
-                [self.video_info['width'], self.video_info['height']]
-            ])
+            warper = PerspectiveWarper(src_points, self.video_info.width, self.video_info.height)
             
             cap = cv2.VideoCapture(self.video_path)
             
             # 音声付きで出力するため、ffmpegを使用
             fourcc = cv2.VideoWriter_fourcc(*'mp4v')
             video_temp = temp_path.replace('.mp4', '_video_only.mp4')
-            out = cv2.VideoWriter(video_temp, fourcc, self.video_info['fps'],
-                                (self.video_info['width'], self.video_info['height']))
+            out = cv2.VideoWriter(video_temp, fourcc, self.video_info.fps,
+                                (self.video_info.width, self.video_info.height))
             
-            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            total_frames = self.video_info.frame_count
             processed_frames = 0
             
             while True:
@@ -1203,9 +4380,7 @@ class VideoEditor:
                     break
                 
                 # 透視変換を適用
-                matrix = cv2.getPerspectiveTransform(src_points, dst_points)
-                corrected = cv2.warpPerspective(frame, matrix, 
-                                              (self.video_info['width'], self.video_info['height']))
+                corrected = warper.apply(frame)
                 out.write(corrected)
                 
                 processed_frames += 1
@@ -1263,28 +4438,15 @@ class VideoEditor:
             start_time = self.get_time_in_seconds(self.start_h, self.start_m, self.start_s, self.start_ms)
             end_time = self.get_time_in_seconds(self.end_h, self.end_m, self.end_s, self.end_ms)
             
-            if start_time >= end_time:
-                self.root.after(0, lambda: messagebox.showerror("エラー", "開始時間は終了時間より前である必要があります"))
-                return
-            
-            if end_time > self.video_info['duration']:
-                self.root.after(0, lambda: messagebox.showerror("エラー", "終了時間が動画の長さを超えています"))
-                return
-            
             # 進捗表示を更新
             self.root.after(0, lambda: self.progress_label.config(text="処理を開始しています..."))
             
-            # エンコーダー設定を取得
-            encoder, quality_settings = self.get_encoder_settings()
-            
-            success = False
-            
-            if encoder == 'opencv':
-                # OpenCVで処理
-                success = self.process_video_opencv(output_path, start_time, end_time, quality_settings)
-            else:
-                # ffmpegで処理
-                success = self.process_video_ffmpeg(output_path, start_time, end_time, encoder, quality_settings)
+            try:
+                success = self.export_range(output_path, start_time, end_time)
+            except ValueError as e:
+                message = str(e)
+                self.root.after(0, lambda: messagebox.showerror("エラー", message))
+                return
             
             if success:
                 # 完了通知
@@ -1295,9 +4457,310 @@ class VideoEditor:
                 raise Exception("動画処理に失敗しました")
             
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("エラー", f"処理中にエラーが発生しました: {str(e)}"))
+            # e は except を抜けると消えるため、メッセージを先に取り出しておく
+            message = f"処理中にエラーが発生しました: {str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("エラー", message))
+            self.root.after(0, lambda: self.progress_label.config(text="エラーが発生しました"))
+    
+    def export_range(self, output_path, start_time, end_time):
+        """現在の設定で指定範囲を書き出す（範囲が不正ならValueError）"""
+        if start_time >= end_time:
+            raise ValueError("開始時間は終了時間より前である必要があります")
+        
+        if end_time > self.video_info.duration:
+            raise ValueError("終了時間が動画の長さを超えています")
+        
+        # エンコーダー設定を取得
+        encoder, quality_settings = self.get_encoder_settings()
+        
+        if encoder == 'opencv':
+            # OpenCVで処理
+            return self.run_with_metrics(output_path, {'encoder': encoder, 'range': [start_time, end_time]},
+                                         self.process_video_opencv,
+                                         output_path, start_time, end_time, quality_settings)
+        # ffmpegで処理
+        return self.run_with_metrics(output_path, {'encoder': encoder, 'range': [start_time, end_time]},
+                                     self.process_video_ffmpeg,
+                                     output_path, start_time, end_time, encoder, quality_settings)
+    
+    def open_clip_list_dialog(self):
+        """複数クリップ書き出しのウィンドウを開く"""
+        if not self.video_path or not self.video_info:
+            messagebox.showerror("エラー", "動画ファイルを選択してください")
+            return
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("複数クリップ書き出し")
+        dialog.geometry("600x450")
+        
+        tk.Label(dialog, text="1行に1クリップ:  開始時間  終了時間  名前（HH:MM:SS.sss、範囲の重複可）",
+                 fg='blue').pack(anchor='w', padx=10, pady=(10, 2))
+        tk.Label(dialog, text="例: 00:10:00.000 00:12:30.500 ハイライト1", fg='gray').pack(anchor='w', padx=10)
+        
+        text_area = tk.Text(dialog, font=('Consolas', 10))
+        text_area.pack(fill='both', expand=True, padx=10, pady=10)
+        
+        def start_export():
+            try:
+                clips = self.parse_clip_list(text_area.get('1.0', tk.END))
+            except ValueError as e:
+                messagebox.showerror("エラー", str(e), parent=dialog)
+                return
+            
+            output_dir = filedialog.askdirectory(title="出力先フォルダを選択", parent=dialog)
+            if not output_dir:
+                return
+            dialog.destroy()
+            
+            thread = threading.Thread(target=self._process_clips_thread, args=(clips, output_dir))
+            thread.daemon = True
+            thread.start()
+        
+        tk.Button(dialog, text="書き出し", command=start_export, bg='lightgreen').pack(pady=(0, 10))
+    
+    def parse_clip_list(self, text):
+        """クリップ一覧の文字列を [(開始秒, 終了秒, 名前), ...] に変換"""
+        clips = []
+        for line_number, line in enumerate(text.split('\n'), 1):
+            parts = line.split(None, 2)
+            if not parts:
+                continue
+            if len(parts) < 2 or ':' not in parts[0] or ':' not in parts[1]:
+                raise ValueError(f"{line_number}行目: 「開始時間 終了時間 名前」の形式で入力してください")
+            
+            start_time = self.parse_time_to_seconds(parts[0])
+            end_time = self.parse_time_to_seconds(parts[1])
+            name = parts[2].strip() if len(parts) > 2 else f"clip_{len(clips) + 1:02d}"
+            
+            if start_time >= end_time:
+                raise ValueError(f"{line_number}行目: 開始時間は終了時間より前である必要があります")
+            if end_time > self.video_info.duration:
+                raise ValueError(f"{line_number}行目: 終了時間が動画の長さを超えています")
+            clips.append((start_time, end_time, name))
+        
+        if not clips:
+            raise ValueError("クリップが入力されていません")
+        return clips
+    
+    def _process_clips_thread(self, clips, output_dir):
+        try:
+            self.root.after(0, lambda: self.progress_label.config(text="複数クリップ処理を開始しています..."))
+            results = self.export_clips(clips, output_dir)
+            failed = [name for name, success in results if not success]
+            
+            if failed:
+                raise Exception(f"次のクリップの処理に失敗しました: {', '.join(failed)}")
+            
+            self.root.after(0, lambda: self.update_progress(100, "完了！"))
+            self.root.after(0, lambda: messagebox.showinfo("完了", f"{len(results)} 本のクリップを書き出しました！"))
+        except Exception as e:
+            # e は except を抜けると消えるため、メッセージを先に取り出しておく
+            message = f"処理中にエラーが発生しました: {str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("エラー", message))
             self.root.after(0, lambda: self.progress_label.config(text="エラーが発生しました"))
     
+    def run_with_metrics(self, output_path, info, func, *args):
+        """処理の内訳を集計しながら func を実行する
+        
+        内訳はジョブごとのJSON Linesファイルに書き出し、プロファイルが有効なら
+        cProfileの結果を同じ名前の .prof に保存する（snakeviz などで確認できる）。
+        """
+        metrics_path = JobMetrics.create_path(output_path)
+        info = dict(info, source=self.video_path, output=output_path,
+                    width=self.video_info.width, height=self.video_info.height, fps=self.video_info.fps)
+        self.metrics = JobMetrics(metrics_path, info)
+        self.root.after(0, self.refresh_metrics_panel)
+        
+        profiler = cProfile.Profile() if self.use_profiling.get() else None
+        result = None
+        try:
+            if profiler is not None:
+                profiler.enable()
+            result = func(*args)
+            return result
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profile_path = metrics_path[:-len('.jsonl')] + '.prof'
+                profiler.dump_stats(profile_path)
+                print(f"プロファイルを保存しました: {profile_path}")
+            self.metrics.close(success=bool(result))
+            print(f"処理の内訳:\n{self.metrics.format_table()}")
+            print(f"メトリクスを保存しました: {metrics_path}")
+    
+    def refresh_metrics_panel(self):
+        """処理の内訳パネルを更新（処理中は定期的に更新し続ける）"""
+        self.metrics_label.config(text=self.metrics.format_table())
+        if not self.metrics.closed:
+            self.root.after(500, self.refresh_metrics_panel)
+    
+    def export_clips(self, clips, output_dir):
+        """現在の設定で複数クリップを書き出す（戻り値は [(名前, 成功したか), ...]）"""
+        encoder, quality_settings = self.get_encoder_settings()
+        if encoder == 'opencv':
+            # 複数出力はffmpegへのパイプで行うため、CPUエンコーダーを使う
+            encoder = 'libx264'
+            quality_settings = self.get_quality_settings(encoder, self.quality_var.get())
+        results = self.run_with_metrics(os.path.join(output_dir, 'clips'),
+                                        {'encoder': encoder, 'clips': [list(clip) for clip in clips]},
+                                        self.process_clips, clips, output_dir, encoder, quality_settings)
+        return results or []
+    
+    def process_clips(self, clips, output_dir, encoder, quality_settings):
+        """複数クリップを1回のデコードで書き出す
+        
+        全クリップの範囲の和集合を時刻順に1度だけデコード（・台形補正）し、
+        各フレームをその時点で有効なクリップごとのエンコーダーへ振り分ける。
+        戻り値は [(名前, 成功したか), ...]。
+        """
+        width = self.video_info.width
+        height = self.video_info.height
+        fps = self.video_info.fps
+        
+        warper = None
+        geometry = self.get_output_geometry()
+        if self.use_perspective.get() or geometry is not None:
+            warper = PerspectiveWarper(self.get_src_points(), width, height, geometry=geometry)
+            width, height = warper.width, warper.height
+        
+        # クリップごとのフレーム範囲
+        jobs = []
+        for start_time, end_time, name in clips:
+            start_frame, end_frame = self.get_frame_range(start_time, end_time)
+            safe_name = re.sub(r'[\\/:*?"<>|]', '_', name)
+            jobs.append({
+                'name': name,
+                'start_time': start_time,
+                'end_time': end_time,
+                'start_frame': start_frame,
+                'end_frame': end_frame,
+                'output_path': os.path.join(output_dir, f"{safe_name}.mp4"),
+                'sink': None,
+                'failed': False,
+            })
+        
+        # 範囲の和集合（重なり・隣接はまとめる）
+        intervals = []
+        for job in sorted(jobs, key=lambda j: j['start_frame']):
+            if intervals and job['start_frame'] <= intervals[-1][1]:
+                intervals[-1][1] = max(intervals[-1][1], job['end_frame'])
+            else:
+                intervals.append([job['start_frame'], job['end_frame']])
+        total_frames = sum(end - start for start, end in intervals)
+        print(f"複数クリップ: {len(jobs)} 本 / デコード範囲 {len(intervals)} 区間 (合計 {total_frames} フレーム)")
+        
+        cap = cv2.VideoCapture(self.video_path)
+        finished_sinks = []
+        
+        # 処理の内訳を記録する
+        def read_frame():
+            start = time.perf_counter()
+            ret, frame = cap.read()
+            self.metrics.record('decode', time.perf_counter() - start, 1 if ret else 0, frame.nbytes if ret else 0)
+            return ret, frame
+        
+        def send_frame(frame, stdin):
+            stdin.write(frame.data)
+        
+        # フレームは全クリップへ送り終えてから次を変換するので、出力バッファは2枚で足りる
+        band_warper = self.create_band_warper(warper, 2) if warper is not None else None
+        if band_warper is not None:
+            warp_frame = self.metrics.timed('warp', band_warper.apply)
+        else:
+            warp_frame = self.metrics.timed('warp', warper.apply) if warper is not None else None
+        send_frame = self.metrics.timed('pipe', send_frame)
+        
+        # 静止フレームは補正せず、直前の補正結果を送る（区間を移るときは比較相手を捨てる）
+        detector = StaticFrameDetector() if warper is not None and self.use_static_skip.get() else None
+        is_static = self.metrics.timed('static_check', detector.is_static) if detector is not None else None
+        warped = None
+        processed_frames = 0
+        start_process_time = time.time()
+        position = None     # 次のread()で返るフレーム番号
+        
+        try:
+            for interval_start, interval_end in intervals:
+                # 近ければ読み進め、遠ければシーク
+                if position is not None and 0 <= interval_start - position <= PreviewDecoder.SEQUENTIAL_LIMIT:
+                    for _ in range(interval_start - position):
+                        cap.grab()
+                else:
+                    self.seek_capture(cap, interval_start)
+                if detector is not None:
+                    detector.reset()
+                    warped = None
+                
+                for frame_number in range(interval_start, interval_end):
+                    ret, frame = read_frame()
+                    if not ret:
+                        print(f"フレーム {frame_number} の読み込みに失敗")
+                        break
+                    if is_static is not None and is_static(frame) and warped is not None:
+                        frame = warped
+                        self.metrics.record('static_skip', 0.0)
+                    elif warper is not None:
+                        frame = warped = warp_frame(frame)
+                    
+                    for job in jobs:
+                        if job['failed'] or not (job['start_frame'] <= frame_number < job['end_frame']):
+                            continue
+                        
+                        # クリップの開始フレームでエンコーダーを起動
+                        if job['sink'] is None:
+                            cmd = self.build_pipe_encode_command(job['output_path'], width, height, fps,
+                                                                 job['start_time'], job['end_time'],
+                                                                 encoder, quality_settings)
+                            job['sink'] = FFmpegProgress(cmd, job['end_time'] - job['start_time'],
+                                                         stdin=subprocess.PIPE)
+                        try:
+                            send_frame(frame, job['sink'].stdin)
+                        except (BrokenPipeError, OSError):
+                            print(f"クリップ「{job['name']}」のエンコーダーへの送信に失敗")
+                            job['failed'] = True
+                        
+                        # 最終フレームを送ったら入力を閉じる（終了待ちは最後にまとめて行う）
+                        if frame_number == job['end_frame'] - 1:
+                            job['sink'].stdin.close()
+                            finished_sinks.append(job)
+                    
+                    processed_frames += 1
+                    position = frame_number + 1
+                    
+                    if processed_frames % 30 == 0:
+                        progress = (processed_frames / total_frames) * 100
+                        elapsed_time = time.time() - start_process_time
+                        remaining_time = (elapsed_time / processed_frames) * (total_frames - processed_frames)
+                        remaining_str = str(timedelta(seconds=int(remaining_time)))
+                        active = sum(1 for job in jobs if job['sink'] is not None and job not in finished_sinks)
+                        self.root.after(0, lambda p=progress, n=processed_frames, a=active, r=remaining_str:
+                                      self.update_progress(p, f"複数クリップ処理中... {n}/{total_frames} "
+                                                              f"(同時出力 {a} 本) - 残り: {r}"))
+        finally:
+            cap.release()
+            if band_warper is not None:
+                band_warper.close()
+            # 読み込み失敗などで閉じられなかったエンコーダーも閉じる
+            for job in jobs:
+                if job['sink'] is not None and job not in finished_sinks:
+                    try:
+                        job['sink'].stdin.close()
+                    except (BrokenPipeError, OSError):
+                        pass
+        
+        results = []
+        for job in jobs:
+            if job['sink'] is None:
+                results.append((job['name'], False))
+                continue
+            job['sink'].wait()
+            self.metrics.record_process('encode', job['sink'])
+            self.record_duplicate_drop(job['end_frame'] - job['start_frame'], job['sink'])
+            error = job['sink'].output_error(job['output_path'])
+            if error is not None:
+                print(f"クリップ「{job['name']}」のエンコードエラー: {error}")
+            results.append((job['name'], error is None and not job['failed']))
+        return results
+    
     def parse_time_to_seconds(self, time_str):
         """HH:MM:SS.ss形式の時間を秒に変換"""
         try:
@@ -1309,11 +4772,376 @@ class VideoEditor:
         except:
             return 0
     
+    def make_progress_callback(self, label, start_percent=0, span=100, detail=None):
+        """FFmpegProgress用のコールバック（全体のうち start_percent から span % 分を受け持つ）
+        
+        detail を渡すと、その戻り値を進捗表示の末尾に添える。
+        """
+        def callback(percent, fps, speed, eta):
+            remaining_str = str(timedelta(seconds=int(eta))) if eta is not None else "計算中..."
+            overall = start_percent + percent * span / 100
+            message = f"{label}... {percent:.1f}% - {fps:.0f}fps ({speed:.2f}x) - 残り: {remaining_str}"
+            if detail is not None:
+                extra = detail()
+                if extra:
+                    message += f" ({extra})"
+            self.root.after(0, lambda: self.update_progress(overall, message))
+        return callback
+    
+    def run_ffmpeg_with_progress(self, cmd, duration, label, start_percent=0, span=100, stage='encode'):
+        """ffmpegを実行して終了まで進捗を表示（終了後のFFmpegProgressを返す）
+        
+        実行時間・フレーム数・出力バイト数は処理の内訳の stage に記録する。
+        """
+        process = FFmpegProgress(cmd, duration, self.make_progress_callback(label, start_percent, span))
+        process.wait()
+        self.metrics.record_process(stage, process)
+        return process
+    
     def update_progress(self, progress, message):
         self.progress_bar.config(value=min(progress, 100))
         self.progress_label.config(text=message)
 
+
+# ヘッドレス実行時のエンコーダー種別ごとの同時実行数
+CPU_CORES_PER_JOB = 4
+DEFAULT_ENCODER_SLOTS = {
+    'nvenc': NVENC_MAX_SESSIONS,
+    'qsv': 2,
+    'cpu': max(1, (os.cpu_count() or 1) // CPU_CORES_PER_JOB),
+}
+
+
+def encoder_slot_class(encoder_code):
+    """エンコーダー名から同時実行数を制限する種別を返す"""
+    if 'nvenc' in encoder_code:
+        return 'nvenc'
+    if 'qsv' in encoder_code:
+        return 'qsv'
+    return 'cpu'
+
+
+class SettingValue:
+    """Tkの変数・入力欄の代わりに値を保持する（ヘッドレス実行用）"""
+    
+    def __init__(self, value):
+        self.value = value
+    
+    def get(self):
+        return self.value
+    
+    def set(self, value):
+        self.value = value
+
+
+class HeadlessRoot:
+    """Tkのrootの代わり（after() のコールバックをその場で実行する）"""
+    
+    def after(self, delay, callback=None, *args):
+        if callback is not None:
+            callback(*args)
+
+
+class HeadlessLabel:
+    """進捗ラベル・進捗バーの代わり（表示内容をジョブの状態に反映する）"""
+    
+    def __init__(self, on_change):
+        self.options = {}
+        self.on_change = on_change
+    
+    def config(self, **options):
+        self.options.update(options)
+        self.on_change(options)
+    
+    configure = config
+    
+    def cget(self, key):
+        return self.options.get(key, '')
+
+
+class HeadlessVideoEditor(VideoEditor):
+    """画面を作らずにVideoEditorの処理をそのまま使う
+    
+    UIの入力欄を SettingValue に置き換えるだけで、エンコーダー設定や書き出し処理は
+    VideoEditor のメソッドを共有する。
+    """
+    
+    def __init__(self, job, encoder_options, status_callback=None):
+        self.root = HeadlessRoot()
+        self.status_callback = status_callback
+        self.metrics = JobMetrics()
+        self.available_gpus = encoder_options
+        self.progress_label = HeadlessLabel(lambda options: self.report(message=options.get('text')))
+        self.progress_bar = HeadlessLabel(lambda options: self.report(progress=options.get('value')))
+        
+        self.video_path = job['source']
+        try:
+            self.video_info = probe_media_info(self.video_path)
+        except Exception as e:
+            print(f"ffprobeでの情報取得に失敗、OpenCVを使用します: {e}")
+            self.video_info = read_media_info_opencv(self.video_path)
+        
+        self.encoder_var = SettingValue(self.find_encoder_name(job.get('encoder', 'libx264')))
+        self.quality_var = SettingValue(job.get('quality', "高品質"))
+        self.size_budget_spin = SettingValue(str(job.get('size_budget_mb_per_min', 0)))
+        
+        quad = job.get('quad')
+        if quad is None:
+            width, height = self.video_info.width, self.video_info.height
+            quad = [[0, 0], [width, 0], [0, height], [width, height]]
+        if len(quad) != 4:
+            raise ValueError("quad には4点（左上・右上・左下・右下）を指定してください")
+        self.use_perspective = SettingValue(job.get('quad') is not None)
+        self.point_entries = [(SettingValue(str(x)), SettingValue(str(y))) for x, y in quad]
+        
+        output = job.get('geometry', {})
+        self.output_resolution_var = SettingValue(output.get('resolution', "元のまま"))
+        self.output_aspect_var = SettingValue(output.get('aspect', "元のまま"))
+        self.crop_entries = [SettingValue(str(value)) for value in output.get('crop', ["", "", "", ""])]
+        
+        self.use_native_perspective = SettingValue(job.get('native_perspective', True))
+        self.use_yuv_warp = SettingValue(job.get('yuv_warp', True))
+        self.use_parallel = SettingValue(job.get('parallel', False))
+        self.segment_count_spin = SettingValue(str(job.get('segments', os.cpu_count() or 1)))
+        self.pipeline_memory_spin = SettingValue(str(job.get('pipeline_memory_mb',
+                                                              FramePipeline.MEMORY_BUDGET // (1024 * 1024))))
+        self.warp_bands_spin = SettingValue(str(job.get('warp_bands', 0)))
+        self.warp_threads_spin = SettingValue(str(job.get('warp_threads', 0)))
+        self.use_smart_cut = SettingValue(job.get('smart_cut', False))
+        self.use_resumable = SettingValue(job.get('resumable', False))
+        self.use_static_skip = SettingValue(job.get('static_skip', False))
+        self.use_drop_duplicates = SettingValue(job.get('drop_duplicates', False))
+        self.use_profiling = SettingValue(job.get('profile', False))
+    
+    def find_encoder_name(self, encoder):
+        """エンコーダー名（ffmpegの名前または表示名）から選択肢の表示名を返す"""
+        for name, code in self.available_gpus:
+            if encoder in (name, code):
+                return name
+        raise ValueError(f"エンコーダー {encoder} はこの環境では使用できません")
+    
+    def refresh_metrics_panel(self):
+        """画面がないので処理の内訳はメトリクスファイルにのみ残す"""
+        pass
+    
+    def report(self, **status):
+        if self.status_callback is not None:
+            self.status_callback({key: value for key, value in status.items() if value is not None})
+    
+    def update_progress(self, progress, message):
+        self.report(progress=min(progress, 100), message=message)
+
+
+class HeadlessJobRunner:
+    """JSONのジョブ定義を読み込み、ワーカー数とエンコーダー種別ごとの上限を守って実行する
+    
+    ジョブ定義の例:
+        {"source": "in.mp4", "output": "out.mp4",
+         "start": "00:10:00.000", "end": "00:12:30.500",
+         "quad": [[120, 40], [1800, 60], [80, 1050], [1840, 1030]],
+         "encoder": "h264_nvenc", "quality": "高品質"}
+    
+    "ranges" に [{"start": ..., "end": ..., "name": ...}, ...] を指定した場合は
+    "output" を出力先フォルダとして複数クリップを書き出す。
+    """
+    
+    STATUS_INTERVAL = 1.0
+    
+    def __init__(self, jobs, status_path, workers=None, slots=None):
+        self.jobs = jobs
+        self.status_path = status_path
+        self.workers = workers or max(1, len(jobs))
+        self.slots = dict(DEFAULT_ENCODER_SLOTS)
+        self.slots.update(slots or {})
+        self.running = {slot: 0 for slot in self.slots}
+        self.condition = threading.Condition()
+        self.last_status_write = 0
+        
+        capabilities = lookup_cached_capabilities() or probe_encoder_capabilities()
+        if capabilities is None:
+            self.encoder_options = [AUTO_ENCODER_OPTION] + list(DEFAULT_ENCODER_OPTIONS)
+        else:
+            self.encoder_options = [AUTO_ENCODER_OPTION] + [tuple(option) for option in capabilities['options']]
+        
+        # 自動選択のジョブは先にエンコーダーを決めておく（同時実行数の制限を実際のエンコーダーで数える）
+        for job in jobs:
+            if job.get('encoder') == 'auto':
+                self.resolve_auto_encoder(job)
+        
+        self.status = []
+        for number, job in enumerate(jobs, 1):
+            self.status.append({
+                'id': job.get('id', f"job_{number:03d}"),
+                'source': job.get('source'),
+                'output': job.get('output'),
+                'encoder': job.get('encoder', 'libx264'),
+                'state': 'pending',
+                'progress': 0,
+                'message': '',
+                'started_at': None,
+                'finished_at': None,
+                'error': None,
+            })
+    
+    @staticmethod
+    def load_jobs(paths):
+        """JSONファイルからジョブ一覧を読み込む（1件・配列・{"jobs": [...]} に対応）"""
+        jobs = []
+        for path in paths:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                data = data.get('jobs', [data])
+            jobs.extend(data)
+        return jobs
+    
+    def resolve_auto_encoder(self, job):
+        """'auto' のジョブのエンコーダーと品質名を計測結果から決めて書き換える
+        
+        動画を読めないなどで決められない場合は 'auto' のまま残し、実行時のエラーとして報告する。
+        """
+        try:
+            editor = HeadlessVideoEditor(job, self.encoder_options)
+            encoder, quality = editor.resolve_auto_encoder(editor.quality_var.get())
+        except Exception as e:
+            print(f"エンコーダーの自動選択に失敗: {job.get('source')}: {e}")
+            return
+        job['encoder'] = encoder
+        job['quality'] = quality
+    
+    def job_slot(self, job):
+        """ジョブが使うエンコーダー種別（OpenCV書き出しはCPU扱い）"""
+        slot = encoder_slot_class(job.get('encoder', 'libx264'))
+        return slot if slot in self.slots else 'cpu'
+    
+    def write_status(self, force=False):
+        """状態ファイルを書き出す（進捗のみの更新は STATUS_INTERVAL ごと）"""
+        with self.condition:
+            now = time.time()
+            if not force and now - self.last_status_write < self.STATUS_INTERVAL:
+                return
+            self.last_status_write = now
+            data = {
+                'updated_at': now,
+                'workers': self.workers,
+                'slots': self.slots,
+                'jobs': self.status,
+            }
+            temp_path = self.status_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.status_path)
+    
+    def update_status(self, index, force=False, **status):
+        with self.condition:
+            self.status[index].update(status)
+        self.write_status(force)
+    
+    def run(self):
+        """全ジョブを実行し、失敗したジョブ数を返す"""
+        pending = list(range(len(self.jobs)))
+        self.write_status(force=True)
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            active = 0
+            while pending or active:
+                with self.condition:
+                    # 空きのあるエンコーダー種別のジョブから順に投入（先頭が詰まっても後続は進める）
+                    for index in list(pending):
+                        if active >= self.workers:
+                            break
+                        slot = self.job_slot(self.jobs[index])
+                        if self.running[slot] >= self.slots[slot]:
+                            continue
+                        self.running[slot] += 1
+                        active += 1
+                        pending.remove(index)
+                        executor.submit(self.run_job, index, slot)
+                    self.condition.wait()
+                    active = sum(self.running.values())
+        
+        self.write_status(force=True)
+        return sum(1 for status in self.status if status['state'] != 'done')
+    
+    def run_job(self, index, slot):
+        job = self.jobs[index]
+        self.update_status(index, force=True, state='running', started_at=time.time())
+        print(f"ジョブ開始: {self.status[index]['id']} ({job.get('encoder', 'libx264')})")
+        try:
+            editor = HeadlessVideoEditor(job, self.encoder_options,
+                                         lambda status: self.update_status(index, **status))
+            # GUIでは動画選択時にバックグラウンドで作る索引を先に用意する
+            try:
+                PacketIndex.load(editor.video_path)
+            except Exception as e:
+                print(f"パケット索引の作成に失敗: {e}")
+            
+            if 'ranges' in job:
+                os.makedirs(job['output'], exist_ok=True)
+                clips = []
+                for number, clip in enumerate(job['ranges'], 1):
+                    clips.append((self.to_seconds(editor, clip['start']), self.to_seconds(editor, clip['end']),
+                                  clip.get('name', f"clip_{number:02d}")))
+                results = editor.export_clips(clips, job['output'])
+                failed = [name for name, success in results if not success]
+                if failed:
+                    raise Exception(f"次のクリップの処理に失敗しました: {', '.join(failed)}")
+            else:
+                success = editor.export_range(job['output'], self.to_seconds(editor, job['start']),
+                                              self.to_seconds(editor, job['end']))
+                if not success:
+                    raise Exception("動画処理に失敗しました")
+            
+            self.update_status(index, force=True, state='done', progress=100, message="完了",
+                               finished_at=time.time())
+            print(f"ジョブ完了: {self.status[index]['id']}")
+        except Exception as e:
+            self.update_status(index, force=True, state='failed', error=str(e), finished_at=time.time())
+            print(f"ジョブ失敗: {self.status[index]['id']}: {e}")
+        finally:
+            with self.condition:
+                self.running[slot] -= 1
+                self.condition.notify_all()
+    
+    @staticmethod
+    def to_seconds(editor, value):
+        """秒数または HH:MM:SS.sss 形式の時間を秒に変換"""
+        if isinstance(value, (int, float)):
+            return float(value)
+        return editor.parse_time_to_seconds(value)
+
+
+def parse_slot_limits(values):
+    """["nvenc=3", "cpu=2"] 形式の指定を辞書に変換"""
+    slots = {}
+    for value in values or []:
+        name, _, count = value.partition('=')
+        slots[name.strip()] = max(1, int(count))
+    return slots
+
+
+def run_headless(argv):
+    """コマンドラインからジョブを実行（画面は作らない）"""
+    parser = argparse.ArgumentParser(description="Twitcas Movie Maker ヘッドレス実行")
+    parser.add_argument('--headless', nargs='+', metavar='JOB.json', required=True,
+                        help="ジョブ定義のJSONファイル")
+    parser.add_argument('--workers', type=int, default=None, help="同時に実行するジョブ数")
+    parser.add_argument('--slots', nargs='*', metavar='種別=数',
+                        help="エンコーダー種別ごとの同時実行数 (nvenc / qsv / cpu)")
+    parser.add_argument('--status', default='job_status.json', help="状態ファイルの出力先")
+    args = parser.parse_args(argv)
+    
+    jobs = HeadlessJobRunner.load_jobs(args.headless)
+    runner = HeadlessJobRunner(jobs, args.status, args.workers, parse_slot_limits(args.slots))
+    failed = runner.run()
+    print(f"全 {len(jobs)} ジョブ終了（失敗 {failed} 件）。状態ファイル: {args.status}")
+    return 1 if failed else 0
+
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    if '--headless' in sys.argv[1:]:
+        sys.exit(run_headless(sys.argv[1:]))
     root = tk.Tk()
     app = VideoEditor(root)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,377 @@
+"""Twitcas Movie Maker ベンチマーク
+
+ffmpegのlavfi (testsrc2 / sine) で決まった内容の素材を作り、各処理経路を
+CPUエンコーダーで実行して 処理時間・fps・最大メモリ使用量・一時ファイル書き込み量 をJSONで出力する。
+基準の結果と比較して、悪化したケースを検出できる。GPUや画面のないLinuxでも動作する。
+
+    python benchmark.py --output result.json
+    python benchmark.py --output result.json --baseline baseline.json
+    python benchmark.py --compare baseline.json result.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Twitcas-movie-maker.py')
+
+RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+PATHS = ['opencv', 'ffmpeg', 'native', 'fallback', 'fallback_bgr', 'segmented', 'smartcut']
+
+SOURCE_DURATION = 6     # 素材の長さ（秒）
+SOURCE_FPS = 30
+CLIP_START = 1.0        # 切り抜く範囲（秒）
+CLIP_END = 5.0
+QUALITY = "高速"
+
+# 比較で悪化とみなす指標（値が大きいほど悪い）
+COMPARE_METRICS = ['wall_time', 'peak_rss_bytes', 'temp_bytes']
+DEFAULT_THRESHOLD = 0.10
+
+
+def load_app():
+    """本体 (Twitcas-movie-maker.py) をモジュールとして読み込む"""
+    spec = importlib.util.spec_from_file_location('twitcas_movie_maker', APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    # 並列処理のワーカーがpickleで関数を参照できるよう登録しておく
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def ffmpeg_version():
+    try:
+        result = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True, timeout=10)
+        return result.stdout.split('\n')[0].strip()
+    except Exception:
+        return None
+
+
+def source_name(resolution, vfr, audio):
+    return f"testsrc_{resolution}_{'vfr' if vfr else 'cfr'}_{'audio' if audio else 'noaudio'}.mp4"
+
+
+def generate_source(source_dir, resolution, vfr, audio):
+    """決まった内容のテスト素材を作成（作成済みなら再利用）"""
+    path = os.path.join(source_dir, source_name(resolution, vfr, audio))
+    if os.path.exists(path):
+        return path
+
+    width, height = RESOLUTIONS[resolution]
+    cmd = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+           '-f', 'lavfi', '-i', f"testsrc2=size={width}x{height}:rate={SOURCE_FPS}:duration={SOURCE_DURATION}"]
+    if audio:
+        cmd.extend(['-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={SOURCE_DURATION}"])
+
+    if vfr:
+        # 10フレーム中3フレームを間引き、時刻はそのまま残して可変フレームレートにする
+        cmd.extend(['-vf', "select='lt(mod(n\\,10)\\,7)'", '-fps_mode', 'vfr'])
+
+    cmd.extend(['-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(SOURCE_FPS), '-pix_fmt', 'yuv420p',
+                '-fflags', '+bitexact', '-flags:v', '+bitexact'])
+    if audio:
+        cmd.extend(['-c:a', 'aac', '-b:a', '128k', '-flags:a', '+bitexact'])
+
+    temp_path = path + '.tmp.mp4'
+    cmd.append(temp_path)
+    print(f"素材を作成中: {os.path.basename(path)}")
+    subprocess.run(cmd, check=True)
+    os.replace(temp_path, path)
+    return path
+
+
+class TempFileMonitor:
+    """作業フォルダ内の一時ファイルの大きさを監視し、書き込まれた量を記録する"""
+
+    INTERVAL = 0.1
+
+    def __init__(self, directory, exclude):
+        self.directory = directory
+        self.exclude = set(os.path.abspath(path) for path in exclude)
+        self.sizes = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def _scan(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.abspath(os.path.join(root, name))
+                if path in self.exclude:
+                    continue
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                self.sizes[path] = max(self.sizes.get(path, 0), size)
+
+    def _run(self):
+        while not self.stop_event.wait(self.INTERVAL):
+            self._scan()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        self._scan()
+        return sum(self.sizes.values())
+
+
+def peak_rss_bytes():
+    """このプロセスと終了済みの子プロセス（ffmpeg・ワーカー）の最大メモリ使用量"""
+    if resource is None:
+        return None
+    # Linuxの ru_maxrss はKB単位
+    usage_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(usage_self, usage_children) * 1024
+
+
+def run_case(case):
+    """1ケースを実行して結果を返す（計測を分けるため、ケースごとに別プロセスで呼ばれる）"""
+    app = load_app()
+    work_dir = case['work_dir']
+    output_path = os.path.join(work_dir, 'output.mp4')
+
+    job = {
+        'source': case['source'],
+        'encoder': 'opencv' if case['path'] == 'opencv' else 'libx264',
+        'quality': QUALITY,
+        'native_perspective': case['path'] == 'native',
+        'parallel': case['path'] == 'segmented',
+        'smart_cut': case['path'] == 'smartcut',
+        # fallback はyuv420pのままの補正、fallback_bgr は従来のBGRでの補正
+        'yuv_warp': case['path'] != 'fallback_bgr',
+    }
+    if case['path'] in ('native', 'fallback', 'fallback_bgr', 'segmented'):
+        width, height = RESOLUTIONS[case['resolution']]
+        inset_x, inset_y = width * 0.05, height * 0.05
+        job['quad'] = [[inset_x, inset_y], [width - inset_x, 0], [0, height - inset_y], [width, height]]
+
+    # キャッシュ（索引・remapテーブルなど）も作業フォルダに作られるので、索引の作成から監視する
+    monitor = TempFileMonitor(work_dir, [output_path])
+    monitor.start()
+
+    editor = app.HeadlessVideoEditor(job, list(app.DEFAULT_ENCODER_OPTIONS))
+    app.PacketIndex.load(editor.video_path)
+    encoder, quality_settings = editor.get_encoder_settings()
+
+    start = time.perf_counter()
+
+    if case['path'] == 'opencv':
+        success = editor.process_video_opencv(output_path, CLIP_START, CLIP_END, quality_settings)
+    elif case['path'] in ('fallback', 'fallback_bgr', 'segmented'):
+        success = editor.process_video_opencv_fallback(output_path, CLIP_START, CLIP_END,
+                                                       encoder, quality_settings)
+    else:
+        success = editor.process_video_ffmpeg(output_path, CLIP_START, CLIP_END, encoder, quality_settings)
+
+    wall_time = time.perf_counter() - start
+    temp_bytes = monitor.stop()
+
+    frames = 0
+    if success and os.path.exists(output_path):
+        try:
+            frames = app.probe_media_info(output_path).frame_count
+        except Exception as e:
+            print(f"出力の解析に失敗: {e}")
+
+    return {
+        'success': bool(success),
+        'wall_time': wall_time,
+        'frames': frames,
+        'fps': frames / wall_time if wall_time > 0 else 0,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'temp_bytes': temp_bytes,
+        'output_bytes': os.path.getsize(output_path) if os.path.exists(output_path) else 0,
+    }
+
+
+def case_id(case):
+    return (f"{case['path']}/{case['resolution']}/{'vfr' if case['vfr'] else 'cfr'}/"
+            f"{'audio' if case['audio'] else 'noaudio'}")
+
+
+def run_suite(args):
+    source_dir = os.path.join(args.work_dir, 'sources')
+    os.makedirs(source_dir, exist_ok=True)
+
+    results = []
+    for resolution in args.resolutions:
+        for vfr in (False, True):
+            for audio in (True, False):
+                source = generate_source(source_dir, resolution, vfr, audio)
+                for path in args.paths:
+                    case = {'path': path, 'resolution': resolution, 'vfr': vfr, 'audio': audio,
+                            'source': source}
+                    case['id'] = case_id(case)
+
+                    # ケースごとに空の作業フォルダと別プロセスで実行（メモリ・一時ファイルの計測を分ける）
+                    # ホームも作業フォルダにして、本体のキャッシュ（~/.twitcas-movie-maker）を
+                    # ケース間・実行間で持ち越さず、書き込みも一時ファイルとして数える
+                    case['work_dir'] = tempfile.mkdtemp(prefix='case_', dir=args.work_dir)
+                    env = dict(os.environ, TMPDIR=case['work_dir'], TEMP=case['work_dir'],
+                               TMP=case['work_dir'], HOME=case['work_dir'], USERPROFILE=case['work_dir'])
+                    print(f"実行中: {case['id']}")
+                    process = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-case',
+                                              json.dumps(case)],
+                                             capture_output=True, text=True, env=env)
+
+                    result = {'id': case['id'], 'path': path, 'resolution': resolution,
+                              'vfr': vfr, 'audio': audio}
+                    lines = process.stdout.strip().split('\n')
+                    try:
+                        result.update(json.loads(lines[-1]))
+                    except (ValueError, IndexError):
+                        result.update({'success': False, 'error': process.stderr[-2000:]})
+                    results.append(result)
+
+                    if result.get('success'):
+                        print(f"  {result['wall_time']:.2f}秒 / {result['fps']:.1f}fps / "
+                              f"最大メモリ {format_bytes(result['peak_rss_bytes'])} / "
+                              f"一時ファイル {format_bytes(result['temp_bytes'])}")
+                    else:
+                        print("  失敗")
+
+                    if not args.keep:
+                        remove_tree(case['work_dir'])
+
+    return {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'ffmpeg': ffmpeg_version(),
+            'source_duration': SOURCE_DURATION,
+            'clip': [CLIP_START, CLIP_END],
+            'quality': QUALITY,
+        },
+        'results': results,
+    }
+
+
+def remove_tree(path):
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            os.remove(os.path.join(root, name))
+        for name in dirs:
+            os.rmdir(os.path.join(root, name))
+    os.rmdir(path)
+
+
+def format_bytes(value):
+    if value is None:
+        return "-"
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if value < 1024 or unit == 'GB':
+            return f"{value:.1f}{unit}"
+        value /= 1024
+
+
+def compare_results(baseline, current, threshold):
+    """基準と比べて悪化したケースを返す（各指標が threshold の割合を超えて増えたもの）"""
+    baseline_by_id = {result['id']: result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        base = baseline_by_id.get(result['id'])
+        if base is None:
+            continue
+        if base.get('success') and not result.get('success'):
+            regressions.append({'id': result['id'], 'metric': 'success', 'baseline': True, 'current': False})
+            continue
+        if not (base.get('success') and result.get('success')):
+            continue
+        for metric in COMPARE_METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change > threshold:
+                regressions.append({'id': result['id'], 'metric': metric,
+                                    'baseline': old, 'current': new, 'change': change})
+    return regressions
+
+
+def print_regressions(regressions, threshold):
+    if not regressions:
+        print(f"悪化なし（しきい値 {threshold:.0%}）")
+        return
+    print(f"悪化したケース: {len(regressions)} 件（しきい値 {threshold:.0%}）")
+    for regression in regressions:
+        if regression['metric'] == 'success':
+            print(f"  {regression['id']}: 失敗するようになりました")
+        else:
+            print(f"  {regression['id']}: {regression['metric']} {regression['baseline']:.4g} → "
+                  f"{regression['current']:.4g} (+{regression['change']:.0%})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Twitcas Movie Maker ベンチマーク")
+    parser.add_argument('--resolutions', nargs='+', choices=list(RESOLUTIONS), default=list(RESOLUTIONS))
+    parser.add_argument('--paths', nargs='+', choices=PATHS, default=PATHS)
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'twitcas-bench'),
+                        help="素材と作業ファイルの保存先")
+    parser.add_argument('--output', help="結果JSONの出力先")
+    parser.add_argument('--baseline', help="比較する基準の結果JSON")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'),
+                        help="保存済みの結果同士を比較する（ベンチマークは実行しない）")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="悪化とみなす増加率（0.10 = 10%%）")
+    parser.add_argument('--keep', action='store_true', help="各ケースの作業フォルダを残す")
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return 0
+
+    if args.compare:
+        with open(args.compare[0], 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.compare[1], 'r', encoding='utf-8') as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        print_regressions(regressions, args.threshold)
+        return 1 if regressions else 0
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    report = run_suite(args)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, report, args.threshold)
+        report['regressions'] = regressions
+        print_regressions(regressions, args.threshold)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"結果を保存しました: {args.output}")
+    else:
+        print(text)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
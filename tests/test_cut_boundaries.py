@@ -0,0 +1,143 @@
+"""切り抜き範囲（入力側シーク）のテスト
+
+    python -m unittest discover tests
+"""
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Twitcas-movie-maker.py')
+
+SOURCE_DURATION = 6     # 素材の長さ（秒）
+SOURCE_FPS = 30
+SOURCE_GOP = 25         # 切り抜き位置がキーフレームと重ならないようにする
+CLIP_START = 2.0
+CLIP_END = 4.5
+
+# スマートカット: キーフレームは1.5秒ごと、範囲の両端がGOPの途中になる
+SMART_CUT_SOURCE_DURATION = 10
+SMART_CUT_GOP = 45
+SMART_CUT_START = 2.1
+SMART_CUT_END = 9.3
+
+
+def load_app():
+    """本体 (Twitcas-movie-maker.py) をモジュールとして読み込む（依存が無ければNone）"""
+    spec = importlib.util.spec_from_file_location('twitcas_movie_maker', APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except ImportError:
+        return None
+    sys.modules[spec.name] = module
+    return module
+
+
+app = load_app()
+
+
+def has_ffmpeg():
+    return shutil.which('ffmpeg') is not None and shutil.which('ffprobe') is not None
+
+
+def probe_frame_times(path):
+    """出力の各フレームの表示時刻（秒）"""
+    result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0',
+                             '-show_entries', 'frame=pts_time', '-of', 'csv=p=0', path],
+                            capture_output=True, text=True, check=True)
+    return [float(line.strip().rstrip(',')) for line in result.stdout.split('\n')
+            if line.strip() and not line.startswith('N/A')]
+
+
+@unittest.skipIf(app is None, "opencv-python / numpy が必要です")
+class InputSeekArgsTest(unittest.TestCase):
+    def test_seek_before_input(self):
+        args = app.build_input_seek_args('input.mp4', 10.0, 12.5)
+        self.assertLess(args.index('-ss'), args.index('-i'))
+        self.assertLess(args.index('-t'), args.index('-i'))
+        self.assertIn('-accurate_seek', args)
+        self.assertEqual(args[args.index('-ss') + 1], '10.0')
+        self.assertEqual(float(args[args.index('-t') + 1]), 2.5)
+        self.assertEqual(args[args.index('-i') + 1], 'input.mp4')
+
+
+@unittest.skipIf(app is None, "opencv-python / numpy が必要です")
+@unittest.skipUnless(has_ffmpeg(), "ffmpeg / ffprobe が必要です")
+class CutBoundaryTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='twitcas_cut_test_')
+        self.source = os.path.join(self.work_dir, 'source.mp4')
+        subprocess.run(['ffmpeg', '-y', '-v', 'error',
+                        '-f', 'lavfi', '-i', f"testsrc=size=320x240:rate={SOURCE_FPS}:duration={SOURCE_DURATION}",
+                        '-c:v', 'libx264', '-g', str(SOURCE_GOP), '-pix_fmt', 'yuv420p', self.source],
+                       check=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_cut_keeps_exact_range(self):
+        output = os.path.join(self.work_dir, 'cut.mp4')
+        cmd = (['ffmpeg', '-y', '-v', 'error']
+               + app.build_input_seek_args(self.source, CLIP_START, CLIP_END)
+               + ['-c:v', 'libx264', '-an', output])
+        subprocess.run(cmd, check=True)
+
+        times = probe_frame_times(output)
+        frame_duration = 1 / SOURCE_FPS
+        # 先頭は0秒から始まり、範囲の長さ分のフレームだけが残る
+        self.assertAlmostEqual(times[0], 0.0, delta=frame_duration / 2)
+        self.assertEqual(len(times), round((CLIP_END - CLIP_START) * SOURCE_FPS))
+        self.assertAlmostEqual(times[-1], CLIP_END - CLIP_START - frame_duration, delta=frame_duration / 2)
+
+    def test_first_frame_matches_output_seek(self):
+        # 入力側シークの先頭フレームが、先頭から全デコードする出力側シークと同じ画像になること
+        input_seek = self.decode_first_frame(app.build_input_seek_args(self.source, CLIP_START, CLIP_END))
+        output_seek = self.decode_first_frame(['-i', self.source, '-ss', str(CLIP_START)])
+        self.assertTrue(input_seek)
+        self.assertEqual(input_seek, output_seek)
+
+    def decode_first_frame(self, input_args):
+        result = subprocess.run(['ffmpeg', '-v', 'error'] + input_args
+                                + ['-frames:v', '1', '-f', 'rawvideo', '-pix_fmt', 'gray', '-'],
+                                capture_output=True, check=True)
+        return result.stdout
+
+
+@unittest.skipIf(app is None, "opencv-python / numpy が必要です")
+@unittest.skipUnless(has_ffmpeg(), "ffmpeg / ffprobe が必要です")
+class SmartCutTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='twitcas_smartcut_test_')
+        # 索引などのキャッシュも作業フォルダに作る
+        self.saved_cache_dir = app.CACHE_DIR
+        app.CACHE_DIR = os.path.join(self.work_dir, 'cache')
+        self.source = os.path.join(self.work_dir, 'source.mp4')
+        subprocess.run(['ffmpeg', '-y', '-v', 'error',
+                        '-f', 'lavfi',
+                        '-i', f"testsrc=size=320x240:rate={SOURCE_FPS}:duration={SMART_CUT_SOURCE_DURATION}",
+                        '-c:v', 'libx264', '-g', str(SMART_CUT_GOP), '-keyint_min', str(SMART_CUT_GOP),
+                        '-sc_threshold', '0', '-pix_fmt', 'yuv420p', self.source],
+                       check=True)
+
+    def tearDown(self):
+        app.CACHE_DIR = self.saved_cache_dir
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_concatenated_frame_count(self):
+        output = os.path.join(self.work_dir, 'cut.mp4')
+        editor = app.HeadlessVideoEditor({'source': self.source, 'smart_cut': True},
+                                         list(app.DEFAULT_ENCODER_OPTIONS))
+        self.assertTrue(editor.process_video_smart_cut(output, SMART_CUT_START, SMART_CUT_END, 'libx264'))
+
+        # 端の再エンコードとコピーした部分の継ぎ目でフレームが重複・欠落しないこと
+        times = probe_frame_times(output)
+        self.assertEqual(len(times), round((SMART_CUT_END - SMART_CUT_START) * SOURCE_FPS))
+        self.assertEqual(len(times), len(set(round(t * SOURCE_FPS) for t in times)))
+
+
+if __name__ == '__main__':
+    unittest.main()